@@ -1,18 +1,26 @@
 __version__ = "1.0.0"
 __author__ = "Acne Classification Team"
 
-from .model_loader import ModelLoader, load_models
-from .prediction import AcnePredictor, predict_image
-from .ingredient_recommendations import IngredientRecommender, get_ingredient_recommendations
-from .product_search import ProductSearcher, rag_search
+# Public names are resolved lazily so importing the package does not pull in
+# torch, transformers, insightface, pandas or openai until they are used
+_EXPORTS = {
+    'ModelLoader': '.model_loader',
+    'load_models': '.model_loader',
+    'AcnePredictor': '.prediction',
+    'predict_image': '.prediction',
+    'BatchingEngine': '.batching',
+    'IngredientRecommender': '.ingredient_recommendations',
+    'get_ingredient_recommendations': '.ingredient_recommendations',
+    'ProductSearcher': '.product_search',
+    'rag_search': '.product_search'
+}
 
-__all__ = [
-    'ModelLoader',
-    'load_models', 
-    'AcnePredictor',
-    'predict_image',
-    'IngredientRecommender',
-    'get_ingredient_recommendations',
-    'ProductSearcher',
-    'rag_search'
-]
\ No newline at end of file
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        import importlib
+        module = importlib.import_module(_EXPORTS[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,327 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+import numpy as np
+from .config import (
+    PRODUCT_TYPE_MAPPING,
+    EMBEDDING_INDEX_VERSION,
+    ANN_NLIST,
+    ANN_NPROBE,
+    ANN_TRAIN_SAMPLE
+)
+from .embedding_index import index_dir_for, normalize_rows
+
+ANN_DIR = "ann"
+ANN_META_FILE = "ann.json"
+PARTITION_ARRAYS = ('centroids', 'offsets', 'rows', 'vectors')
+
+
+def catalog_fingerprint(catalog):
+    # Fingerprint of the catalog rows and their types, so an ANN index built for another catalog is rejected
+    digest = hashlib.sha1()
+    for ingredients_hash, product_type in zip(catalog.content_hashes, catalog.product_types):
+        digest.update(f"{ingredients_hash}|{product_type}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def default_nlist(count):
+    # Roughly sqrt(n) inverted lists keeps list scans and centroid scoring balanced
+    return max(1, min(count, int(round(np.sqrt(count)))))
+
+
+class IvfPartition:
+    # Inverted-file index for one product type: vectors grouped contiguously by nearest centroid
+    def __init__(self, centroids, offsets, rows, vectors):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.rows = rows
+        self.vectors = vectors
+
+    @property
+    def count(self):
+        return len(self.rows)
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def train(cls, vectors, rows, nlist=0, train_sample=ANN_TRAIN_SAMPLE, seed=0):
+        # Cluster normalized vectors and lay each inverted list out contiguously
+        from sklearn.cluster import MiniBatchKMeans
+
+        vectors = normalize_rows(vectors)
+        nlist = min(nlist or default_nlist(len(vectors)), len(vectors))
+
+        # Train the coarse quantizer on a sample; assignment below covers every vector
+        rng = np.random.default_rng(seed)
+        sample = vectors
+        if len(vectors) > train_sample:
+            sample = vectors[rng.choice(len(vectors), train_sample, replace=False)]
+        kmeans = MiniBatchKMeans(n_clusters=nlist, random_state=seed, n_init=3, batch_size=4096)
+        kmeans.fit(sample)
+        return cls.from_centroids(normalize_rows(kmeans.cluster_centers_), vectors, rows)
+
+    @classmethod
+    def from_centroids(cls, centroids, vectors, rows):
+        # Assign vectors to existing centroids, e.g. after a catalog update, without re-clustering
+        vectors = normalize_rows(vectors)
+        rows = np.asarray(rows, dtype=np.int64)
+        nlist = len(centroids)
+
+        # Assign in chunks so large partitions do not need an n x nlist score matrix at once
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), 65536):
+            chunk = vectors[start:start + 65536]
+            assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+
+        order = np.argsort(assignments, kind='stable')
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=nlist), out=offsets[1:])
+        return cls(centroids, offsets, rows[order], np.ascontiguousarray(vectors[order]))
+
+    def search(self, query, k, nprobe=ANN_NPROBE):
+        # Score the nprobe closest lists only and return the top k catalog positions with scores
+        nprobe = max(1, min(nprobe, self.nlist))
+        coarse = self.centroids @ query
+        lists = np.argpartition(-coarse, nprobe - 1)[:nprobe]
+
+        # Each list is a contiguous slice, so scanning it is a sequential read of the mmap
+        positions, scores = [], []
+        for list_id in lists:
+            start, end = self.offsets[list_id], self.offsets[list_id + 1]
+            if end > start:
+                positions.append(np.arange(start, end))
+                scores.append(np.asarray(self.vectors[start:end] @ query, dtype=np.float32))
+        if not positions:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        positions = np.concatenate(positions)
+        scores = np.concatenate(scores)
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            positions, scores = positions[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        return self.rows[positions[order]], scores[order]
+
+    def scanned(self, nprobe=ANN_NPROBE):
+        # Expected fraction of the partition a query scans at this nprobe, for the benchmark
+        sizes = np.diff(self.offsets)
+        return min(1.0, float(np.mean(sizes)) * min(nprobe, self.nlist) / max(self.count, 1))
+
+    def save(self, path_prefix):
+        # Per-process temporary names, since several workers may write after the same catalog update
+        suffix = f"{os.getpid()}.tmp"
+        for name in PARTITION_ARRAYS:
+            with open(f"{path_prefix}.{name}.npy.{suffix}", 'wb') as f:
+                np.save(f, getattr(self, name))
+        for name in PARTITION_ARRAYS:
+            os.replace(f"{path_prefix}.{name}.npy.{suffix}", f"{path_prefix}.{name}.npy")
+
+    @classmethod
+    def load(cls, path_prefix):
+        # Read-only mmap so the lists are shared between worker processes
+        return cls(*(np.load(f"{path_prefix}.{name}.npy", mmap_mode='r') for name in PARTITION_ARRAYS))
+
+
+class AnnIndex:
+    # One IVF partition per PRODUCT_TYPE_MAPPING category
+    def __init__(self, partitions, meta):
+        self.partitions = partitions
+        self.meta = meta
+
+    def partition(self, category):
+        return self.partitions.get(category.lower())
+
+    @classmethod
+    def load(cls, provider, catalog, index_dir=None):
+        # Load the partitions from disk, returning None when missing or built for another catalog
+        logger = logging.getLogger(__name__)
+        ann_dir = os.path.join(index_dir or index_dir_for(provider), ANN_DIR)
+        meta_path = os.path.join(ann_dir, ANN_META_FILE)
+        if not os.path.exists(meta_path):
+            logger.info(f"ANN index not found: {ann_dir}; using exact search")
+            return None
+
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+
+        if (meta.get('version') != EMBEDDING_INDEX_VERSION
+                or meta.get('provider') != provider.provider
+                or meta.get('model') != provider.model
+                or meta.get('catalog') != catalog_fingerprint(catalog)):
+            logger.warning("ANN index does not match the catalog or embedding model; rebuild it")
+            return None
+
+        partitions = {
+            category: IvfPartition.load(os.path.join(ann_dir, category))
+            for category in meta['partitions']
+        }
+        logger.info(f"Loaded ANN index with {len(partitions)} partitions from {ann_dir}")
+        return cls(partitions, meta)
+
+
+def build_ann_index(catalog, index, embedding_rows, provider, nlist=ANN_NLIST, index_dir=None, previous=None):
+    # Train one IVF partition per product type from the embedding index and write it to disk;
+    # with a previous index its centroids are kept and only list membership is recomputed
+    logger = logging.getLogger(__name__)
+    ann_dir = os.path.join(index_dir or index_dir_for(provider), ANN_DIR)
+    os.makedirs(ann_dir, exist_ok=True)
+
+    partitions = {}
+    for category in PRODUCT_TYPE_MAPPING:
+        positions = catalog.rows_for(category)
+        if len(positions) == 0:
+            logger.warning(f"No products for {category}, skipping its partition")
+            continue
+        vectors = np.asarray(index.vectors[embedding_rows[positions]])
+        previous_partition = previous.partition(category) if previous is not None else None
+        if previous_partition is not None:
+            partition = IvfPartition.from_centroids(np.asarray(previous_partition.centroids), vectors, positions)
+        else:
+            partition = IvfPartition.train(vectors, positions, nlist=nlist)
+        partition.save(os.path.join(ann_dir, category))
+        partitions[category] = partition
+        logger.info(f"Built {category} partition: {partition.count} products in {partition.nlist} lists")
+
+    meta = {
+        'version': EMBEDDING_INDEX_VERSION,
+        'provider': provider.provider,
+        'model': provider.model,
+        'catalog': catalog_fingerprint(catalog),
+        'partitions': {
+            category: {'count': partition.count, 'nlist': partition.nlist}
+            for category, partition in partitions.items()
+        }
+    }
+    meta_path = os.path.join(ann_dir, ANN_META_FILE)
+    tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+    logger.info(f"ANN index written to {ann_dir}")
+    return AnnIndex(partitions, meta)
+
+
+def exact_search(vectors, rows, query, k):
+    # Brute-force top k by dot product, the reference the benchmark measures recall against
+    scores = np.asarray(vectors @ query, dtype=np.float32)
+    top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+    return rows[top[np.argsort(-scores[top], kind='stable')]]
+
+
+def benchmark_partition(partition, queries, k, nprobes):
+    # Recall@k and latency of ANN search against exact search over the same partition
+    exact_results, exact_ms = [], []
+    for query in queries:
+        began = time.perf_counter()
+        exact_results.append(set(exact_search(partition.vectors, partition.rows, query, k).tolist()))
+        exact_ms.append((time.perf_counter() - began) * 1000)
+
+    report = {
+        'count': partition.count,
+        'nlist': partition.nlist,
+        'exact_ms': {'mean': round(float(np.mean(exact_ms)), 4), 'p95': round(float(np.percentile(exact_ms, 95)), 4)},
+        'nprobe': {}
+    }
+    for nprobe in nprobes:
+        recalls, latencies_ms = [], []
+        for query, expected in zip(queries, exact_results):
+            began = time.perf_counter()
+            found, _ = partition.search(query, k, nprobe)
+            latencies_ms.append((time.perf_counter() - began) * 1000)
+            recalls.append(len(expected & set(found.tolist())) / max(len(expected), 1))
+        report['nprobe'][nprobe] = {
+            'recall_at_k': round(float(np.mean(recalls)), 4),
+            'mean_ms': round(float(np.mean(latencies_ms)), 4),
+            'p95_ms': round(float(np.percentile(latencies_ms, 95)), 4),
+            'speedup_vs_exact': round(float(np.mean(exact_ms) / np.mean(latencies_ms)), 2),
+            'scanned_fraction': round(partition.scanned(nprobe), 4)
+        }
+    return report
+
+
+def catalog_queries(searcher, count, seed=0):
+    # Queries shaped like rag_search's: two or three ingredient names from the catalog vocabulary
+    rng = np.random.default_rng(seed)
+    vocabulary = list(searcher.ingredient_index.vocabulary)
+    texts = [
+        ', '.join(rng.choice(vocabulary, size=rng.integers(2, 4), replace=False))
+        for _ in range(count)
+    ]
+    return normalize_rows(searcher.provider.embed(texts))
+
+
+def synthetic_vectors(centers, count, spread, rng):
+    # Points scattered around random cluster centers; spread is the noise norm relative to a center
+    dim = centers.shape[1]
+    labels = rng.integers(0, len(centers), size=count)
+    noise = rng.standard_normal((count, dim)).astype(np.float32) * (spread / np.sqrt(dim))
+    return normalize_rows(centers[labels] + noise)
+
+
+def synthetic_benchmark(count, dim, queries, k, nprobes, nlist=0, clusters=1024, seed=0):
+    # Benchmark a large clustered synthetic partition standing in for a multi-retailer catalog
+    rng = np.random.default_rng(seed)
+    centers = normalize_rows(rng.standard_normal((clusters, dim)))
+    partition = IvfPartition.train(synthetic_vectors(centers, count, 0.5, rng), np.arange(count), nlist=nlist)
+    return benchmark_partition(partition, synthetic_vectors(centers, queries, 0.7, rng), k, nprobes)
+
+
+def main(argv=None):
+    # Command-line entry point: python -m acne_classifier.ann_index {build,bench}
+    parser = argparse.ArgumentParser(description="Build or benchmark the per-category ANN product index")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="Train the IVF partitions from the embedding index")
+    build_parser.add_argument('--nlist', type=int, default=ANN_NLIST, help="Inverted lists per partition (0 = sqrt(n))")
+
+    bench_parser = subparsers.add_parser('bench', help="Report recall@k and latency against exact search")
+    bench_parser.add_argument('--k', type=int, default=10)
+    bench_parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    bench_parser.add_argument('--queries', type=int, default=200)
+    bench_parser.add_argument('--synthetic', type=int, help="Benchmark a synthetic partition of this many vectors instead")
+    bench_parser.add_argument('--dim', type=int, default=256, help="Vector size for --synthetic")
+    bench_parser.add_argument('--nlist', type=int, default=ANN_NLIST)
+    bench_parser.add_argument('--output', help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'bench' and args.synthetic:
+        report = {
+            'synthetic': synthetic_benchmark(args.synthetic, args.dim, args.queries, args.k, args.nprobe, nlist=args.nlist)
+        }
+    else:
+        from .product_search import ProductSearcher
+
+        searcher = ProductSearcher()
+        if searcher.index is None:
+            raise SystemExit("Embedding index not available; build it with python -m acne_classifier.embedding_index")
+
+        if args.command == 'build':
+            build_ann_index(searcher.catalog, searcher.index, searcher.embedding_rows, searcher.provider, nlist=args.nlist)
+            return
+
+        ann = searcher.ann
+        if ann is None:
+            raise SystemExit("ANN index not available; build it with python -m acne_classifier.ann_index build")
+        queries = catalog_queries(searcher, args.queries)
+        report = {
+            category: benchmark_partition(partition, queries, args.k, args.nprobe)
+            for category, partition in ann.partitions.items()
+        }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from .config import (
+    RECOMMENDATION_TIMEOUT,
+    SEARCH_TIMEOUT,
+    DAILY_PLAN_TIMEOUT,
+    PIPELINE_TIMEOUT
+)
+from .ingredient_recommendations import get_ingredient_recommendations_async
+from .metrics import metrics
+from .openai_client import openai_client
+
+
+class AsyncPipeline:
+    # Runs the remote stages after classification concurrently on a shared event loop
+    def __init__(self, recommender, searcher,
+                 recommendation_timeout=RECOMMENDATION_TIMEOUT,
+                 search_timeout=SEARCH_TIMEOUT,
+                 daily_plan_timeout=DAILY_PLAN_TIMEOUT,
+                 pipeline_timeout=PIPELINE_TIMEOUT):
+        self.recommender = recommender
+        self.searcher = searcher
+        self.recommendation_timeout = recommendation_timeout
+        self.search_timeout = search_timeout
+        self.daily_plan_timeout = daily_plan_timeout
+        self.pipeline_timeout = pipeline_timeout
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._pid = None
+
+    def _ensure_loop(self):
+        # Start the loop thread lazily, and again after a fork since threads do not survive it
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name="async-pipeline",
+                    daemon=True
+                )
+                self._thread.start()
+                self._pid = os.getpid()
+            return self._loop
+
+    def _get_client(self):
+        # The shared OpenAIClient; its async pool lives on the pipeline's loop and is reused across requests
+        return openai_client if openai_client.available else None
+
+    def close(self):
+        # Stop the event loop thread
+        with self._lock:
+            if self._loop is not None and self._pid == os.getpid():
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join()
+            self._loop = None
+
+    @staticmethod
+    def empty_result():
+        return {
+            'recommendations': None,
+            'products': {},
+            'daily_plan': None,
+            'timed_out': []
+        }
+
+    def run(self, severity):
+        # Blocking entry point for sync callers such as the Flask route
+        loop = self._ensure_loop()
+        result = self.empty_result()
+        future = asyncio.run_coroutine_threadsafe(self.run_async(severity, result), loop)
+        try:
+            future.result(timeout=self.pipeline_timeout)
+        except FutureTimeoutError:
+            # Cancel whatever is still running and hand back what finished
+            future.cancel()
+            self.logger.warning(f"Pipeline exceeded {self.pipeline_timeout}s, returning partial results")
+            metrics.inc('acne_stage_timeouts_total', stage='pipeline')
+
+            # Snapshot so the cancelled coroutine cannot mutate what the caller receives
+            result = dict(
+                result,
+                products=dict(result['products']),
+                timed_out=result['timed_out'] + ['pipeline']
+            )
+        return result
+
+    def stream(self, severity):
+        # Blocking generator for sync callers: yields (event, data) pairs as the stages finish
+        loop = self._ensure_loop()
+        events = queue.Queue()
+        
+        async def pump():
+            try:
+                async for event in self.stream_async(severity):
+                    events.put(event)
+            except Exception as e:
+                self.logger.error(f"Streaming pipeline failed: {e}")
+                events.put(('error', 'Pipeline failed'))
+            finally:
+                events.put(None)
+        
+        future = asyncio.run_coroutine_threadsafe(pump(), loop)
+        deadline = time.monotonic() + self.pipeline_timeout
+        try:
+            while True:
+                try:
+                    event = events.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    self.logger.warning(f"Pipeline exceeded {self.pipeline_timeout}s, ending stream")
+                    metrics.inc('acne_stage_timeouts_total', stage='pipeline')
+                    yield ('timeout', 'pipeline')
+                    return
+                if event is None:
+                    return
+                yield event
+        finally:
+            # Also reached when the client disconnects, so remaining remote calls are cancelled
+            future.cancel()
+    
+    async def stream_async(self, severity):
+        # Same stages as run_async, yielding each result as soon as it is ready:
+        # ('recommendations', text), ('products', (category, products)) per finished search,
+        # ('daily_plan', text delta) per streamed chunk, ('timeout', stage) and ('error', message)
+        result = self.empty_result()
+        client = self._get_client()
+        
+        recommendations = await self._stage(
+            'recommendations',
+            get_ingredient_recommendations_async(severity, client),
+            self.recommendation_timeout,
+            result
+        )
+        if recommendations is None:
+            yield ('timeout', 'recommendations')
+            return
+        if recommendations.startswith("Error"):
+            yield ('error', 'Recommendation failed')
+            return
+        yield ('recommendations', recommendations)
+        
+        # Start every category search at once and report them in completion order
+        async def search(category, ingredients):
+            await self._search(category, ingredients, client, result)
+            return category
+        
+        parsed = self.recommender.parse_recommendations(recommendations)
+        searches = [asyncio.ensure_future(search(category, ingredients)) for category, ingredients in parsed.items()]
+        try:
+            for finished in asyncio.as_completed(searches):
+                category = await finished
+                if f'search:{category}' in result['timed_out']:
+                    yield ('timeout', f'search:{category}')
+                yield ('products', (category, result['products'][category]))
+        finally:
+            for task in searches:
+                task.cancel()
+        
+        # Forward the plan chunk by chunk, bounded by the daily plan timeout as a whole
+        plan = self.recommender.stream_daily_plan_async(severity, recommendations, result['products'], client)
+        deadline = asyncio.get_running_loop().time() + self.daily_plan_timeout
+        try:
+            while True:
+                remaining = deadline - asyncio.get_running_loop().time()
+                delta = await asyncio.wait_for(plan.__anext__(), max(remaining, 0))
+                yield ('daily_plan', delta)
+        except StopAsyncIteration:
+            pass
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Stage 'daily_plan' timed out after {self.daily_plan_timeout}s")
+            metrics.inc('acne_stage_timeouts_total', stage='daily_plan')
+            yield ('timeout', 'daily_plan')
+        finally:
+            await plan.aclose()
+    
+    async def run_async(self, severity, result=None):
+        # Recommendations, then all category searches at once, then the daily plan
+        if result is None:
+            result = self.empty_result()
+        client = self._get_client()
+
+        recommendations = await self._stage(
+            'recommendations',
+            get_ingredient_recommendations_async(severity, client),
+            self.recommendation_timeout,
+            result
+        )
+        if recommendations is None or recommendations.startswith("Error"):
+            result['recommendations'] = recommendations
+            return result
+        result['recommendations'] = recommendations
+
+        # Run every category search concurrently; each has its own timeout
+        parsed = self.recommender.parse_recommendations(recommendations)
+        await asyncio.gather(*(
+            self._search(category, ingredients, client, result)
+            for category, ingredients in parsed.items()
+        ))
+
+        result['daily_plan'] = await self._stage(
+            'daily_plan',
+            self.recommender.generate_daily_plan_async(severity, recommendations, result['products'], client),
+            self.daily_plan_timeout,
+            result
+        )
+        return result
+
+    async def _search(self, category, ingredients, client, result):
+        # Search one category, recording an empty list on failure or timeout
+        result['products'][category] = []
+        if not ingredients:
+            self.logger.warning(f"No ingredients provided for {category}")
+            return
+        products = await self._stage(
+            f'search:{category}',
+            self.searcher.rag_search_async(ingredients, category, client),
+            self.search_timeout,
+            result
+        )
+        if products is not None:
+            result['products'][category] = products
+
+    async def _stage(self, name, coroutine, timeout, result):
+        # Await a stage with a timeout; the stage is cancelled and None returned if it runs over
+        try:
+            return await asyncio.wait_for(coroutine, timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Stage '{name}' timed out after {timeout}s")
+            result['timed_out'].append(name)
+            metrics.inc('acne_stage_timeouts_total', stage=name.split(':')[0])
+            return None
@@ -0,0 +1,294 @@
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import time
+from pathlib import Path
+import numpy as np
+from .prediction import decode_image_bytes, detect_face
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+
+# Per-process state for the decode/detect pool, set by _init_pool_worker
+_face_app = None
+_processor = None
+
+
+def collect_inputs(source):
+    # Image paths from a directory (recursive) or a manifest (.txt one path per line, .csv with a path column)
+    source = Path(source)
+    if source.is_dir():
+        return [
+            str(path) for path in sorted(source.rglob('*'))
+            if path.suffix.lower() in IMAGE_EXTENSIONS
+        ]
+
+    base = source.parent
+    with open(source, 'r', newline='') as f:
+        if source.suffix.lower() == '.csv':
+            reader = csv.DictReader(f)
+            column = 'path' if 'path' in reader.fieldnames else reader.fieldnames[0]
+            entries = [row[column] for row in reader]
+        else:
+            entries = [line.strip() for line in f]
+
+    # Relative manifest entries are resolved against the manifest's folder
+    return [str(base / entry) if not os.path.isabs(entry) else entry for entry in entries if entry]
+
+
+def _init_pool_worker(processor, threads):
+    # Load a face detector per pool process; the ViT stays in the parent
+    global _face_app, _processor
+    from .model_loader import ModelLoader
+
+    logging.getLogger().setLevel(logging.WARNING)
+    _face_app = ModelLoader().load_face_detection(intra_op_threads=threads)
+    _processor = processor
+
+
+def _prepare(path):
+    # Decode, detect and crop one image in a pool process; the uint8 crop is 4x smaller to ship than floats
+    try:
+        with open(path, 'rb') as f:
+            img_rgb = decode_image_bytes(f.read())
+        bbox = detect_face(img_rgb, _face_app)
+        if isinstance(bbox, dict):
+            return {'path': path, 'error': bbox['error']}
+        crop = np.ascontiguousarray(_processor.crop_resize(img_rgb, bbox))
+        return {'path': path, 'crop': crop, 'bbox': [int(v) for v in bbox]}
+    except FileNotFoundError:
+        return {'path': path, 'error': 'Image file not found'}
+    except Exception as e:
+        return {'path': path, 'error': f'Prediction failed: {str(e)}'}
+
+
+def make_record(path, prediction=None, bbox=None, error=None):
+    # One output row; the same fields are written to JSONL and Parquet
+    if prediction is None:
+        return {
+            'path': path, 'severity': None, 'predicted_label': None, 'predicted_class_id': None,
+            'confidence': None, 'probabilities': None, 'bbox': bbox, 'error': error
+        }
+    return {
+        'path': path,
+        'severity': prediction['severity'],
+        'predicted_label': prediction['predicted_label'],
+        'predicted_class_id': int(prediction['predicted_class_id']),
+        'confidence': float(prediction['confidence']),
+        'probabilities': [float(p) for p in prediction['probabilities']],
+        'bbox': bbox,
+        'error': None
+    }
+
+
+class JsonlWriter:
+    # Appends one JSON object per line; every complete line marks an image as done
+    def __init__(self, path, fresh=False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._truncate_partial_line()
+        self.file = open(self.path, 'w' if fresh else 'a')
+
+    def _truncate_partial_line(self):
+        # A crash mid-write can leave half a line; drop it so appended lines stay parseable
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def completed(self):
+        # Paths already written by earlier runs
+        done = set()
+        if self.path.exists():
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        done.add(json.loads(line)['path'])
+                    except (ValueError, KeyError):
+                        continue
+        return done
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+
+    def checkpoint(self):
+        # Make everything written so far durable
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.checkpoint()
+        self.file.close()
+
+
+class ParquetWriter:
+    # Buffers records and writes one part file per checkpoint into an output directory
+    def __init__(self, path, fresh=False):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet output needs pyarrow (pip install pyarrow), or write .jsonl instead")
+        self.pa, self.pq = pa, pq
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        if fresh:
+            for part in self._parts():
+                part.unlink()
+        self.records = []
+        self.schema = pa.schema([
+            ('path', pa.string()),
+            ('severity', pa.string()),
+            ('predicted_label', pa.string()),
+            ('predicted_class_id', pa.int64()),
+            ('confidence', pa.float64()),
+            ('probabilities', pa.list_(pa.float64())),
+            ('bbox', pa.list_(pa.int64())),
+            ('error', pa.string())
+        ])
+
+    def _parts(self):
+        return sorted(self.path.glob('part-*.parquet'))
+
+    def completed(self):
+        done = set()
+        for part in self._parts():
+            done.update(self.pq.read_table(part, columns=['path']).column('path').to_pylist())
+        return done
+
+    def write(self, record):
+        self.records.append(record)
+
+    def checkpoint(self):
+        # Write the buffered records as a new part under a temporary name, then rename it into place
+        if not self.records:
+            return
+        parts = self._parts()
+        index = int(parts[-1].stem.split('-')[1]) + 1 if parts else 0
+        part = self.path / f"part-{index:05d}.parquet"
+        table = self.pa.Table.from_pylist(self.records, schema=self.schema)
+        self.pq.write_table(table, str(part) + '.tmp')
+        os.replace(str(part) + '.tmp', part)
+        self.records = []
+
+    def close(self):
+        self.checkpoint()
+
+
+def open_writer(output, fresh=False):
+    # Parquet for a .parquet path (written as a directory of parts), JSONL otherwise; fresh discards old results
+    if str(output).endswith('.parquet'):
+        return ParquetWriter(output, fresh)
+    return JsonlWriter(output, fresh)
+
+
+def run_batch(source, output, workers=None, batch_size=32, checkpoint_every=500, model_threads=None, resume=True):
+    # Classify every image under source, resuming from whatever output already holds
+    from .model_loader import ModelLoader, set_thread_count
+    from .prediction import AcnePredictor
+
+    logger = logging.getLogger(__name__)
+    cpus = os.cpu_count() or 1
+    workers = workers or max(1, cpus - 1)
+    set_thread_count(model_threads or max(1, cpus - workers))
+
+    paths = collect_inputs(source)
+    writer = open_writer(output, fresh=not resume)
+    done = writer.completed()
+    pending = [path for path in paths if path not in done]
+    logger.info(f"{len(paths)} images, {len(paths) - len(pending)} already done, {len(pending)} to process")
+    if not pending:
+        writer.close()
+        return {'total': len(paths), 'processed': 0, 'failed': 0, 'skipped': len(paths)}
+
+    loader = ModelLoader()
+    model, processor = loader.load_acne_model()
+    predictor = AcnePredictor(model, processor, None, loader.model_config_dict)
+
+    batch = []
+    counts = {'processed': 0, 'failed': 0}
+    since_checkpoint = 0
+    started = time.perf_counter()
+
+    def flush():
+        # Normalize the crops into one tensor and classify them with a single forward pass
+        if not batch:
+            return
+        pixel_values = processor.preprocess_batch([item['crop'] for item in batch])
+        for item, prediction in zip(batch, predictor.classify(pixel_values)):
+            writer.write(make_record(item['path'], prediction, item['bbox']))
+        batch.clear()
+
+    # Spawned processes only import the light decode/detect path, never torch
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, initializer=_init_pool_worker, initargs=(processor, 1)) as pool:
+        for item in pool.imap_unordered(_prepare, pending, chunksize=4):
+            if 'error' in item:
+                writer.write(make_record(item['path'], error=item['error']))
+                counts['failed'] += 1
+            else:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    flush()
+            counts['processed'] += 1
+            since_checkpoint += 1
+
+            if since_checkpoint >= checkpoint_every:
+                # Only checkpoint whole batches, so every record before the checkpoint is on disk
+                flush()
+                writer.checkpoint()
+                since_checkpoint = 0
+                rate = counts['processed'] / (time.perf_counter() - started)
+                remaining = (len(pending) - counts['processed']) / rate if rate else 0
+                logger.info(
+                    f"Checkpoint: {counts['processed']}/{len(pending)} images "
+                    f"({rate:.1f} img/s, ~{remaining / 60:.1f} min left, {counts['failed']} without a usable face)"
+                )
+
+        flush()
+    writer.close()
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        'total': len(paths),
+        'skipped': len(paths) - len(pending),
+        'processed': counts['processed'],
+        'failed': counts['failed'],
+        'seconds': round(elapsed, 1),
+        'images_per_s': round(counts['processed'] / elapsed, 2) if elapsed else None
+    }
+    logger.info(f"Batch classification finished: {summary}")
+    return summary
+
+
+def main(argv=None):
+    # Command-line entry point: python -m acne_classifier.batch_classify <dir|manifest> --output results.jsonl
+    parser = argparse.ArgumentParser(description="Classify acne severity for a directory or manifest of images")
+    parser.add_argument('source', help="Image directory (searched recursively) or a .txt/.csv manifest of paths")
+    parser.add_argument('--output', required=True, help="Results file: .jsonl, or .parquet (a directory of parts)")
+    parser.add_argument('--workers', type=int, help="Decode/detect processes (default: cores - 1)")
+    parser.add_argument('--batch-size', type=int, default=32, help="Faces per ViT forward pass")
+    parser.add_argument('--checkpoint-every', type=int, default=500, help="Images between durable checkpoints")
+    parser.add_argument('--model-threads', type=int, help="Torch threads for classification (default: cores - workers)")
+    parser.add_argument('--no-resume', action='store_true', help="Reprocess images already in the output")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    summary = run_batch(
+        args.source,
+        args.output,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        checkpoint_every=args.checkpoint_every,
+        model_threads=args.model_threads,
+        resume=not args.no_resume
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
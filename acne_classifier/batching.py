@@ -0,0 +1,155 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from .config import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
+from .metrics import BATCH_SIZE_BUCKETS, metrics, span
+from .prediction import classify_faces
+
+
+class BatchingEngine:
+    # Collects preprocessed faces from concurrent requests and classifies them in batched forward passes
+    def __init__(self, model, model_config_dict,
+                 max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self.model = model
+        self.model_config_dict = model_config_dict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.logger = logging.getLogger(__name__)
+
+        self._queue = queue.Queue()
+        self._buffer = None
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._items = 0
+        self._total_forward_time = 0.0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        # Start the background scheduler thread
+        if self._running:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="batching-engine", daemon=True)
+        self._thread.start()
+        self.logger.info(
+            f"Batching engine started (max_batch_size={self.max_batch_size}, "
+            f"max_wait_ms={self.max_wait * 1000:.1f})"
+        )
+        return self
+
+    def stop(self):
+        # Stop the scheduler after it drains the current batch
+        if not self._running:
+            return
+        self._running = False
+        self._queue.put(None)
+        self._thread.join()
+
+        # Fail anything that was queued behind the stop request
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[1].set_exception(RuntimeError("Batching engine stopped"))
+        self.logger.info("Batching engine stopped")
+
+    def submit(self, pixel_values):
+        # Queue a preprocessed (3, H, W) face tensor and return a future for its prediction
+        if not self._running:
+            raise RuntimeError("Batching engine is not running")
+        future = Future()
+        self._queue.put((pixel_values, future))
+        return future
+
+    def classify(self, pixel_values, timeout=None):
+        # Queue a preprocessed face tensor and block until its prediction is ready
+        return self.submit(pixel_values).result(timeout=timeout)
+
+    def stats(self):
+        # Queue depth and batch-size distribution for tuning latency against throughput
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                'queue_depth': self._queue.qsize(),
+                'batches': batches,
+                'items': self._items,
+                'mean_batch_size': round(self._items / batches, 3) if batches else 0.0,
+                'max_batch_size': max(self._batch_sizes) if batches else 0,
+                'batch_size_histogram': dict(sorted(self._batch_sizes.items())),
+                'mean_forward_ms': round(self._total_forward_time / batches * 1000, 3) if batches else 0.0,
+                'config': {
+                    'max_batch_size': self.max_batch_size,
+                    'max_wait_ms': self.max_wait * 1000
+                }
+            }
+
+    def _collect_batch(self):
+        # Block for the first item, then gather more until the batch is full or the wait window closes
+        item = self._queue.get()
+        if item is None:
+            return []
+
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Re-queue the stop sentinel so the loop exits after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _stack(self, faces):
+        # Copy queued faces into a reused contiguous batch buffer
+        import torch
+
+        if self._buffer is None or self._buffer.shape[1:] != faces[0].shape:
+            self._buffer = torch.empty((self.max_batch_size,) + tuple(faces[0].shape), dtype=torch.float32)
+        return torch.stack(faces, out=self._buffer[:len(faces)])
+
+    def _run(self):
+        # Scheduler loop: one batched forward per collected batch
+        while self._running:
+            batch = self._collect_batch()
+            if not batch:
+                continue
+
+            faces = [pixel_values for pixel_values, _ in batch]
+            futures = [future for _, future in batch]
+
+            start = time.perf_counter()
+            metrics.observe('acne_batch_size', len(batch), buckets=BATCH_SIZE_BUCKETS)
+            try:
+                with span('batch_forward'):
+                    results = classify_faces(
+                        self._stack(faces),
+                        self.model,
+                        self.model_config_dict
+                    )
+            except Exception as e:
+                self.logger.error(f"Batched inference failed: {str(e)}")
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            elapsed = time.perf_counter() - start
+
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] += 1
+                self._items += len(batch)
+                self._total_forward_time += elapsed
@@ -0,0 +1,415 @@
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+
+BASELINE_VERSION = 1
+DEFAULT_BASELINE = str(Path(__file__).resolve().parent.parent / 'benchmarks' / 'baseline.json')
+STAGE_GROUPS = ('predict', 'search', 'llm')
+
+# Fallback ingredient pool for synthetic catalogs when the real catalog is missing
+SYNTHETIC_INGREDIENTS = [
+    'Aqua (Water)', 'Glycerin', 'Niacinamide', 'Salicylic Acid', 'Glycolic Acid', 'Lactic Acid',
+    'Hyaluronic Acid', 'Sodium Hyaluronate', 'Ceramide NP', 'Squalane', 'Panthenol', 'Allantoin',
+    'Butylene Glycol', 'Caprylic/Capric Triglyceride', 'Cetearyl Alcohol', 'Dimethicone', 'Tocopherol',
+    'Phenoxyethanol', 'Ethylhexylglycerin', 'Sodium Benzoate', 'Citric Acid', 'Xanthan Gum',
+    'Benzoyl Peroxide', 'Azelaic Acid', 'Mandelic Acid', 'Zinc PCA', 'Centella Asiatica Extract',
+    'Cocamidopropyl Betaine', 'Sodium Laureth Sulfate', 'Parfum (Fragrance)'
+]
+
+
+def synthetic_face(width=640, height=480, seed=0):
+    # A drawn face on a noisy background: skin-toned oval, eyes, brows, nose, mouth and a few red spots
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:] = rng.integers(40, 90, size=3)
+    img = cv2.add(img, rng.integers(0, 25, size=img.shape, dtype=np.uint8))
+
+    cx, cy = width // 2, height // 2
+    fw, fh = int(min(width, height) * 0.28), int(min(width, height) * 0.38)
+    skin = tuple(int(v) for v in rng.integers([170, 120, 100], [230, 180, 150]))
+    cv2.ellipse(img, (cx, cy), (fw, fh), 0, 0, 360, skin, -1)
+    for side in (-1, 1):
+        eye = (cx + side * fw // 2, cy - fh // 5)
+        cv2.ellipse(img, eye, (fw // 6, fh // 14), 0, 0, 360, (245, 245, 245), -1)
+        cv2.circle(img, eye, fh // 18, (60, 40, 30), -1)
+        cv2.line(img, (eye[0] - fw // 5, eye[1] - fh // 7), (eye[0] + fw // 5, eye[1] - fh // 6), (70, 50, 40), 3)
+    cv2.line(img, (cx, cy - fh // 10), (cx - fw // 10, cy + fh // 5), (150, 100, 80), 2)
+    cv2.ellipse(img, (cx, cy + fh // 2), (fw // 3, fh // 10), 0, 0, 180, (160, 60, 60), 3)
+
+    # Blemishes so the crop is not a flat colour
+    for _ in range(rng.integers(5, 30)):
+        x = int(cx + rng.normal(0, fw / 2.5))
+        y = int(cy + rng.normal(0, fh / 2.5))
+        cv2.circle(img, (x, y), int(rng.integers(2, 6)), (200, 70, 70), -1)
+    return img
+
+
+def encode_jpeg(img_rgb, quality=90):
+    # JPEG bytes as they would arrive in an upload
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.fromarray(img_rgb).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def synthetic_catalog(size, path, source=None, seed=0):
+    # Scale the real catalog up to size rows by resampling products and perturbing their ingredient lists,
+    # so content hashes stay distinct; falls back to a generated catalog when no source is available
+    import pandas as pd
+    from .config import PRODUCT_TYPE_MAPPING
+    from .ingredient_index import split_ingredients
+
+    rng = np.random.default_rng(seed)
+    if source is not None and os.path.exists(source):
+        base = pd.read_csv(source).dropna(subset=['ingredients', 'product_type'])
+    else:
+        types = list(PRODUCT_TYPE_MAPPING.values())
+        base = pd.DataFrame({
+            'product_name': [f"Product {i}" for i in range(300)],
+            'product_url': [f"https://example.com/product/{i}" for i in range(300)],
+            'product_type': [types[i % len(types)] for i in range(300)],
+            'ingredients': [
+                ', '.join(rng.choice(SYNTHETIC_INGREDIENTS, size=12, replace=False)) for _ in range(300)
+            ],
+            'price': [f"£{rng.uniform(5, 60):.2f}" for _ in range(300)]
+        })
+
+    pool = sorted({name for text in base['ingredients'] for name in split_ingredients(text)} | set(SYNTHETIC_INGREDIENTS))
+    picks = rng.integers(0, len(base), size=size)
+    rows = base.iloc[picks].reset_index(drop=True).copy()
+
+    # Drop one ingredient and add another from the pool per product
+    ingredients = []
+    for text in rows['ingredients']:
+        names = split_ingredients(text)
+        if len(names) > 1:
+            names.pop(int(rng.integers(len(names))))
+        names.insert(int(rng.integers(len(names) + 1)), pool[int(rng.integers(len(pool)))])
+        ingredients.append(', '.join(names))
+    rows['ingredients'] = ingredients
+    rows['product_name'] = [f"{name} #{i}" for i, name in enumerate(rows['product_name'])]
+    rows.to_csv(path, index=False)
+    return path
+
+
+def summarize(timings):
+    # Latency summary in milliseconds for one stage
+    timings = sorted(timings)
+    return {
+        'runs': len(timings),
+        'median_ms': round(statistics.median(timings) * 1000, 4),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 4),
+        'mean_ms': round(statistics.fmean(timings) * 1000, 4),
+        'min_ms': round(timings[0] * 1000, 4)
+    }
+
+
+def time_stage(fn, repeat, warmup=1):
+    # Call fn warmup + repeat times and summarize the timed calls
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - began)
+    return summarize(timings)
+
+
+def bench_predict(results, repeat, image_size, batch_size, seed=0):
+    # Each stage of predict_image on synthetic faces: decode, detection, preprocessing, forward pass
+    from .model_loader import ModelLoader
+    from .prediction import AcnePredictor, classify_faces, decode_image_bytes, detect_face
+
+    logger = logging.getLogger(__name__)
+    loader = ModelLoader()
+    try:
+        model, processor = loader.load_acne_model()
+        face_app = loader.load_face_detection()
+    except Exception as e:
+        logger.error(f"Skipping predict stages, models could not be loaded: {e}")
+        results['skipped']['predict'] = str(e)
+        return
+    config = loader.model_config_dict
+
+    width, height = image_size
+    img_rgb = synthetic_face(width, height, seed)
+    image_bytes = encode_jpeg(img_rgb)
+    decoded = decode_image_bytes(image_bytes)
+
+    # A drawn face is not always detected; fall back to a centred box so later stages still run
+    bbox = detect_face(decoded, face_app)
+    if isinstance(bbox, dict):
+        logger.warning("No face detected in the synthetic image, benchmarking with a centred crop")
+        h, w = decoded.shape[:2]
+        bbox = (w // 4, h // 8, 3 * w // 4, 7 * h // 8)
+    pixel_values = processor.preprocess(decoded, bbox)
+    batch = processor.preprocess_batch([decoded] * batch_size, [bbox] * batch_size)
+    predictor = AcnePredictor(model, processor, face_app, config)
+
+    stages = results['stages']
+    stages['predict.decode'] = time_stage(lambda: decode_image_bytes(image_bytes), repeat)
+    stages['predict.detect'] = time_stage(lambda: detect_face(decoded, face_app), repeat)
+    stages['predict.preprocess'] = time_stage(lambda: processor.preprocess(decoded, bbox), repeat)
+    stages['predict.forward'] = time_stage(lambda: classify_faces(pixel_values, model, config), repeat)
+    stages[f'predict.forward_batch{batch_size}'] = time_stage(lambda: classify_faces(batch, model, config), repeat)
+    stages['predict.end_to_end'] = time_stage(lambda: predictor.predict(image_bytes), repeat)
+
+
+def bench_search(results, repeat, catalog_sizes, workdir, fake_server, seed=0):
+    # ProductSearcher stages per synthetic catalog size through its public API: query embedding, one category
+    # search with and without the simulated network latency, and the search across every category
+    from .ann_index import build_ann_index
+    from .catalog import ProductCatalog
+    from .config import SKINCARE_DATA_PATH
+    from .embedding_index import build_index, index_dir_for
+    from .embeddings import get_embedding_provider
+    from .product_search import ProductSearcher
+
+    logger = logging.getLogger(__name__)
+    stages = results['stages']
+    targets = {
+        'cleanser': ['Salicylic Acid'],
+        'moisturizer': ['Niacinamide'],
+        'exfoliator': ['Glycolic Acid']
+    }
+
+    for size in catalog_sizes:
+        path = synthetic_catalog(size, os.path.join(workdir, f"catalog_{size}.csv"), SKINCARE_DATA_PATH, seed)
+
+        # Index building is setup, not a measured stage, so it runs without the simulated latency
+        latency, fake_server.latency = fake_server.latency, 0.0
+        provider = get_embedding_provider()
+        index_root = os.path.join(workdir, f"index_{size}")
+        build_index(ProductCatalog.from_csv(path), provider, index_dir_for(provider, index_root))
+        searcher = ProductSearcher(data_path=path, index_root=index_root, provider=provider)
+        state = searcher.state
+        if state.index is not None and state.ann is None:
+            state.ann = build_ann_index(
+                state.catalog, state.index, state.embedding_rows, searcher.provider, index_dir=searcher.index_dir
+            )
+        fake_server.latency = latency
+        logger.info(f"Benchmarking search over {len(state.catalog)} products")
+
+        category, ingredients = 'cleanser', targets['cleanser']
+        query = ', '.join(ingredients)
+
+        stages[f'search.embed_query@{size}'] = time_stage(lambda: searcher.provider.embed([query]), repeat)
+        stages[f'search.rag_search@{size}'] = time_stage(lambda: searcher.rag_search(ingredients, category), repeat)
+
+        # Without the simulated latency the query embedding is a local round trip, so filtering, similarity
+        # and ranking make up most of this stage
+        fake_server.latency = 0.0
+        stages[f'search.rag_search_local@{size}'] = time_stage(lambda: searcher.rag_search(ingredients, category), repeat)
+        fake_server.latency = latency
+        stages[f'search.all_categories@{size}'] = time_stage(lambda: searcher.search_all_categories(targets), repeat)
+
+
+def bench_llm(results, repeat):
+    # IngredientRecommender calls against the fake server: recommendations, parsing, full and streamed plans
+    import asyncio
+    from .ingredient_recommendations import IngredientRecommender, get_ingredient_recommendations
+
+    recommender = IngredientRecommender()
+    severity = 'moderate'
+    text = get_ingredient_recommendations(severity)
+    parsed = recommender.parse_recommendations(text)
+    products = {category: [] for category in parsed}
+
+    stages = results['stages']
+    stages['llm.recommendations'] = time_stage(lambda: get_ingredient_recommendations(severity), repeat)
+    stages['llm.parse'] = time_stage(lambda: recommender.parse_recommendations(text), repeat)
+    stages['llm.daily_plan'] = time_stage(lambda: recommender.generate_daily_plan(severity, text, products), repeat)
+
+    async def streamed():
+        # Time to the first plan token and to the whole plan over the shared pooled client
+        from .openai_client import openai_client as client
+
+        first, total = [], []
+        for run in range(repeat + 1):
+            began = time.perf_counter()
+            first_token = None
+            async for _ in recommender.stream_daily_plan_async(severity, text, products, client):
+                if first_token is None:
+                    first_token = time.perf_counter() - began
+            if run:
+                first.append(first_token)
+                total.append(time.perf_counter() - began)
+        return first, total
+
+    first, total = asyncio.run(streamed())
+    stages['llm.daily_plan_first_token'] = summarize(first)
+    stages['llm.daily_plan_stream'] = summarize(total)
+
+
+def environment():
+    # Where the numbers came from; comparisons across different machines are flagged
+    import torch
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'torch': torch.__version__,
+        'torch_threads': torch.get_num_threads()
+    }
+
+
+def compare(current, baseline, threshold, min_delta_ms):
+    # Median latency change per stage; a stage regresses when it is slower by more than threshold and min_delta_ms
+    rows = []
+    for stage, stats in current['stages'].items():
+        before = baseline['stages'].get(stage)
+        if before is None:
+            rows.append({'stage': stage, 'baseline_ms': None, 'current_ms': stats['median_ms'], 'change': None, 'regression': False})
+            continue
+        change = stats['median_ms'] / before['median_ms'] - 1 if before['median_ms'] else 0.0
+        regression = change > threshold and stats['median_ms'] - before['median_ms'] > min_delta_ms
+        rows.append({
+            'stage': stage,
+            'baseline_ms': before['median_ms'],
+            'current_ms': stats['median_ms'],
+            'change': round(change, 4),
+            'regression': regression
+        })
+    return rows
+
+
+def format_comparison(rows):
+    lines = [f"{'stage':<36} {'baseline':>12} {'current':>12} {'change':>9}"]
+    for row in rows:
+        baseline = f"{row['baseline_ms']:.3f} ms" if row['baseline_ms'] is not None else 'new'
+        change = f"{row['change'] * 100:+.1f}%" if row['change'] is not None else ''
+        flag = '  REGRESSION' if row['regression'] else ''
+        lines.append(f"{row['stage']:<36} {baseline:>12} {row['current_ms']:>9.3f} ms {change:>9}{flag}")
+    return '\n'.join(lines)
+
+
+def run_benchmarks(groups=STAGE_GROUPS, repeat=20, image_size=(640, 480), batch_size=8,
+                   catalog_sizes=(1000, 10000), latency=0.05, token_latency=0.005, seed=0):
+    # Run the selected stage groups against a local fake OpenAI server and return the results document;
+    # the environment is restored afterwards
+    saved_environ = dict(os.environ)
+    try:
+        return _run_benchmarks(groups, repeat, image_size, batch_size, catalog_sizes, latency, token_latency, seed)
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_environ)
+
+
+def _run_benchmarks(groups, repeat, image_size, batch_size, catalog_sizes, latency, token_latency, seed):
+    from .fake_openai import FakeOpenAIServer
+
+    # Point every OpenAI client at the fake server and bypass the response cache, before config is imported
+    os.environ['OPENAI_API_KEY'] = 'benchmark'
+    os.environ['LLM_CACHE_ENABLED'] = 'false'
+    os.environ.setdefault('EMBEDDING_PROVIDER', 'openai')
+    os.environ['CATALOG_RELOAD_INTERVAL'] = '0'
+    config = sys.modules.get('acne_classifier.config')
+    if config is not None and (config.OPENAI_API_KEY != 'benchmark' or config.LLM_CACHE_ENABLED):
+        raise RuntimeError(
+            "acne_classifier.config was imported before the benchmark could point it at the fake server; "
+            "run it as python -m acne_classifier.benchmark or set OPENAI_API_KEY=benchmark LLM_CACHE_ENABLED=false"
+        )
+
+    results = {
+        'version': BASELINE_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'config': {
+            'groups': list(groups),
+            'repeat': repeat,
+            'image_size': list(image_size),
+            'batch_size': batch_size,
+            'catalog_sizes': list(catalog_sizes),
+            'latency': latency,
+            'token_latency': token_latency,
+            'embedding_provider': os.environ['EMBEDDING_PROVIDER']
+        },
+        'stages': {},
+        'skipped': {}
+    }
+
+    with FakeOpenAIServer(latency=latency, token_latency=token_latency) as server, tempfile.TemporaryDirectory() as workdir:
+        os.environ['OPENAI_BASE_URL'] = server.url
+        if 'predict' in groups:
+            bench_predict(results, repeat, image_size, batch_size, seed)
+        if 'search' in groups:
+            bench_search(results, repeat, catalog_sizes, workdir, server, seed)
+        if 'llm' in groups:
+            bench_llm(results, repeat)
+        results['fake_server_requests'] = dict(server.requests)
+
+    results['environment'] = environment()
+    return results
+
+
+def main(argv=None):
+    # Command-line entry point: python -m acne_classifier.benchmark [--baseline benchmarks/baseline.json]
+    parser = argparse.ArgumentParser(description="Benchmark each classification, search and recommendation stage")
+    parser.add_argument('--groups', nargs='+', choices=STAGE_GROUPS, default=list(STAGE_GROUPS))
+    parser.add_argument('--repeat', type=int, default=20, help="Timed runs per stage")
+    parser.add_argument('--image-size', type=int, nargs=2, default=[640, 480], metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--batch-size', type=int, default=8, help="Faces in the batched forward pass stage")
+    parser.add_argument('--catalog-sizes', type=int, nargs='+', default=[1000, 10000], help="Synthetic catalog sizes")
+    parser.add_argument('--latency', type=float, default=0.05, help="Fake OpenAI seconds per response")
+    parser.add_argument('--token-latency', type=float, default=0.005, help="Fake OpenAI seconds per streamed chunk")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline JSON to compare against, created if missing")
+    parser.add_argument('--update-baseline', action='store_true', help="Overwrite the baseline with these results")
+    parser.add_argument('--output', help="Also write these results to a JSON file")
+    parser.add_argument('--threshold', type=float, default=0.15, help="Relative slowdown of the median that counts as a regression")
+    parser.add_argument('--min-delta-ms', type=float, default=0.05, help="Ignore slowdowns smaller than this")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+    results = run_benchmarks(
+        groups=args.groups,
+        repeat=args.repeat,
+        image_size=tuple(args.image_size),
+        batch_size=args.batch_size,
+        catalog_sizes=tuple(args.catalog_sizes),
+        latency=args.latency,
+        token_latency=args.token_latency
+    )
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+    baseline_path = Path(args.baseline)
+    regressions = []
+    if baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text())
+        if baseline.get('config') != results['config'] or baseline.get('environment') != results['environment']:
+            logger.warning("Baseline was recorded with a different configuration or environment; changes may not be comparable")
+        rows = compare(results, baseline, args.threshold, args.min_delta_ms)
+        print(format_comparison(rows))
+        regressions = [row['stage'] for row in rows if row['regression']]
+    else:
+        print(format_comparison(compare(results, {'stages': {}}, args.threshold, args.min_delta_ms)))
+
+    if args.update_baseline or not baseline_path.exists():
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(results, indent=2))
+        logger.info(f"Baseline written to {baseline_path}")
+
+    if regressions:
+        print(f"\n{len(regressions)} stage(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import os
+import numpy as np
+from .config import PRODUCT_TYPE_MAPPING
+from .embedding_index import content_hash
+
+STRING_COLUMNS = ('product_name', 'product_url', 'ingredients', 'price')
+
+
+def catalog_source(path):
+    # Modification time and size of the catalog file, used to detect changes; None if it is missing
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class StringColumn:
+    # Strings packed into one UTF-8 buffer with offsets, so a column costs two arrays instead of n objects
+    def __init__(self, buffer, offsets, missing):
+        self.buffer = buffer
+        self.offsets = offsets
+        self.missing = missing
+
+    @classmethod
+    def from_values(cls, values):
+        # Encode once at load time; missing values (None or NaN) are flagged rather than stored
+        encoded, missing = [], []
+        for value in values:
+            is_missing = value is None or (isinstance(value, float) and value != value)
+            missing.append(is_missing)
+            encoded.append(b'' if is_missing else str(value).encode('utf-8'))
+
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(buffer, offsets, np.array(missing, dtype=bool))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        # Decode a single value, None where it was missing
+        if self.missing[row]:
+            return None
+        return self.buffer[self.offsets[row]:self.offsets[row + 1]].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def take(self, rows):
+        return [self[row] for row in rows]
+
+    @property
+    def nbytes(self):
+        return self.buffer.nbytes + self.offsets.nbytes + self.missing.nbytes
+
+
+class ProductCatalog:
+    # Read-only columnar product catalog: packed string columns, categorical product types
+    # and row partitions per search category, all built once at load time
+    def __init__(self, columns, type_codes, type_names):
+        self.columns = columns
+        self.type_codes = type_codes
+        self.type_names = type_names
+        self.content_hashes = [content_hash(text) for text in columns['ingredients']]
+        self.partitions = self._build_partitions()
+
+    @classmethod
+    def from_dataframe(cls, df):
+        # Convert a parsed catalog DataFrame; the DataFrame can be dropped afterwards
+        columns = {
+            name: StringColumn.from_values(df[name].tolist() if name in df.columns else [None] * len(df))
+            for name in STRING_COLUMNS
+        }
+        type_names, type_codes = np.unique(df['product_type'].astype(str).to_numpy(), return_inverse=True)
+        return cls(columns, type_codes.astype(np.int16), [str(name) for name in type_names])
+
+    @classmethod
+    def from_csv(cls, path):
+        # Parse the CSV with pandas, keep only rows that can be searched, then pack the columns
+        import pandas as pd
+
+        df = pd.read_csv(path)
+        df = df.dropna(subset=['ingredients', 'product_type'])
+        return cls.from_dataframe(df)
+
+    @classmethod
+    def empty(cls):
+        columns = {name: StringColumn.from_values([]) for name in STRING_COLUMNS}
+        return cls(columns, np.zeros(0, dtype=np.int16), [])
+
+    def __len__(self):
+        return len(self.type_codes)
+
+    @property
+    def ingredients(self):
+        return self.columns['ingredients']
+
+    @property
+    def product_types(self):
+        # Product type per row, decoded from the categorical codes
+        return [self.type_names[code] for code in self.type_codes]
+
+    def _build_partitions(self):
+        # Rows per search category, matched like the old case-insensitive str.contains filter
+        partitions = {}
+        for category, mapped_type in PRODUCT_TYPE_MAPPING.items():
+            matching = [code for code, name in enumerate(self.type_names) if mapped_type.lower() in name.lower()]
+            partitions[category] = np.flatnonzero(np.isin(self.type_codes, matching))
+        return partitions
+
+    def rows_for(self, category):
+        # Precomputed catalog rows for a category, None for an unknown category
+        return self.partitions.get(category.lower())
+
+    def product(self, row):
+        # Materialize one row as the product fields search results expose
+        price = self.columns['price'][row]
+        url = self.columns['product_url'][row]
+        return {
+            'product_name': self.columns['product_name'][row],
+            'price': price if price is not None else 'N/A',
+            'url': url if url is not None else 'N/A',
+            'ingredients': self.columns['ingredients'][row]
+        }
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values()) + self.type_codes.nbytes
@@ -6,11 +6,65 @@ PROJECT_DIR = Path(__file__).parent.parent
 MODEL_CONFIG_PATH = PROJECT_DIR / "pretrain_model/config.json"
 PREPROCESSOR_CONFIG_PATH = PROJECT_DIR / "pretrain_model/preprocessor_config.json"
 MODEL_WEIGHTS_PATH = PROJECT_DIR / "pretrain_model/model.safetensors"
+ONNX_MODEL_PATH = PROJECT_DIR / "pretrain_model/model.onnx"
 SKINCARE_DATA_PATH = PROJECT_DIR / "data/skincare_products.csv"
+EMBEDDING_INDEX_DIR = PROJECT_DIR / "data/embedding_index"
 
 # Model configuration - input image dimensions for Vision Transformer
 IMAGE_SIZE = 224
-FACE_DETECTION_SIZE = (640, 640)
+
+# Inference backend - "torch" runs the ViT eagerly, "onnx" runs the exported graph with ONNX Runtime
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+ONNX_OPSET = 17
+ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", "1"))
+
+# Model precision for the torch backend - "fp32", "int8" (dynamic quantization) or "bf16"
+MODEL_PRECISION = os.getenv("MODEL_PRECISION", "fp32")
+
+# Face detection configuration - "detection" runs only the detector, "full" runs every buffalo_l module
+FACE_DETECTION_MODE = os.getenv("FACE_DETECTION_MODE", "detection")
+FACE_DETECTION_SIZE = tuple(int(v) for v in os.getenv("FACE_DETECTION_SIZE", "640,640").split(","))
+
+# Coarse detection pass - images at least FACE_DETECTION_COARSE_MIN_SCALE times FACE_DETECTION_SIZE are first searched
+# at FACE_DETECTION_COARSE_SIZE ("320" means 320x320); an empty value, "0" or "off" disables the coarse pass
+_coarse_size = os.getenv("FACE_DETECTION_COARSE_SIZE", "320,320").strip().lower()
+_coarse_sides = [int(v) for v in _coarse_size.split(",")] if _coarse_size not in ("", "off", "none") else [0]
+FACE_DETECTION_COARSE_SIZE = (_coarse_sides[0], _coarse_sides[-1]) if all(_coarse_sides) else None
+FACE_DETECTION_COARSE_MIN_SCALE = float(os.getenv("FACE_DETECTION_COARSE_MIN_SCALE", "1.5"))
+
+# Multi-face mode - faces whose shorter bbox side is under MULTI_FACE_MIN_SIZE pixels are ignored,
+# at most MULTI_FACE_MAX_COUNT of the largest remaining faces are classified
+MULTI_FACE_MIN_SIZE = int(os.getenv("MULTI_FACE_MIN_SIZE", "48"))
+MULTI_FACE_MAX_COUNT = int(os.getenv("MULTI_FACE_MAX_COUNT", "16"))
+
+# Video analysis - the detector runs every VIDEO_DETECT_EVERY frames and template matching tracks the face in
+# between; a frame is classified when its face crop changed by VIDEO_SAMPLE_CHANGE_THRESHOLD gray levels (at most
+# every VIDEO_SAMPLE_MIN_INTERVAL frames) or VIDEO_SAMPLE_MAX_INTERVAL frames passed, up to VIDEO_MAX_SAMPLES
+VIDEO_DETECT_EVERY = int(os.getenv("VIDEO_DETECT_EVERY", "10"))
+VIDEO_TRACK_MIN_SCORE = float(os.getenv("VIDEO_TRACK_MIN_SCORE", "0.5"))
+VIDEO_TRACK_SEARCH_MARGIN = float(os.getenv("VIDEO_TRACK_SEARCH_MARGIN", "0.5"))
+VIDEO_SAMPLE_MIN_INTERVAL = int(os.getenv("VIDEO_SAMPLE_MIN_INTERVAL", "3"))
+VIDEO_SAMPLE_MAX_INTERVAL = int(os.getenv("VIDEO_SAMPLE_MAX_INTERVAL", "15"))
+VIDEO_SAMPLE_CHANGE_THRESHOLD = float(os.getenv("VIDEO_SAMPLE_CHANGE_THRESHOLD", "6"))
+VIDEO_BATCH_SIZE = int(os.getenv("VIDEO_BATCH_SIZE", "8"))
+VIDEO_MAX_INFLIGHT_BATCHES = int(os.getenv("VIDEO_MAX_INFLIGHT_BATCHES", "2"))
+VIDEO_MAX_SAMPLES = int(os.getenv("VIDEO_MAX_SAMPLES", "64"))
+VIDEO_MAX_FRAMES = int(os.getenv("VIDEO_MAX_FRAMES", "900"))
+
+# Upload decoding - longest image side kept after decoding, larger uploads are downscaled
+MAX_IMAGE_SIDE = int(os.getenv("MAX_IMAGE_SIDE", "2048"))
+
+# Batching configuration - group face crops from concurrent requests into one forward pass
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+
+# Prediction cache - results for re-uploaded images keyed by content hash and model version; the optional
+# perceptual-hash tier also matches re-encoded copies within PREDICTION_CACHE_PHASH_DISTANCE bits
+PREDICTION_CACHE_ENABLED = os.getenv("PREDICTION_CACHE_ENABLED", "true").lower() == "true"
+PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "4096"))
+PREDICTION_CACHE_PHASH = os.getenv("PREDICTION_CACHE_PHASH", "false").lower() == "true"
+PREDICTION_CACHE_PHASH_DISTANCE = int(os.getenv("PREDICTION_CACHE_PHASH_DISTANCE", "4"))
 
 # Severity mappings - convert model output labels to readable severity levels
 SEVERITY_MAP = {
@@ -26,6 +80,24 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     print("Warning: OPENAI_API_KEY environment variable not set")
 
+# Chat model used for ingredient recommendations and daily plans
+CHAT_MODEL = "gpt-3.5-turbo"
+
+# OpenAI client - one pooled client per process; OPENAI_BASE_URL redirects every call (e.g. to acne_classifier.fake_openai).
+# Failed calls are retried up to OPENAI_MAX_RETRIES times after the server's Retry-After or a jittered exponential backoff
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+OPENAI_RETRY_BASE_DELAY = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.5"))
+OPENAI_RETRY_MAX_DELAY = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "20"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+
+# LLM response cache - responses keyed by prompt fingerprint; set LLM_CACHE_DIR to share them across workers
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 60 * 60)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR")
+
 # Product search configuration - map user-friendly names to dataset column values
 PRODUCT_TYPE_MAPPING = {
     'cleanser': 'Cleanser',
@@ -37,3 +109,43 @@ PRODUCT_TYPE_MAPPING = {
 TOP_K_PRODUCTS = 3
 MIN_RELEVANCE_THRESHOLD = 0.1
 EXACT_MATCH_BONUS = 0.3
+
+# Embedding provider - "openai", "local" (CPU char n-gram hashing, works offline) or "auto" (openai when a key is set)
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "auto").lower()
+LOCAL_EMBEDDING_DIM = int(os.getenv("LOCAL_EMBEDDING_DIM", "4096"))
+LOCAL_EMBEDDING_NGRAMS = (3, 5)
+
+# Embedding index configuration - product embeddings are built once and memory-mapped at startup
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_INDEX_VERSION = 2
+EMBEDDING_BATCH_SIZE = 256
+
+# ANN index - one IVF partition per product type; nprobe trades recall for latency, small partitions stay exact
+ANN_NLIST = int(os.getenv("ANN_NLIST", "0"))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+ANN_CANDIDATES = int(os.getenv("ANN_CANDIDATES", "100"))
+ANN_MIN_PARTITION_SIZE = int(os.getenv("ANN_MIN_PARTITION_SIZE", "20000"))
+ANN_TRAIN_SAMPLE = 100000
+
+# Catalog hot reload - seconds between checks of the catalog file for changes, 0 disables the watcher
+CATALOG_RELOAD_INTERVAL = float(os.getenv("CATALOG_RELOAD_INTERVAL", "30"))
+
+# Async pipeline - per-stage timeouts in seconds for the remote calls after classification
+RECOMMENDATION_TIMEOUT = float(os.getenv("RECOMMENDATION_TIMEOUT", "15"))
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "10"))
+DAILY_PLAN_TIMEOUT = float(os.getenv("DAILY_PLAN_TIMEOUT", "30"))
+PIPELINE_TIMEOUT = float(os.getenv("PIPELINE_TIMEOUT", "60"))
+
+# Metrics - latency histogram buckets in seconds; set METRICS_DIR so /metrics aggregates every gunicorn worker
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Request profiling - profile a /predict request when it sends X-Profile-Token matching PROFILE_TOKEN,
+# or a PROFILE_SAMPLE_RATE fraction of requests; the newest PROFILE_MAX_PROFILES are kept in PROFILE_DIR
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", str(PROJECT_DIR / "profiles"))
+PROFILE_MAX_PROFILES = int(os.getenv("PROFILE_MAX_PROFILES", "20"))
+PROFILE_TORCH = os.getenv("PROFILE_TORCH", "true").lower() == "true"
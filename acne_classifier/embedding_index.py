@@ -0,0 +1,160 @@
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+from .config import (
+    EMBEDDING_INDEX_DIR,
+    EMBEDDING_INDEX_VERSION
+)
+
+VECTORS_FILE = "vectors.npy"
+META_FILE = "meta.json"
+
+
+def content_hash(text):
+    # Stable fingerprint of the text that gets embedded for a product
+    return hashlib.sha1(str(text).strip().encode('utf-8')).hexdigest()
+
+
+def normalize_rows(vectors):
+    # Scale vectors to unit length so cosine similarity becomes a dot product
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def index_dir_for(provider, root=EMBEDDING_INDEX_DIR):
+    # Each provider gets its own subdirectory so switching providers does not clobber an index
+    return os.path.join(root, provider.provider)
+
+
+def build_index(catalog, provider, index_dir=None, previous=None):
+    # Embed every product's ingredient list once and write vectors plus row metadata to disk;
+    # vectors for content hashes already in a previous index of the same model are reused
+    logger = logging.getLogger(__name__)
+    index_dir = index_dir or index_dir_for(provider)
+
+    texts = list(catalog.ingredients)
+    hashes = catalog.content_hashes
+
+    # Identical ingredient lists only need to be embedded once
+    unique = {}
+    for text, digest in zip(texts, hashes):
+        unique.setdefault(digest, text)
+    unique_hashes = list(unique)
+
+    if previous is not None and previous.model != provider.model:
+        previous = None
+    reused = [h for h in unique_hashes if previous is not None and h in previous.positions]
+    missing = [h for h in unique_hashes if previous is None or h not in previous.positions]
+
+    logger.info(
+        f"Embedding {len(missing)} unique ingredient lists for {len(texts)} products "
+        f"({len(reused)} reused from the previous index)"
+    )
+    embedded = normalize_rows(provider.embed([unique[h] for h in missing])) if missing or previous is None else None
+    dim = embedded.shape[1] if embedded is not None else previous.vectors.shape[1]
+
+    vectors = np.empty((len(unique_hashes), dim), dtype=np.float32)
+    slots = {digest: i for i, digest in enumerate(unique_hashes)}
+    if reused:
+        vectors[[slots[h] for h in reused]] = previous.vectors[[previous.positions[h] for h in reused]]
+    if embedded is not None:
+        vectors[[slots[h] for h in missing]] = embedded
+
+    rows = [
+        {
+            'hash': digest,
+            'product_name': str(name),
+            'product_type': str(product_type)
+        }
+        for digest, name, product_type in zip(
+            hashes, catalog.columns['product_name'], catalog.product_types
+        )
+    ]
+    meta = {
+        'version': EMBEDDING_INDEX_VERSION,
+        'provider': provider.provider,
+        'model': provider.model,
+        'dim': int(vectors.shape[1]),
+        'count': int(vectors.shape[0]),
+        'hashes': unique_hashes,
+        'rows': rows
+    }
+
+    # Write to per-process temporary files first so readers never see a half-written index
+    # and workers updating after the same catalog change do not collide
+    os.makedirs(index_dir, exist_ok=True)
+    vectors_path = os.path.join(index_dir, VECTORS_FILE)
+    meta_path = os.path.join(index_dir, META_FILE)
+    suffix = f"{os.getpid()}.tmp"
+    with open(f"{vectors_path}.{suffix}", 'wb') as f:
+        np.save(f, vectors)
+    with open(f"{meta_path}.{suffix}", 'w') as f:
+        json.dump(meta, f)
+    os.replace(f"{vectors_path}.{suffix}", vectors_path)
+    os.replace(f"{meta_path}.{suffix}", meta_path)
+
+    logger.info(f"Embedding index written to {index_dir}")
+    return EmbeddingIndex(vectors, meta)
+
+
+class EmbeddingIndex:
+    # Read-only view over precomputed product embeddings keyed by content hash
+    def __init__(self, vectors, meta):
+        self.vectors = vectors
+        self.meta = meta
+        self.model = meta['model']
+        self.positions = {digest: i for i, digest in enumerate(meta['hashes'])}
+
+    @classmethod
+    def load(cls, provider, index_dir=None):
+        # Memory-map the index from disk, returning None when it is missing or incompatible
+        logger = logging.getLogger(__name__)
+        index_dir = index_dir or index_dir_for(provider)
+        vectors_path = os.path.join(index_dir, VECTORS_FILE)
+        meta_path = os.path.join(index_dir, META_FILE)
+
+        if not (os.path.exists(vectors_path) and os.path.exists(meta_path)):
+            logger.warning(f"Embedding index not found: {index_dir}")
+            return None
+
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+
+        if (meta.get('version') != EMBEDDING_INDEX_VERSION
+                or meta.get('provider') != provider.provider
+                or meta.get('model') != provider.model):
+            logger.warning(
+                f"Embedding index is incompatible (version {meta.get('version')}, "
+                f"provider {meta.get('provider')}, model {meta.get('model')}); rebuild it"
+            )
+            return None
+
+        # Read-only mmap keeps the pages shared between worker processes
+        vectors = np.load(vectors_path, mmap_mode='r')
+        if vectors.shape != (meta['count'], meta['dim']):
+            logger.warning("Embedding index vectors do not match metadata; rebuild it")
+            return None
+
+        logger.info(f"Memory-mapped {vectors.shape[0]} product embeddings from {index_dir}")
+        return cls(vectors, meta)
+
+    def lookup(self, hashes):
+        # Map content hashes to vector positions, -1 where a hash is not in the index
+        return np.array([self.positions.get(h, -1) for h in hashes], dtype=np.int64)
+
+    def similarities(self, query_vector):
+        # Cosine similarity of a normalized query against every indexed vector
+        return np.asarray(self.vectors @ query_vector, dtype=np.float32)
+
+
+if __name__ == '__main__':
+    # Build step: python -m acne_classifier.embedding_index
+    from .product_search import ProductSearcher
+
+    logging.basicConfig(level=logging.INFO)
+    searcher = ProductSearcher()
+    build_index(searcher.catalog, searcher.provider)
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import numpy as np
+from .config import (
+    OPENAI_API_KEY,
+    EMBEDDING_PROVIDER,
+    EMBEDDING_MODEL,
+    EMBEDDING_BATCH_SIZE,
+    LOCAL_EMBEDDING_DIM,
+    LOCAL_EMBEDDING_NGRAMS,
+    SEARCH_TIMEOUT
+)
+
+EMBEDDING_PROVIDERS = ('openai', 'local')
+
+
+class EmbeddingProvider:
+    # Turns texts into embedding vectors; the product index and search queries both go through one
+    provider = None
+
+    @property
+    def model(self):
+        # Identifier recorded in the index metadata so vectors from another model are never mixed in
+        raise NotImplementedError
+
+    def embed(self, texts):
+        # Embed a list of texts into a (len(texts), dim) float32 array
+        raise NotImplementedError
+
+    async def embed_async(self, texts, client=None):
+        # Async variant; the default runs the sync path off the event loop
+        return await asyncio.to_thread(self.embed, texts)
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    # Remote embeddings from the OpenAI API through a shared OpenAIClient
+    provider = 'openai'
+
+    def __init__(self, client=None, model=EMBEDDING_MODEL, batch_size=EMBEDDING_BATCH_SIZE, timeout=SEARCH_TIMEOUT):
+        self.client = client
+        self._model = model
+        self.batch_size = batch_size
+        self.timeout = timeout
+        if self.client is None and OPENAI_API_KEY:
+            from .openai_client import openai_client
+            self.client = openai_client
+
+    @property
+    def model(self):
+        return self._model
+
+    def embed(self, texts):
+        # Embed in fixed-size batches to stay under the API's input limit
+        if self.client is None:
+            raise RuntimeError("OpenAI client not initialized")
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = self.client.embedding(
+                texts[start:start + self.batch_size],
+                model=self._model,
+                timeout=self.timeout
+            )
+            vectors.extend(item.embedding for item in response.data)
+        return np.array(vectors, dtype=np.float32)
+
+    async def embed_async(self, texts, client=None):
+        # Embed on the caller's event loop; identical queries in flight share one upstream call
+        client = client or self.client
+        if client is None:
+            raise RuntimeError("OpenAI client not initialized")
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = await client.embedding_async(
+                texts[start:start + self.batch_size],
+                model=self._model,
+                timeout=self.timeout
+            )
+            vectors.extend(item.embedding for item in response.data)
+        return np.array(vectors, dtype=np.float32)
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    # Character n-gram hashing embeddings computed on the CPU, no network or fitted vocabulary needed
+    provider = 'local'
+
+    def __init__(self, dim=LOCAL_EMBEDDING_DIM, ngram_range=LOCAL_EMBEDDING_NGRAMS):
+        from sklearn.feature_extraction.text import HashingVectorizer
+
+        self.dim = dim
+        self.ngram_range = tuple(ngram_range)
+        # Stateless hashing keeps query vectors consistent with an index built in another process
+        self.vectorizer = HashingVectorizer(
+            analyzer='char_wb',
+            ngram_range=self.ngram_range,
+            n_features=dim,
+            alternate_sign=False,
+            lowercase=True,
+            norm='l2',
+            dtype=np.float32
+        )
+
+    @property
+    def model(self):
+        return f"hashing-char_wb-{self.ngram_range[0]}-{self.ngram_range[1]}-{self.dim}"
+
+    def embed(self, texts):
+        return self.vectorizer.transform(texts).toarray()
+
+    async def embed_async(self, texts, client=None):
+        # Fast enough to run inline on the event loop
+        return self.embed(texts)
+
+
+def get_embedding_provider(name=EMBEDDING_PROVIDER, client=None):
+    # Build the configured provider; "auto" uses OpenAI when a key is set and the local backend otherwise
+    logger = logging.getLogger(__name__)
+
+    if name == 'auto':
+        name = 'openai' if (client is not None or OPENAI_API_KEY) else 'local'
+        if name == 'local':
+            logger.warning("OPENAI_API_KEY not set, using local embeddings for product search")
+
+    if name == 'openai':
+        return OpenAIEmbeddingProvider(client=client)
+    if name == 'local':
+        return LocalEmbeddingProvider()
+    raise ValueError(f"Unknown embedding provider: {name}")
@@ -0,0 +1,71 @@
+import logging
+import cv2
+import numpy as np
+from insightface.app.common import Face
+from .config import FACE_DETECTION_SIZE, FACE_DETECTION_COARSE_SIZE, FACE_DETECTION_COARSE_MIN_SCALE
+
+
+class FaceDetector:
+    # Runs only the InsightFace detector, coarse-to-fine on large images, and exposes the FaceAnalysis.get interface
+    def __init__(self, det_model, det_size=FACE_DETECTION_SIZE, coarse_size=FACE_DETECTION_COARSE_SIZE,
+                 coarse_min_scale=FACE_DETECTION_COARSE_MIN_SCALE):
+        self.det_model = det_model
+        self.det_size = tuple(det_size)
+        self.coarse_size = tuple(coarse_size) if coarse_size else None
+        self.coarse_min_scale = coarse_min_scale
+        self.logger = logging.getLogger(__name__)
+
+    def get(self, img_rgb, max_num=0, full=False):
+        # Detect faces and return them with bounding boxes in full-resolution coordinates; full skips the coarse pass
+        bboxes, kpss = self.detect(img_rgb, max_num=max_num, full=full)
+        faces = []
+        for i, bbox in enumerate(bboxes):
+            faces.append(Face(
+                bbox=bbox[:4],
+                det_score=float(bbox[4]),
+                kps=kpss[i] if kpss is not None else None
+            ))
+        return faces
+
+    def use_coarse_pass(self, img_rgb):
+        # Only an image at least coarse_min_scale times the detector size is worth a coarse pass; smaller ones
+        # would just be detected at a lower input resolution than before
+        if not self.coarse_size:
+            return False
+        height, width = img_rgb.shape[:2]
+        return max(width / self.det_size[0], height / self.det_size[1]) >= self.coarse_min_scale
+
+    def detect(self, img_rgb, max_num=0, full=False):
+        # Coarse pass on a downscaled copy of a large image, full-size pass if the coarse pass finds nothing,
+        # or straight away when full is set (e.g. every face of a group photo is needed, not just the largest)
+        height, width = img_rgb.shape[:2]
+
+        if not full and self.use_coarse_pass(img_rgb):
+            scale = min(self.coarse_size[0] / width, self.coarse_size[1] / height, 1.0)
+            coarse_img = img_rgb
+            if scale < 1.0:
+                coarse_img = cv2.resize(
+                    img_rgb,
+                    (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1)),
+                    interpolation=cv2.INTER_AREA
+                )
+            bboxes, kpss = self.det_model.detect(coarse_img, input_size=self.coarse_size, max_num=max_num)
+            if len(bboxes) > 0:
+                scale_x = coarse_img.shape[1] / width
+                scale_y = coarse_img.shape[0] / height
+                return self._rescale(bboxes, kpss, scale_x, scale_y)
+            self.logger.info("No face found in coarse detection pass, retrying at full detector size")
+
+        return self.det_model.detect(img_rgb, input_size=self.det_size, max_num=max_num)
+
+    @staticmethod
+    def _rescale(bboxes, kpss, scale_x, scale_y):
+        # Map detections from the downscaled copy back to full-resolution coordinates
+        if scale_x == 1.0 and scale_y == 1.0:
+            return bboxes, kpss
+        bboxes = bboxes.copy()
+        bboxes[:, [0, 2]] /= scale_x
+        bboxes[:, [1, 3]] /= scale_y
+        if kpss is not None:
+            kpss = kpss / np.array([scale_x, scale_y], dtype=kpss.dtype)
+        return bboxes, kpss
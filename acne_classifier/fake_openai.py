@@ -0,0 +1,257 @@
+import argparse
+import base64
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Deterministic replies in the formats the recommender and daily plan prompts expect
+RECOMMENDATION_INGREDIENTS = {
+    'cleanser': ['Salicylic Acid', 'Glycerin', 'Niacinamide', 'Benzoyl Peroxide', 'Ceramide NP'],
+    'moisturizer': ['Niacinamide', 'Hyaluronic Acid', 'Squalane', 'Ceramide NP', 'Panthenol'],
+    'exfoliator': ['Glycolic Acid', 'Lactic Acid', 'Mandelic Acid', 'Salicylic Acid', 'Azelaic Acid']
+}
+PLAN_TEXT = (
+    "Morning Routine:\n"
+    "1. Cleanse with the recommended cleanser, massaging gently for 60 seconds.\n"
+    "2. Apply the moisturizer to damp skin to lock in hydration.\n"
+    "3. Finish with a broad-spectrum SPF 30 or higher.\n\n"
+    "Evening Routine:\n"
+    "1. Cleanse to remove sunscreen, oil and buildup from the day.\n"
+    "2. Use the exfoliator two to three nights a week, skipping it if skin feels irritated.\n"
+    "3. Moisturize to support the skin barrier overnight.\n\n"
+    "Tips: introduce one product at a time, avoid picking at blemishes, and give the routine six weeks before judging results."
+)
+
+
+def chat_reply(messages):
+    # Ingredient lines for a recommendation prompt, a fixed routine for anything else
+    prompt = ' '.join(str(message.get('content', '')) for message in messages)
+    if 'pick only 1 ingredient' in prompt:
+        pick = sum(prompt.encode('utf-8')) % 5
+        return '\n'.join(
+            f"{category.capitalize()}: {ingredients[pick]}"
+            for category, ingredients in RECOMMENDATION_INGREDIENTS.items()
+        )
+    return PLAN_TEXT
+
+
+class FakeOpenAIServer:
+    # Local stand-in for the OpenAI chat and embeddings endpoints with configurable latency,
+    # so benchmarks and load tests exercise the real client code without network or cost
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, token_latency=0.0, embedding_dim=1536):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.token_latency = token_latency
+        self.embedding_dim = embedding_dim
+        self.requests = Counter()
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self._embedder = None
+        self._failures = []
+
+    @property
+    def url(self):
+        # Base URL to hand to the client, e.g. through OPENAI_BASE_URL
+        return f"http://{self.host}:{self.port}/v1"
+
+    def embed(self, texts):
+        # Character n-gram hashing vectors, so similar ingredient lists still land close together
+        if self._embedder is None:
+            from .embeddings import LocalEmbeddingProvider
+            self._embedder = LocalEmbeddingProvider(dim=self.embedding_dim)
+        return self._embedder.embed(texts)
+
+    def start(self):
+        # Serve on a daemon thread; port 0 picks a free port
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        self.logger.info(f"Fake OpenAI server listening on {self.url}")
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def fail_next(self, count=1, status=429, retry_after=None, headers=None):
+        # Answer the next count requests with an error, e.g. a 429 with Retry-After, to exercise client retries
+        failure_headers = dict(headers or {})
+        if retry_after is not None:
+            failure_headers['Retry-After'] = str(retry_after)
+        with self._lock:
+            self._failures.extend([(status, failure_headers)] * count)
+
+    def _next_failure(self):
+        with self._lock:
+            return self._failures.pop(0) if self._failures else None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive so client connection pooling behaves as it does against the real API
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out as separate writes; without this, delayed ACKs add ~40 ms per response
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    return self._send_json(400, {'error': {'message': 'Invalid JSON body', 'type': 'invalid_request_error'}})
+
+                failure = server._next_failure()
+                if failure is not None:
+                    server._count('failed')
+                    status, headers = failure
+                    error_type = 'rate_limit_exceeded' if status == 429 else 'server_error'
+                    return self._send_json(status, {'error': {'message': f'Injected {status}', 'type': error_type}}, headers)
+
+                if self.path.endswith('/embeddings'):
+                    server._count('embeddings')
+                    time.sleep(server.latency)
+                    return self._send_json(200, self._embeddings(body))
+                if self.path.endswith('/chat/completions'):
+                    server._count('chat')
+                    time.sleep(server.latency)
+                    if body.get('stream'):
+                        return self._stream_chat(body)
+                    return self._send_json(200, self._chat(body))
+                self._send_json(404, {'error': {'message': f'Unknown path {self.path}', 'type': 'invalid_request_error'}})
+
+            def _embeddings(self, body):
+                texts = body.get('input', [])
+                if isinstance(texts, str):
+                    texts = [texts]
+                vectors = server.embed(texts)
+                # The Python client asks for base64 by default; plain float lists otherwise
+                as_base64 = body.get('encoding_format') == 'base64'
+                data = [
+                    {
+                        'object': 'embedding',
+                        'index': i,
+                        'embedding': base64.b64encode(vector.tobytes()).decode('ascii') if as_base64 else vector.tolist()
+                    }
+                    for i, vector in enumerate(vectors)
+                ]
+                tokens = sum(len(text.split()) for text in texts)
+                return {
+                    'object': 'list',
+                    'data': data,
+                    'model': body.get('model'),
+                    'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}
+                }
+
+            def _chat(self, body):
+                content = chat_reply(body.get('messages', []))
+                return {
+                    'id': 'chatcmpl-fake',
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': body.get('model'),
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': content},
+                        'finish_reason': 'stop'
+                    }],
+                    'usage': {'prompt_tokens': 0, 'completion_tokens': len(content.split()), 'total_tokens': len(content.split())}
+                }
+
+            def _stream_chat(self, body):
+                # Server-Sent Events over chunked transfer encoding, one word per chunk
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                words = chat_reply(body.get('messages', [])).split(' ')
+                for i, word in enumerate(words):
+                    time.sleep(server.token_latency)
+                    self._write_event({
+                        'id': 'chatcmpl-fake',
+                        'object': 'chat.completion.chunk',
+                        'created': int(time.time()),
+                        'model': body.get('model'),
+                        'choices': [{
+                            'index': 0,
+                            'delta': {'content': word if i == 0 else ' ' + word},
+                            'finish_reason': None
+                        }]
+                    })
+                # Like the real API, the last chunk carries no content, only why generation stopped
+                self._write_event({
+                    'id': 'chatcmpl-fake',
+                    'object': 'chat.completion.chunk',
+                    'created': int(time.time()),
+                    'model': body.get('model'),
+                    'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]
+                })
+                self._write_chunk(b'data: [DONE]\n\n')
+                self._write_chunk(b'')
+
+            def _write_event(self, payload):
+                self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode('utf-8'))
+
+            def _write_chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b'\r\n')
+                self.wfile.flush()
+
+            def _send_json(self, status, payload, headers=None):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+def main(argv=None):
+    # Command-line entry point: python -m acne_classifier.fake_openai --port 8765 --latency 0.2
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the OpenAI API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds before every response")
+    parser.add_argument('--token-latency', type=float, default=0.0, help="Seconds between streamed chunks")
+    parser.add_argument('--embedding-dim', type=int, default=1536)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    server = FakeOpenAIServer(args.host, args.port, args.latency, args.token_latency, args.embedding_dim).start()
+    print(f"export OPENAI_BASE_URL={server.url} OPENAI_API_KEY=fake")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import re
+import numpy as np
+
+_WHITESPACE = re.compile(r'\s+')
+# Only a trailing parenthetical is an alias: "Aqua (Water)", but not "Tocopherol (Vitamin E) Acetate"
+_PARENTHESIZED = re.compile(r'^(.*?)\s*[(\[]([^()\[\]]*)[)\]]?\s*$')
+_EDGE_PUNCTUATION = ' .;:*+†-'
+
+
+def split_ingredients(text):
+    # Split an ingredient list on commas that are not inside parentheses
+    parts, depth, current = [], 0, []
+    for char in str(text):
+        if char in '([':
+            depth += 1
+        elif char in ')]' and depth:
+            depth -= 1
+        if char == ',' and depth == 0:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append(''.join(current))
+    return [part for part in parts if part.strip()]
+
+
+def clean_name(name):
+    # Lowercase, collapse whitespace and trim punctuation around an ingredient name
+    return _WHITESPACE.sub(' ', name.lower()).strip(_EDGE_PUNCTUATION)
+
+
+def normalize_inci(ingredient):
+    # Normalized INCI names for one ingredient: "Aqua/Water" and "Aqua (Water)" both give aqua and water
+    cleaned = clean_name(ingredient)
+    if not cleaned:
+        return []
+
+    # "Aqua (Water)" -> outer and inner names; anything else is a single candidate
+    match = _PARENTHESIZED.match(cleaned)
+    candidates = [match.group(1), match.group(2)] if match else [cleaned]
+
+    # Keep the full name too, so "Caprylic/Capric Triglyceride" still matches as written
+    names = [cleaned]
+    for candidate in candidates:
+        for part in candidate.split('/'):
+            part = clean_name(part)
+            if part and part not in names:
+                names.append(part)
+    return names
+
+
+def parse_ingredient_list(text):
+    # Normalized INCI tokens for a whole product ingredient list
+    tokens = []
+    for ingredient in split_ingredients(text):
+        for name in normalize_inci(ingredient):
+            if name not in tokens:
+                tokens.append(name)
+    return tokens
+
+
+class IngredientIndex:
+    # Inverted index from normalized INCI token to products, stored as a sparse product x token matrix
+    def __init__(self, matrix, vocabulary, hashes=None):
+        self.matrix = matrix
+        self.vocabulary = vocabulary
+        self.hashes = hashes
+
+    @classmethod
+    def build(cls, ingredient_texts, hashes=None, previous=None):
+        # Parse every product's ingredient list once at load time; given a previous index and
+        # content hashes, rows whose ingredient list is unchanged reuse its parsed tokens
+        from scipy import sparse
+
+        previous_rows, previous_csr = {}, None
+        if previous is not None and previous.hashes is not None and hashes is not None:
+            previous_rows = {digest: row for row, digest in enumerate(previous.hashes)}
+            previous_csr = previous.matrix.tocsr()
+
+        # The vocabulary only grows, so reused column ids stay valid
+        vocabulary = dict(previous.vocabulary) if previous_csr is not None else {}
+        rows, cols = [], []
+        for row, text in enumerate(ingredient_texts):
+            previous_row = previous_rows.get(hashes[row]) if previous_rows else None
+            if previous_row is not None:
+                start, end = previous_csr.indptr[previous_row], previous_csr.indptr[previous_row + 1]
+                cols.extend(previous_csr.indices[start:end].tolist())
+                rows.extend([row] * (end - start))
+                continue
+            for token in parse_ingredient_list(text):
+                col = vocabulary.setdefault(token, len(vocabulary))
+                rows.append(row)
+                cols.append(col)
+
+        # CSC makes selecting the columns of a few target ingredients cheap
+        matrix = sparse.csc_matrix(
+            (np.ones(len(rows), dtype=np.int8), (rows, cols)),
+            shape=(len(ingredient_texts), max(len(vocabulary), 1))
+        )
+        return cls(matrix, vocabulary, list(hashes) if hashes is not None else None)
+
+    @property
+    def num_products(self):
+        return self.matrix.shape[0]
+
+    def token_columns(self, target_ingredient):
+        # Vocabulary columns for every normalized name of a target ingredient
+        return [
+            self.vocabulary[name]
+            for name in normalize_inci(target_ingredient)
+            if name in self.vocabulary
+        ]
+
+    def match_counts(self, target_ingredients, rows=None):
+        # Number of target ingredients each product contains, for every product or only the given
+        # catalog rows (ascending, as catalog partitions are), without building a full-catalog vector
+        counts = np.zeros(self.num_products if rows is None else len(rows), dtype=np.int32)
+        indptr, indices = self.matrix.indptr, self.matrix.indices
+        for target in target_ingredients:
+            cols = self.token_columns(target)
+            if not cols:
+                continue
+            # A product matches a target if it contains any of the target's names; each CSC column is
+            # already a sorted list of distinct rows, so only several names need merging
+            hits = [indices[indptr[col]:indptr[col + 1]] for col in cols]
+            hits = hits[0] if len(hits) == 1 else np.unique(np.concatenate(hits))
+            if rows is not None:
+                # Positions of the matching products among the requested rows
+                positions = np.searchsorted(rows, hits)
+                inside = positions < len(rows)
+                hits = positions[inside][rows[positions[inside]] == hits[inside]]
+            counts[hits] += 1
+        return counts
@@ -1,7 +1,214 @@
+import asyncio
+import functools
+import hashlib
+import json
 import logging
-import openai
+import os
+import threading
+import time
 import base64
-from .config import OPENAI_API_KEY
+from collections import OrderedDict
+from .config import (
+    OPENAI_API_KEY,
+    CHAT_MODEL,
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_TTL,
+    LLM_CACHE_MAX_ENTRIES,
+    LLM_CACHE_DIR,
+    RECOMMENDATION_TIMEOUT,
+    DAILY_PLAN_TIMEOUT
+)
+from .metrics import metrics, span
+from .openai_client import openai_client
+
+
+class ResponseCache:
+    # TTL + LRU cache for LLM responses keyed by a normalized prompt fingerprint, optionally persisted to disk
+    def __init__(self, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES, cache_dir=LLM_CACHE_DIR, enabled=LLM_CACHE_ENABLED):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self.logger = logging.getLogger(__name__)
+        
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        if self.enabled and self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+    
+    @staticmethod
+    def fingerprint(model, messages, **params):
+        # Hash the model, parameters and whitespace-normalized messages
+        normalized = {
+            'model': model,
+            'messages': [
+                {'role': m['role'], 'content': ' '.join(str(m['content']).split())}
+                for m in messages
+            ],
+            'params': params
+        }
+        payload = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def get(self, key):
+        # Return a cached response, checking memory first and then the shared file store
+        if not self.enabled:
+            return None
+        
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+        
+        value = self._read_disk(key, now)
+        with self._lock:
+            if value is not None:
+                self.disk_hits += 1
+                self._store(key, value, now)
+            else:
+                self.misses += 1
+        return value
+    
+    def set(self, key, value):
+        # Cache a successful response in memory and, if configured, in the shared file store
+        if not self.enabled or value is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._store(key, value, now)
+        self._write_disk(key, value, now)
+    
+    def stats(self):
+        # Hit/miss counters for monitoring how much LLM traffic the cache absorbs
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0
+            }
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def _store(self, key, value, now):
+        # Insert under the lock, evicting least recently used entries beyond max_entries
+        self._entries[key] = (now + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+    
+    def _read_disk(self, key, now):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('expires_at', 0) <= now:
+            return None
+        return entry.get('value')
+    
+    def _write_disk(self, key, value, now):
+        # Write atomically so other workers never read a partial file
+        if not self.cache_dir:
+            return
+        try:
+            tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'expires_at': now + self.ttl, 'value': value}, f)
+            os.replace(tmp_path, self._path(key))
+            self._prune_disk()
+        except OSError as e:
+            self.logger.warning(f"Failed to persist cached response: {e}")
+    
+    def _prune_disk(self):
+        # Keep the file store within max_entries by dropping the oldest files
+        files = [
+            os.path.join(self.cache_dir, name) 
+            for name in os.listdir(self.cache_dir) if name.endswith('.json')
+        ]
+        if len(files) <= self.max_entries:
+            return
+        files.sort(key=lambda path: os.path.getmtime(path))
+        for path in files[:len(files) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+# Shared by every recommender in the process
+response_cache = ResponseCache()
+
+# Sampling parameters of the daily plan request, part of its cache key
+PLAN_PARAMS = {'temperature': 0.7, 'max_tokens': 800}
+
+
+def lookup_response(messages, description, **params):
+    # Fingerprint a chat request and return (cache key, cached response or None), logging cache hits
+    key = response_cache.fingerprint(CHAT_MODEL, messages, **params)
+    cached = response_cache.get(key)
+    if cached is not None:
+        logging.getLogger(__name__).info(f"Using cached {description}")
+    return key, cached
+
+
+async def lookup_response_async(messages, description, **params):
+    # lookup_response for coroutines; with a file store the lookup runs on the default executor so disk reads
+    # never block the event loop
+    if not response_cache.cache_dir:
+        return lookup_response(messages, description, **params)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(lookup_response, messages, description, **params))
+
+
+def is_complete(content, finish_reason, description):
+    # Only a non-empty response the model finished on its own ("stop") may be cached; one cut off at max_tokens
+    # ("length") or by a content filter would otherwise be served for its prompt until the TTL runs out
+    if finish_reason == 'stop' and content and content.strip():
+        return True
+    logging.getLogger(__name__).warning(f"Not caching incomplete {description} (finish_reason={finish_reason})")
+    return False
+
+
+async def store_response_async(key, value):
+    # response_cache.set for coroutines; file store writes and pruning run on the default executor
+    if not response_cache.cache_dir:
+        response_cache.set(key, value)
+        return
+    await asyncio.get_running_loop().run_in_executor(None, response_cache.set, key, value)
+
+
+def build_recommendation_messages(severity):
+    # Chat messages asking for one ingredient per product category for a severity level
+    return [
+        {
+            "role": "user", 
+            "content": f"For {severity} acne, pick only 1 ingredient that best suits severity level: 1) Cleanser 2) Moisturizer 3) Exfoliator? Provide only ingredient names separated by commas for each category. Each line should be [Category]: [Ingredient] (This is a plan so please make a treatment for each possible ingredient unique per severity, you are allowed to list non-acne treatment ingredients)."
+        }
+    ]
 
 
 def get_ingredient_recommendations(severity):
@@ -14,23 +221,60 @@ def get_ingredient_recommendations(severity):
     
     logger.info(f"Getting recommendations for severity: {severity}")
     
+    # The prompt only depends on severity, so most requests are served from cache
+    messages = build_recommendation_messages(severity)
+    cache_key, cached = lookup_response(messages, "recommendations")
+    if cached is not None:
+        return cached
+    
     try:
-        # Initialize OpenAI client
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
-        
-        # Request ingredient recommendations using GPT-3.5
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {
-                    "role": "user", 
-                    "content": f"For {severity} acne, pick only 1 ingredient that best suits severity level: 1) Cleanser 2) Moisturizer 3) Exfoliator? Provide only ingredient names separated by commas for each category. Each line should be [Category]: [Ingredient] (This is a plan so please make a treatment for each possible ingredient unique per severity, you are allowed to list non-acne treatment ingredients)."
-                }
-            ]
-        )
+        # Request ingredient recommendations using GPT-3.5 through the shared pooled client
+        with span('llm_recommendations'):
+            response = openai_client.chat_completion(
+                messages,
+                model=CHAT_MODEL,
+                timeout=RECOMMENDATION_TIMEOUT
+            )
         
         logger.info("Successfully received OpenAI recommendations")
-        return response.choices[0].message.content
+        content = response.choices[0].message.content
+        if is_complete(content, response.choices[0].finish_reason, "recommendations"):
+            response_cache.set(cache_key, content)
+        return content
+        
+    except Exception as e:
+        logger.error(f"OpenAI API error: {str(e)}")
+        return f"Error getting recommendations: {str(e)}"
+
+
+async def get_ingredient_recommendations_async(severity, client):
+    # Async variant of get_ingredient_recommendations; client is the shared OpenAIClient, None without a key
+    logger = logging.getLogger(__name__)
+    
+    if client is None:
+        logger.error("OpenAI API key not configured")
+        return "Error: OpenAI API key not configured"
+    
+    logger.info(f"Getting recommendations for severity: {severity}")
+    
+    messages = build_recommendation_messages(severity)
+    cache_key, cached = await lookup_response_async(messages, "recommendations")
+    if cached is not None:
+        return cached
+    
+    try:
+        with span('llm_recommendations'):
+            response = await client.chat_completion_async(
+                messages,
+                model=CHAT_MODEL,
+                timeout=RECOMMENDATION_TIMEOUT
+            )
+        
+        logger.info("Successfully received OpenAI recommendations")
+        content = response.choices[0].message.content
+        if is_complete(content, response.choices[0].finish_reason, "recommendations"):
+            await store_response_async(cache_key, content)
+        return content
         
     except Exception as e:
         logger.error(f"OpenAI API error: {str(e)}")
@@ -60,10 +304,9 @@ def parse_ingredient_line(line):
 class IngredientRecommender:
     # Class wrapper for ingredient recommendation functionality
     def __init__(self):
-        self.client = None
+        # Every recommender shares the process-wide client and its connection pool
+        self.client = openai_client if openai_client.available else None
         self.logger = logging.getLogger(__name__)
-        if OPENAI_API_KEY:
-            self.client = openai.OpenAI(api_key=OPENAI_API_KEY)
     
     def get_recommendations(self, predicted_label):
         # Get ingredient recommendations for a given severity level
@@ -111,17 +354,124 @@ class IngredientRecommender:
             # Build context from retrieved products
             context = self._build_context(severity, ingredient_recommendations, product_results)
             
+            # The plan is fully determined by severity, recommendations and retrieved products
+            messages = self._build_plan_messages(severity, ingredient_recommendations, context)
+            cache_key, cached = lookup_response(messages, "daily skincare plan", **PLAN_PARAMS)
+            if cached is not None:
+                return cached
+            
             # Generate personalized plan using LLM with retrieved context (RAG)
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a dermatology expert creating personalized skincare routines. Use the provided product recommendations to create a detailed, easy-to-follow daily plan."
-                    },
-                    {
-                        "role": "user",
-                        "content": f"""Based on the following information, create a detailed daily skincare routine:
+            with span('llm_daily_plan'):
+                response = self.client.chat_completion(
+                    messages,
+                    model=CHAT_MODEL,
+                    timeout=DAILY_PLAN_TIMEOUT,
+                    **PLAN_PARAMS
+                )
+            
+            plan = response.choices[0].message.content
+            if is_complete(plan, response.choices[0].finish_reason, "daily skincare plan"):
+                response_cache.set(cache_key, plan)
+            self.logger.info("Successfully generated daily skincare plan")
+            return plan
+            
+        except Exception as e:
+            self.logger.error(f"Plan generation error: {str(e)}")
+            return f"Error generating plan: {str(e)}"
+    
+    async def generate_daily_plan_async(self, severity, ingredient_recommendations, product_results, client):
+        # Async variant of generate_daily_plan through the shared OpenAIClient
+        if client is None:
+            self.logger.error("OpenAI client not initialized")
+            return "Error: OpenAI API key not configured"
+        
+        self.logger.info(f"Generating daily plan for severity: {severity}")
+        
+        try:
+            context = self._build_context(severity, ingredient_recommendations, product_results)
+            messages = self._build_plan_messages(severity, ingredient_recommendations, context)
+            cache_key, cached = await lookup_response_async(messages, "daily skincare plan", **PLAN_PARAMS)
+            if cached is not None:
+                return cached
+            
+            with span('llm_daily_plan'):
+                response = await client.chat_completion_async(
+                    messages,
+                    model=CHAT_MODEL,
+                    timeout=DAILY_PLAN_TIMEOUT,
+                    **PLAN_PARAMS
+                )
+            
+            plan = response.choices[0].message.content
+            if is_complete(plan, response.choices[0].finish_reason, "daily skincare plan"):
+                await store_response_async(cache_key, plan)
+            self.logger.info("Successfully generated daily skincare plan")
+            return plan
+            
+        except Exception as e:
+            self.logger.error(f"Plan generation error: {str(e)}")
+            return f"Error generating plan: {str(e)}"
+    
+    async def stream_daily_plan_async(self, severity, ingredient_recommendations, product_results, client):
+        # Streamed variant of generate_daily_plan_async that yields the plan as it is generated
+        if client is None:
+            self.logger.error("OpenAI client not initialized")
+            yield "Error: OpenAI API key not configured"
+            return
+        
+        self.logger.info(f"Streaming daily plan for severity: {severity}")
+        
+        try:
+            context = self._build_context(severity, ingredient_recommendations, product_results)
+            messages = self._build_plan_messages(severity, ingredient_recommendations, context)
+            cache_key, cached = await lookup_response_async(messages, "daily skincare plan", **PLAN_PARAMS)
+            if cached is not None:
+                yield cached
+                return
+            
+            began = time.perf_counter()
+            with span('llm_daily_plan_stream'):
+                stream = client.stream_chat_completion_async(
+                    messages,
+                    model=CHAT_MODEL,
+                    timeout=DAILY_PLAN_TIMEOUT,
+                    **PLAN_PARAMS
+                )
+                
+                # Forward each token delta; only a completed plan is cached
+                parts = []
+                finish_reason = None
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    finish_reason = chunk.choices[0].finish_reason or finish_reason
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        # Time to the first token is what the user actually waits for
+                        if not parts:
+                            metrics.observe('acne_stage_duration_seconds', time.perf_counter() - began, stage='llm_daily_plan_first_token')
+                        parts.append(delta)
+                        yield delta
+            
+            plan = ''.join(parts)
+            if is_complete(plan, finish_reason, "daily skincare plan"):
+                await store_response_async(cache_key, plan)
+            self.logger.info("Successfully streamed daily skincare plan")
+            
+        except Exception as e:
+            self.logger.error(f"Plan generation error: {str(e)}")
+            yield f"Error generating plan: {str(e)}"
+    
+    def _build_plan_messages(self, severity, ingredient_recommendations, context):
+        # Chat messages asking for a daily routine grounded in the retrieved products
+        return [
+            {
+                "role": "system",
+                "content": "You are a dermatology expert creating personalized skincare routines. Use the provided product recommendations to create a detailed, easy-to-follow daily plan."
+            },
+            {
+                "role": "user",
+                "content": f"""Based on the following information, create a detailed daily skincare routine:
 
                     Acne Severity: {severity}
 
@@ -136,19 +486,8 @@ class IngredientRecommender:
                     2. Evening Routine (step-by-step)
                     
                     Be specific about which products to use when, and include the product names from the recommendations above."""
-                    }
-                ],
-                temperature=0.7,
-                max_tokens=800
-            )
-            
-            plan = response.choices[0].message.content
-            self.logger.info("Successfully generated daily skincare plan")
-            return plan
-            
-        except Exception as e:
-            self.logger.error(f"Plan generation error: {str(e)}")
-            return f"Error generating plan: {str(e)}"
+            }
+        ]
     
     def _build_context(self, severity, ingredients, product_results):
         # Build context string from retrieved products for RAG
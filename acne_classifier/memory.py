@@ -0,0 +1,82 @@
+import os
+import resource
+import sys
+
+
+def rss_bytes():
+    # Current resident set size of this process in bytes
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        # No /proc (e.g. macOS): fall back to peak RSS, reported in bytes there
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def rss_mb():
+    # Current resident set size of this process in megabytes
+    return round(rss_bytes() / (1024 * 1024), 1)
+
+
+def process_memory(pid='self'):
+    # RSS, PSS and shared/private split for a process from /proc/<pid>/smaps_rollup, in megabytes
+    fields = {
+        'Rss': 'rss_mb',
+        'Pss': 'pss_mb',
+        'Shared_Clean': 'shared_clean_mb',
+        'Shared_Dirty': 'shared_dirty_mb',
+        'Private_Clean': 'private_clean_mb',
+        'Private_Dirty': 'private_dirty_mb'
+    }
+    report = {'pid': os.getpid() if pid == 'self' else int(pid)}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in fields:
+                    report[fields[key]] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        # Without smaps_rollup only the plain RSS of this process is available
+        if pid == 'self':
+            report['rss_mb'] = rss_mb()
+    return report
+
+
+def child_pids(parent_pid):
+    # PIDs whose parent is parent_pid, read from /proc/<pid>/stat
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may contain spaces, so split after its closing parenthesis
+        ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        if ppid == parent_pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def worker_memory_report(master_pid):
+    # Memory of a pre-fork master and each worker; PSS shows the true per-worker cost of shared pages
+    master = process_memory(master_pid)
+    workers = [process_memory(pid) for pid in child_pids(master_pid)]
+    return {
+        'master': master,
+        'workers': workers,
+        'total_pss_mb': round(master.get('pss_mb', 0) + sum(w.get('pss_mb', 0) for w in workers), 1)
+    }
+
+
+if __name__ == '__main__':
+    # Per-worker memory report: python -m acne_classifier.memory <master_pid>
+    import json
+
+    if len(sys.argv) != 2:
+        raise SystemExit("usage: python -m acne_classifier.memory <master_pid>")
+    print(json.dumps(worker_memory_report(int(sys.argv[1])), indent=2))
@@ -0,0 +1,275 @@
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from .config import METRICS_ENABLED, METRICS_DIR, METRICS_FLUSH_INTERVAL, METRICS_LATENCY_BUCKETS
+from .profiling import active_profile
+
+# Metric name -> (type, help text) for the metrics the pipeline records
+METRIC_HELP = {
+    'acne_stage_duration_seconds': ('histogram', 'Time spent in each pipeline stage'),
+    'acne_stage_errors_total': ('counter', 'Pipeline stages that raised or returned an error'),
+    'acne_stage_timeouts_total': ('counter', 'Async pipeline stages cancelled by their timeout'),
+    'acne_http_requests_total': ('counter', 'HTTP requests by endpoint and status code'),
+    'acne_http_request_duration_seconds': ('histogram', 'HTTP request latency by endpoint'),
+    'acne_predictions_total': ('counter', 'Successful predictions by severity'),
+    'acne_batch_size': ('histogram', 'Faces per batched forward pass'),
+    'acne_prediction_cache_total': ('counter', 'Prediction cache lookups by result (hit, phash_hit, miss)'),
+    'acne_openai_requests_total': ('counter', 'Upstream OpenAI calls by endpoint and final outcome'),
+    'acne_openai_retries_total': ('counter', 'OpenAI call retries by endpoint and failure reason'),
+    'acne_openai_coalesced_total': ('counter', 'OpenAI calls served by an identical request already in flight')
+}
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+class Span:
+    # Handle yielded by MetricsRegistry.span; fail() counts an error without raising one
+    def __init__(self, stage):
+        self.stage = stage
+        self.failed = False
+        self.seconds = None
+
+    def fail(self):
+        self.failed = True
+
+
+class MetricsRegistry:
+    # Process-local counters and histograms with Prometheus text output. With METRICS_DIR set,
+    # each process also writes its snapshot there and /metrics sums every process's file
+    def __init__(self, enabled=METRICS_ENABLED, metrics_dir=METRICS_DIR, buckets=METRICS_LATENCY_BUCKETS):
+        self.enabled = enabled
+        self.metrics_dir = metrics_dir
+        self.buckets = tuple(buckets)
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._pid = os.getpid()
+        self._flusher = None
+        self._flusher_pid = None
+        self._stop_flushing = threading.Event()
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted((key, str(value)) for key, value in labels.items())))
+
+    def _check_fork(self):
+        # Values inherited from the master are not this worker's; start from zero after a fork
+        if self._pid != os.getpid():
+            self._counters.clear()
+            self._histograms.clear()
+            self._pid = os.getpid()
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._check_fork()
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, buckets=None, **labels):
+        # Add one observation to a cumulative-bucket histogram
+        if not self.enabled:
+            return
+        buckets = tuple(buckets) if buckets is not None else self.buckets
+        key = self._key(name, labels)
+        with self._lock:
+            self._check_fork()
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': buckets, 'counts': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0}
+            histogram['counts'][bisect.bisect_left(histogram['buckets'], value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    @contextmanager
+    def span(self, stage, **labels):
+        # Time a block as one pipeline stage; an exception or span.fail() also counts a stage error.
+        # Inside a profiled request the stage's memory deltas are recorded too
+        span = Span(stage)
+        profile = active_profile()
+        if profile is not None:
+            profile.stage_started(stage)
+        began = time.perf_counter()
+        try:
+            yield span
+        except Exception:
+            span.failed = True
+            raise
+        finally:
+            span.seconds = time.perf_counter() - began
+            if profile is not None:
+                profile.stage_finished(stage, span.seconds, labels)
+            self.observe('acne_stage_duration_seconds', span.seconds, stage=stage, **labels)
+            if span.failed:
+                self.inc('acne_stage_errors_total', stage=stage, **labels)
+
+    def snapshot(self):
+        # JSON-serializable copy of this process's metrics
+        with self._lock:
+            self._check_fork()
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [
+                    [name, list(labels), dict(histogram, buckets=list(histogram['buckets']), counts=list(histogram['counts']))]
+                    for (name, labels), histogram in self._histograms.items()
+                ]
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def flush(self):
+        # Write this process's snapshot into METRICS_DIR under a per-pid name
+        if not self.metrics_dir:
+            return
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        path = os.path.join(self.metrics_dir, f"metrics-{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def clear_files(self):
+        # Remove snapshots left by an earlier server run; call once in the master before forking
+        if not self.metrics_dir:
+            return
+        for path in glob.glob(os.path.join(self.metrics_dir, 'metrics-*.json*')):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+    def start_flushing(self, interval=METRICS_FLUSH_INTERVAL):
+        # Periodically flush so other workers can serve this one's numbers; call after fork
+        if not self.metrics_dir or interval <= 0:
+            return
+        if self._flusher is not None and self._flusher.is_alive() and self._flusher_pid == os.getpid():
+            return
+
+        def flush_periodically():
+            while not self._stop_flushing.wait(interval):
+                try:
+                    self.flush()
+                except Exception as e:
+                    self.logger.error(f"Metrics flush failed: {e}")
+
+        self._stop_flushing = threading.Event()
+        self._flusher = threading.Thread(target=flush_periodically, name="metrics-flusher", daemon=True)
+        self._flusher.start()
+        self._flusher_pid = os.getpid()
+
+    def stop_flushing(self):
+        self._stop_flushing.set()
+
+    def collect(self):
+        # Metrics from every process sharing METRICS_DIR summed together, or just this process's
+        if not self.metrics_dir:
+            return self._merge([self.snapshot()])
+
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.metrics_dir, 'metrics-*.json')):
+            try:
+                with open(path, 'r') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return self._merge(snapshots)
+
+    @staticmethod
+    def _merge(snapshots):
+        counters, histograms = {}, {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(label) for label in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, histogram in snapshot['histograms']:
+                key = (name, tuple(tuple(label) for label in labels))
+                merged = histograms.get(key)
+                if merged is None or merged['buckets'] != histogram['buckets']:
+                    histograms[key] = dict(histogram, counts=list(histogram['counts']))
+                    continue
+                merged['counts'] = [a + b for a, b in zip(merged['counts'], histogram['counts'])]
+                merged['sum'] += histogram['sum']
+                merged['count'] += histogram['count']
+        return counters, histograms
+
+    def render(self):
+        # Prometheus text exposition format (version 0.0.4)
+        counters, histograms = self.collect()
+        lines = []
+        for name in sorted({key[0] for key in counters} | {key[0] for key in histograms}):
+            kind, help_text = METRIC_HELP.get(name, ('counter' if any(key[0] == name for key in counters) else 'histogram', name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(histogram['buckets']) + ['+Inf'], histogram['counts']):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else format_value(bound)
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(histogram['sum'])}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def stage_summary(self, quantiles=(0.5, 0.9, 0.99)):
+        # Estimated latency quantiles in milliseconds per stage, interpolated within histogram buckets
+        _, histograms = self.collect()
+        summary = {}
+        for (name, labels), histogram in sorted(histograms.items()):
+            if name != 'acne_stage_duration_seconds' or not histogram['count']:
+                continue
+            labels = dict(labels)
+            stage = labels.pop('stage', name)
+            if labels:
+                stage += '{' + ','.join(f"{key}={value}" for key, value in labels.items()) + '}'
+            summary[stage] = {
+                'count': histogram['count'],
+                'mean_ms': round(histogram['sum'] / histogram['count'] * 1000, 3),
+                **{f"p{int(q * 100)}_ms": round(estimate_quantile(histogram, q) * 1000, 3) for q in quantiles}
+            }
+        return summary
+
+
+def estimate_quantile(histogram, q):
+    # Linear interpolation inside the bucket holding the q-th observation, as histogram_quantile does
+    rank = q * histogram['count']
+    cumulative, lower = 0, 0.0
+    for bound, count in zip(histogram['buckets'], histogram['counts']):
+        if count and cumulative + count >= rank:
+            return lower + (bound - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    return histogram['buckets'][-1] if histogram['buckets'] else 0.0
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Shared registry; instrumented modules record into it and web/app.py serves it on /metrics
+metrics = MetricsRegistry()
+span = metrics.span
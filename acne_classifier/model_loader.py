@@ -1,16 +1,75 @@
 import json
 import logging
-import torch
-from transformers import ViTImageProcessor, ViTForImageClassification, ViTConfig
-from safetensors.torch import load_file
-from insightface.app import FaceAnalysis
+import time
+from contextlib import contextmanager
+import numpy as np
 from .config import (
     MODEL_CONFIG_PATH, 
     PREPROCESSOR_CONFIG_PATH, 
     MODEL_WEIGHTS_PATH,
+    ONNX_MODEL_PATH,
+    INFERENCE_BACKEND,
+    ORT_INTRA_OP_THREADS,
+    MODEL_PRECISION,
+    FACE_DETECTION_MODE,
     FACE_DETECTION_SIZE
 )
 
+# Heavy dependencies (torch, transformers, insightface, onnxruntime) are imported
+# inside the load methods so importing this module stays cheap
+
+
+def build_vit_model(model_config_dict, weights_path=MODEL_WEIGHTS_PATH):
+    # Build the ViT directly on memory-mapped safetensors weights, skipping random init and copy
+    import torch
+    from transformers import ViTForImageClassification, ViTConfig
+    from safetensors.torch import load_file
+    
+    model_config = ViTConfig(**model_config_dict)
+    
+    # Create parameters on the meta device so no memory is allocated or initialized
+    with torch.device('meta'):
+        model = ViTForImageClassification(config=model_config)
+    
+    # load_file memory-maps the file; assign=True adopts those tensors instead of copying
+    model.load_state_dict(load_file(weights_path), assign=True)
+    
+    # Buffers that are not stored in the checkpoint would still be on the meta device
+    if any(t.is_meta for t in model.buffers()) or any(p.is_meta for p in model.parameters()):
+        logging.getLogger(__name__).warning("Checkpoint does not cover every tensor, using regular load")
+        model = ViTForImageClassification(config=model_config)
+        model.load_state_dict(load_file(weights_path))
+    
+    return model.eval()
+
+
+def model_version(backend=INFERENCE_BACKEND, precision=MODEL_PRECISION):
+    # Short fingerprint of the model files and inference settings; changes whenever pretrain_model does
+    import hashlib
+    
+    weights_path = ONNX_MODEL_PATH if backend == 'onnx' else MODEL_WEIGHTS_PATH
+    parts = [backend, precision]
+    for path in (MODEL_CONFIG_PATH, PREPROCESSOR_CONFIG_PATH, weights_path):
+        try:
+            stat = path.stat()
+            parts.append(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}")
+        except OSError:
+            parts.append(f"{path.name}:missing")
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def set_thread_count(threads):
+    # Limit torch intra-op threads so several worker processes do not oversubscribe cores
+    import torch
+    
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Only allowed before any inter-op work has started in this process
+        pass
+
+
 class ModelLoader:
     # Handles loading of machine learning models for acne classification
     def __init__(self):
@@ -18,20 +77,41 @@ class ModelLoader:
         self.processor = None
         self.face_app = None
         self.model_config_dict = None
+        self.model_version = None
+        self.timings = {}
         self.logger = logging.getLogger(__name__)
     
-    def load_acne_model(self):
+    @contextmanager
+    def timed(self, phase):
+        # Record and log how long a startup phase takes
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[phase] = round(time.perf_counter() - start, 3)
+            self.logger.info(f"Startup phase '{phase}' took {self.timings[phase]:.3f}s")
+    
+    def load_acne_model(self, backend=INFERENCE_BACKEND, precision=MODEL_PRECISION,
+                        intra_op_threads=ORT_INTRA_OP_THREADS):
         # Load the Vision Transformer model for acne severity classification
         try:
-            self.logger.info("Loading acne classification model...")
+            self.logger.info(f"Loading acne classification model ({backend} backend, {precision})...")
+            
+            if backend not in ('torch', 'onnx'):
+                raise ValueError(f"Unknown inference backend: {backend}")
             
             # Check if model files exist
             if not MODEL_CONFIG_PATH.exists():
                 raise FileNotFoundError(f"Model config not found: {MODEL_CONFIG_PATH}")
             if not PREPROCESSOR_CONFIG_PATH.exists():
                 raise FileNotFoundError(f"Preprocessor config not found: {PREPROCESSOR_CONFIG_PATH}")
-            if not MODEL_WEIGHTS_PATH.exists():
+            if backend == 'torch' and not MODEL_WEIGHTS_PATH.exists():
                 raise FileNotFoundError(f"Model weights not found: {MODEL_WEIGHTS_PATH}")
+            if backend == 'onnx' and not ONNX_MODEL_PATH.exists():
+                raise FileNotFoundError(
+                    f"ONNX model not found: {ONNX_MODEL_PATH} "
+                    "(export it with python -m acne_classifier.onnx_backend)"
+                )
             
             # Load model configuration
             with open(MODEL_CONFIG_PATH, 'r') as f:
@@ -41,20 +121,24 @@ class ModelLoader:
             with open(PREPROCESSOR_CONFIG_PATH, 'r') as f:
                 preprocessor_config = json.load(f)
             
-            # Initialize Vision Transformer model with loaded configuration
-            model_config = ViTConfig(**self.model_config_dict)
-            self.model = ViTForImageClassification(config=model_config)
-            
-            # Load pre-trained weights from safetensors file
-            self.model.load_state_dict(load_file(MODEL_WEIGHTS_PATH))
-            self.model.eval()
+            if backend == 'onnx':
+                # Run the exported graph with ONNX Runtime
+                from .onnx_backend import OnnxViTModel
+                with self.timed('acne_model'):
+                    self.model = OnnxViTModel(ONNX_MODEL_PATH, intra_op_threads=intra_op_threads)
+            else:
+                from .precision import apply_precision
+                with self.timed('acne_model'):
+                    # Initialize Vision Transformer model straight from the safetensors file
+                    self.model = build_vit_model(self.model_config_dict, MODEL_WEIGHTS_PATH)
+                    
+                    # Optionally trade a little accuracy for CPU speed (int8 or bf16)
+                    self.model = apply_precision(self.model, precision)
             
-            # Initialize image processor for input preprocessing
-            processor_params = {
-                k: v for k, v in preprocessor_config.items() 
-                if k != 'image_processor_type'
-            }
-            self.processor = ViTImageProcessor(**processor_params)
+            # Initialize tensor-native preprocessor from the model's mean/std/size
+            from .preprocessing import FacePreprocessor
+            self.processor = FacePreprocessor(preprocessor_config)
+            self.model_version = model_version(backend, precision)
             
             self.logger.info("Acne classification model loaded successfully!")
             return self.model, self.processor
@@ -63,17 +147,43 @@ class ModelLoader:
             self.logger.error(f"Failed to load acne model: {str(e)}")
             raise
     
-    def load_face_detection(self):
+    def load_face_detection(self, intra_op_threads=None):
         # Load InsightFace model for detecting and cropping faces from images
         try:
             self.logger.info("Loading face detection model...")
             
-            # Initialize InsightFace with buffalo_l model on CPU
-            self.face_app = FaceAnalysis(
-                name="buffalo_l", 
-                providers=['CPUExecutionProvider']
-            )
-            self.face_app.prepare(ctx_id=0, det_size=FACE_DETECTION_SIZE)
+            # Detection-only mode skips the landmark, recognition and gender/age models
+            allowed_modules = ['detection'] if FACE_DETECTION_MODE == 'detection' else None
+            
+            with self.timed('face_detection'):
+                from insightface.app import FaceAnalysis
+                from .face_detection import FaceDetector
+                
+                # Initialize InsightFace with buffalo_l model on CPU
+                face_analysis = FaceAnalysis(
+                    name="buffalo_l", 
+                    allowed_modules=allowed_modules,
+                    providers=['CPUExecutionProvider']
+                )
+                face_analysis.prepare(ctx_id=0, det_size=FACE_DETECTION_SIZE)
+                
+                # Rebuild the detector session with a bounded thread pool when running several workers
+                if intra_op_threads:
+                    import onnxruntime as ort
+                    options = ort.SessionOptions()
+                    options.intra_op_num_threads = intra_op_threads
+                    options.inter_op_num_threads = 1
+                    det_model = face_analysis.det_model
+                    det_model.session = ort.InferenceSession(
+                        det_model.model_file,
+                        sess_options=options,
+                        providers=['CPUExecutionProvider']
+                    )
+                
+                if FACE_DETECTION_MODE == 'detection':
+                    self.face_app = FaceDetector(face_analysis.det_model)
+                else:
+                    self.face_app = face_analysis
             
             self.logger.info("Face detection model loaded successfully!")
             return self.face_app
@@ -82,19 +192,41 @@ class ModelLoader:
             self.logger.error(f"Failed to load face detection model: {str(e)}")
             raise
     
-    def load_all_models(self):
+    def warmup(self, image_shape=(480, 640, 3)):
+        # Run dummy detection and classification so first requests skip lazy initialization
+        try:
+            self.logger.info("Warming up models...")
+            with self.timed('warmup'):
+                import torch
+                dummy = np.zeros(image_shape, dtype=np.uint8)
+                
+                if self.face_app is not None:
+                    self.face_app.get(dummy)
+                
+                if self.model is not None:
+                    with torch.no_grad():
+                        self.model(pixel_values=self.processor.preprocess(dummy))
+            
+            self.logger.info("Model warmup completed")
+        except Exception as e:
+            self.logger.error(f"Model warmup failed: {str(e)}")
+            raise
+    
+    def load_all_models(self, warmup=False):
         # Load both acne classification and face detection models
         try:
             self.load_acne_model()
             self.load_face_detection()
-            self.logger.info("All models loaded successfully")
+            if warmup:
+                self.warmup()
+            self.logger.info(f"All models loaded successfully (timings: {self.timings})")
             return self.model, self.processor, self.face_app, self.model_config_dict
         except Exception as e:
             self.logger.error(f"Failed to load models: {str(e)}")
             raise
 
 
-def load_models():
+def load_models(warmup=False):
     # Convenience function to load all models at once
     loader = ModelLoader()
-    return loader.load_all_models()
+    return loader.load_all_models(warmup=warmup)
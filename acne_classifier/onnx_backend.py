@@ -0,0 +1,115 @@
+import inspect
+import logging
+from types import SimpleNamespace
+import numpy as np
+import torch
+from .config import (
+    ONNX_MODEL_PATH,
+    ONNX_OPSET,
+    ORT_INTRA_OP_THREADS,
+    ORT_INTER_OP_THREADS
+)
+
+
+class _LogitsOnly(torch.nn.Module):
+    # Export wrapper so the ONNX graph has a single logits output
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values).logits
+
+
+def export_onnx(model, output_path=ONNX_MODEL_PATH, input_shape=(3, 224, 224), opset=ONNX_OPSET):
+    # Export the ViT classifier to ONNX with a dynamic batch dimension
+    logger = logging.getLogger(__name__)
+    logger.info(f"Exporting ONNX model to {output_path}")
+
+    # Newer torch defaults to the dynamo exporter; the TorchScript exporter handles dynamic_axes directly
+    export_kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        export_kwargs['dynamo'] = False
+    
+    model.eval()
+    dummy = torch.randn((2,) + tuple(input_shape), dtype=torch.float32)
+    with torch.no_grad():
+        torch.onnx.export(
+            _LogitsOnly(model),
+            (dummy,),
+            str(output_path),
+            input_names=['pixel_values'],
+            output_names=['logits'],
+            dynamic_axes={'pixel_values': {0: 'batch'}, 'logits': {0: 'batch'}},
+            opset_version=opset,
+            **export_kwargs
+        )
+
+    logger.info("ONNX export completed")
+    return output_path
+
+
+class OnnxViTModel:
+    # ONNX Runtime session that mimics the ViTForImageClassification call interface
+    def __init__(self, model_path=ONNX_MODEL_PATH,
+                 intra_op_threads=ORT_INTRA_OP_THREADS, inter_op_threads=ORT_INTER_OP_THREADS):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+
+        self.session = ort.InferenceSession(
+            str(model_path),
+            sess_options=options,
+            providers=['CPUExecutionProvider']
+        )
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_name = self.session.get_outputs()[0].name
+
+    def eval(self):
+        # No-op so callers can treat this like a torch module
+        return self
+
+    def __call__(self, pixel_values):
+        # Run the session and return an object with a torch logits tensor
+        if isinstance(pixel_values, torch.Tensor):
+            pixel_values = pixel_values.numpy()
+        logits = self.session.run(
+            [self.output_name],
+            {self.input_name: np.ascontiguousarray(pixel_values, dtype=np.float32)}
+        )[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+def check_parity(torch_model, onnx_model, input_shape=(3, 224, 224), batch_sizes=(1, 4)):
+    # Maximum absolute logit difference between the torch and ONNX Runtime backends
+    generator = torch.Generator().manual_seed(0)
+    max_diff = 0.0
+    for batch_size in batch_sizes:
+        pixel_values = torch.randn((batch_size,) + tuple(input_shape), generator=generator)
+        with torch.no_grad():
+            expected = torch_model(pixel_values=pixel_values).logits
+        actual = onnx_model(pixel_values=pixel_values).logits
+        max_diff = max(max_diff, (expected - actual).abs().max().item())
+    return max_diff
+
+
+if __name__ == '__main__':
+    # Export and parity check: python -m acne_classifier.onnx_backend
+    from .model_loader import ModelLoader
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+
+    # Always export the fp32 graph; MODEL_PRECISION wrappers (bf16, int8) do not export
+    loader = ModelLoader()
+    model, processor = loader.load_acne_model(backend='torch', precision='fp32')
+    export_onnx(model, input_shape=processor.input_shape)
+
+    max_diff = check_parity(model, OnnxViTModel(), input_shape=processor.input_shape)
+    logger.info(f"Max absolute logit difference vs torch: {max_diff:.2e}")
+    if max_diff > 1e-3:
+        raise SystemExit(1)
@@ -0,0 +1,445 @@
+import asyncio
+import email.utils
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future
+from .config import (
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    OPENAI_TIMEOUT,
+    OPENAI_MAX_RETRIES,
+    OPENAI_RETRY_BASE_DELAY,
+    OPENAI_RETRY_MAX_DELAY,
+    OPENAI_MAX_CONCURRENCY,
+    CHAT_MODEL,
+    EMBEDDING_MODEL
+)
+from .metrics import metrics
+
+# Status codes worth retrying; anything else (bad request, auth, not found) fails the same way again
+RETRY_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+
+_DURATION = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(value):
+    # Seconds from rate-limit reset values such as "20ms", "1.5s" or "6m0s", None if unparseable
+    matches = _DURATION.findall(value or '')
+    if not matches:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in matches)
+
+
+def retry_after(headers):
+    # Seconds the server asked us to wait: retry-after-ms, retry-after (seconds or an HTTP date), or the
+    # reset time of whichever x-ratelimit budget is exhausted; None when the response says nothing
+    if headers is None:
+        return None
+
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    value = headers.get('retry-after')
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            date = email.utils.parsedate_tz(value)
+            if date is not None:
+                return max(email.utils.mktime_tz(date) - time.time(), 0.0)
+
+    resets = [
+        parse_duration(headers.get(f'x-ratelimit-reset-{budget}'))
+        for budget in ('requests', 'tokens')
+        if headers.get(f'x-ratelimit-remaining-{budget}') == '0'
+    ]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+def failure_reason(exc):
+    # Short label for logs and metrics: the HTTP status, "timeout" or "connection"
+    import openai
+
+    if isinstance(exc, openai.APITimeoutError):
+        return 'timeout'
+    if isinstance(exc, openai.APIConnectionError):
+        return 'connection'
+    if isinstance(exc, openai.APIStatusError):
+        return str(exc.status_code)
+    return type(exc).__name__
+
+
+def is_retryable(exc):
+    import openai
+
+    if isinstance(exc, openai.APIConnectionError):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        # An exhausted quota is also a 429 but will not recover by waiting
+        return exc.status_code in RETRY_STATUS_CODES and getattr(exc, 'code', None) != 'insufficient_quota'
+    return False
+
+
+class ConcurrencyLimiter:
+    # One budget of concurrent calls shared by threads and every event loop in the process. A released slot
+    # is handed straight to the longest waiting caller, sync or async, so neither side can starve the other
+    def __init__(self, limit):
+        self.limit = max(limit, 1)
+        self._lock = threading.Lock()
+        self._active = 0
+        # threading.Event for a blocked thread, (loop, future) for a waiting coroutine
+        self._waiters = deque()
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def acquire(self):
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                return
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+        waiter.wait()
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                return
+            future = loop.create_future()
+            waiter = (loop, future)
+            self._waiters.append(waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                queued = waiter in self._waiters
+                if queued:
+                    self._waiters.remove(waiter)
+            # Cancelled after the slot was granted: give it back. A grant still on its way is
+            # returned by _grant once it sees the cancelled future
+            if not queued and future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                loop, future = waiter
+                if not loop.is_closed():
+                    loop.call_soon_threadsafe(self._grant, future)
+                    return
+            self._active -= 1
+
+    def _grant(self, future):
+        # Runs on the waiter's loop; the waiter may have been cancelled since the slot was handed over
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class OpenAIClient:
+    # One OpenAI client per process shared by recommendations, daily plans and embeddings. It keeps a
+    # persistent connection pool, applies per-call timeouts and one concurrency limit for sync and async
+    # calls, retries transient
+    # failures with jittered backoff that honours rate-limit headers, and coalesces identical in-flight
+    # requests into a single upstream call
+    def __init__(self, api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, timeout=OPENAI_TIMEOUT,
+                 max_retries=OPENAI_MAX_RETRIES, retry_base_delay=OPENAI_RETRY_BASE_DELAY,
+                 retry_max_delay=OPENAI_RETRY_MAX_DELAY, max_concurrency=OPENAI_MAX_CONCURRENCY):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.max_concurrency = max(max_concurrency, 1)
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._client = None
+        self._limiter = None
+        self._inflight = {}
+        self._async = weakref.WeakKeyDictionary()
+        self.requests = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    @property
+    def available(self):
+        return bool(self.api_key)
+
+    @property
+    def effective_base_url(self):
+        # OPENAI_BASE_URL set after config was imported (e.g. by the benchmark) still applies, as in the SDK
+        return self.base_url or os.getenv('OPENAI_BASE_URL') or None
+
+    def _check_fork(self):
+        # Pooled connections, locks and pending calls belong to the process that made them; start over after a fork
+        if self._pid != os.getpid():
+            self._client = None
+            self._limiter = ConcurrencyLimiter(self.max_concurrency)
+            self._inflight = {}
+            self._async = weakref.WeakKeyDictionary()
+            self._pid = os.getpid()
+
+    def _client_options(self):
+        # The SDK's own retries are off so every retry goes through the limiter and our backoff
+        options = {'api_key': self.api_key, 'timeout': self.timeout, 'max_retries': 0}
+        if self.effective_base_url:
+            options['base_url'] = self.effective_base_url
+        return options
+
+    @property
+    def client(self):
+        # Sync openai.OpenAI client, created once per process
+        with self._lock:
+            self._check_fork()
+            if self._client is None:
+                import openai
+                self._client = openai.OpenAI(**self._client_options())
+            return self._client
+
+    @property
+    def limiter(self):
+        with self._lock:
+            self._check_fork()
+            return self._limiter
+
+    def _async_state(self):
+        # AsyncOpenAI clients and in-flight tasks are bound to one event loop, so each loop gets its own;
+        # entries go away with their loop
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._check_fork()
+            state = self._async.get(loop)
+            if state is None:
+                import openai
+                state = self._async[loop] = {
+                    'client': openai.AsyncOpenAI(**self._client_options()),
+                    'inflight': {}
+                }
+            return state
+
+    @staticmethod
+    def request_key(endpoint, params):
+        # Identical endpoint and parameters (same prompt, same embedding input) give the same key
+        payload = json.dumps([endpoint, params], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def chat_completion(self, messages, model=CHAT_MODEL, timeout=None, **params):
+        return self._call('chat', lambda client: client.chat.completions.create, dict(params, model=model, messages=messages), timeout)
+
+    def embedding(self, input, model=EMBEDDING_MODEL, timeout=None):
+        return self._call('embeddings', lambda client: client.embeddings.create, {'model': model, 'input': input}, timeout)
+
+    async def chat_completion_async(self, messages, model=CHAT_MODEL, timeout=None, **params):
+        return await self._call_async('chat', lambda client: client.chat.completions.create, dict(params, model=model, messages=messages), timeout)
+
+    async def embedding_async(self, input, model=EMBEDDING_MODEL, timeout=None):
+        return await self._call_async('embeddings', lambda client: client.embeddings.create, {'model': model, 'input': input}, timeout)
+
+    async def stream_chat_completion_async(self, messages, model=CHAT_MODEL, timeout=None, **params):
+        # Yield chat completion chunks. Streams are never coalesced. Only opening the stream is retried, since
+        # chunks already forwarded cannot be taken back; the slot of the attempt that opened it is held until
+        # the stream is fully read, but not while backing off between attempts
+        state = self._async_state()
+        limiter = self.limiter
+        params = dict(params, model=model, messages=messages, stream=True)
+        stream = await self._with_retries_async(
+            'chat_stream', state['client'].chat.completions.create, params, timeout, hold=True
+        )
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            try:
+                await stream.close()
+            finally:
+                limiter.release()
+
+    def _call(self, endpoint, method, params, timeout):
+        # Join an identical call already in flight, otherwise make it ourselves and share the result
+        client = self.client
+        key = self.request_key(endpoint, params)
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            metrics.inc('acne_openai_coalesced_total', endpoint=endpoint)
+            return future.result()
+
+        try:
+            response = self._with_retries(endpoint, method(client), params, timeout)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def _call_async(self, endpoint, method, params, timeout):
+        # The upstream call runs as its own task, so a caller cancelled by its stage timeout does not
+        # cancel it for the other callers waiting on the same request
+        state = self._async_state()
+        key = self.request_key(endpoint, params)
+        task = state['inflight'].get(key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._with_retries_async(endpoint, method(state['client']), params, timeout)
+            )
+            state['inflight'][key] = task
+            task.add_done_callback(lambda done: self._finish_task(state['inflight'], key, done))
+        else:
+            with self._lock:
+                self.coalesced += 1
+            metrics.inc('acne_openai_coalesced_total', endpoint=endpoint)
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def _finish_task(inflight, key, task):
+        if inflight.get(key) is task:
+            del inflight[key]
+        # Mark the exception retrieved; every caller may have timed out before it arrived
+        if not task.cancelled():
+            task.exception()
+
+    def _retry_delay(self, exc, attempt):
+        # Seconds before the next attempt, or None to give up
+        if attempt >= self.max_retries or not is_retryable(exc):
+            return None
+        response = getattr(exc, 'response', None)
+        requested = retry_after(response.headers if response is not None else None)
+        if requested is not None:
+            if requested > self.retry_max_delay:
+                self.logger.warning(f"OpenAI asked to retry after {requested:.1f}s, longer than {self.retry_max_delay}s; giving up")
+                return None
+            # A little jitter so callers throttled together do not all come back at the same instant
+            return requested + random.uniform(0, self.retry_base_delay)
+        # Full jitter exponential backoff
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+
+    def _record(self, endpoint, outcome):
+        with self._lock:
+            self.requests += 1
+            if outcome == 'error':
+                self.errors += 1
+        metrics.inc('acne_openai_requests_total', endpoint=endpoint, outcome=outcome)
+
+    def _record_retry(self, endpoint, exc, attempt, delay):
+        reason = failure_reason(exc)
+        with self._lock:
+            self.retries += 1
+        metrics.inc('acne_openai_retries_total', endpoint=endpoint, reason=reason)
+        self.logger.warning(f"OpenAI {endpoint} call failed ({reason}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+
+    def _with_retries(self, endpoint, create, params, timeout):
+        limiter = self.limiter
+        attempt = 0
+        while True:
+            try:
+                with limiter:
+                    response = create(**params, **self._timeout_option(timeout))
+                self._record(endpoint, 'ok')
+                return response
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    self._record(endpoint, 'error')
+                    raise
+                attempt += 1
+                self._record_retry(endpoint, e, attempt, delay)
+                # Sleep outside the limiter so a throttled call does not hold a slot
+                time.sleep(delay)
+
+    async def _with_retries_async(self, endpoint, create, params, timeout, hold=False):
+        # Each attempt takes a slot of the shared limiter; with hold, the caller releases the successful one
+        limiter = self.limiter
+        attempt = 0
+        while True:
+            await limiter.acquire_async()
+            try:
+                response = await create(**params, **self._timeout_option(timeout))
+            except Exception as e:
+                limiter.release()
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    self._record(endpoint, 'error')
+                    raise
+                attempt += 1
+                self._record_retry(endpoint, e, attempt, delay)
+                # Sleep outside the limiter so a throttled call does not hold a slot
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                limiter.release()
+                raise
+            if not hold:
+                limiter.release()
+            self._record(endpoint, 'ok')
+            return response
+
+    @staticmethod
+    def _timeout_option(timeout):
+        return {'timeout': timeout} if timeout is not None else {}
+
+    def stats(self):
+        # Upstream call counters for this process; in_flight counts distinct requests on every thread and loop
+        with self._lock:
+            return {
+                'available': self.available,
+                'base_url': self.effective_base_url,
+                'max_concurrency': self.max_concurrency,
+                'active': self._limiter.active if self._limiter is not None else 0,
+                'waiting': self._limiter.waiting if self._limiter is not None else 0,
+                'in_flight': len(self._inflight) + sum(len(state['inflight']) for state in list(self._async.values())),
+                'requests': self.requests,
+                'errors': self.errors,
+                'retries': self.retries,
+                'coalesced': self.coalesced
+            }
+
+
+# Shared by every OpenAI caller in the process
+openai_client = OpenAIClient()
@@ -0,0 +1,39 @@
+import logging
+from types import SimpleNamespace
+import torch
+
+PRECISION_MODES = ('fp32', 'int8', 'bf16')
+
+
+class Bf16Model:
+    # Runs the ViT in bfloat16 while keeping float32 inputs and logits at the call boundary
+    def __init__(self, model):
+        self.model = model.to(torch.bfloat16)
+
+    def eval(self):
+        self.model.eval()
+        return self
+
+    def __call__(self, pixel_values):
+        outputs = self.model(pixel_values=pixel_values.to(torch.bfloat16))
+        return SimpleNamespace(logits=outputs.logits.float())
+
+
+def apply_precision(model, precision):
+    # Convert a float32 ViTForImageClassification to the requested precision mode
+    logger = logging.getLogger(__name__)
+
+    if precision not in PRECISION_MODES:
+        raise ValueError(f"Unknown model precision: {precision}")
+    if precision == 'fp32':
+        return model
+
+    logger.info(f"Converting acne model to {precision}")
+    if precision == 'int8':
+        # Dynamic quantization: int8 Linear weights, activations quantized on the fly
+        return torch.ao.quantization.quantize_dynamic(
+            model,
+            {torch.nn.Linear},
+            dtype=torch.qint8
+        )
+    return Bf16Model(model).eval()
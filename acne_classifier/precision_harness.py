@@ -0,0 +1,205 @@
+import argparse
+import gc
+import json
+import logging
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+import numpy as np
+import torch
+from .config import SEVERITY_MAP
+from .memory import rss_mb
+from .model_loader import ModelLoader
+from .precision import PRECISION_MODES
+from .prediction import load_image, detect_face
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def collect_images(image_dir):
+    # Find images under <image_dir>/<label>/, using the folder name as the ground-truth label
+    images = []
+    for path in sorted(Path(image_dir).rglob('*')):
+        if path.suffix.lower() in IMAGE_EXTENSIONS:
+            label = path.parent.name if path.parent != Path(image_dir) else None
+            images.append((path, label))
+    return images
+
+
+def normalize_label(label, model_config_dict):
+    # Map a folder name (model label like "level 1" or severity like "mild") to a severity
+    if label is None:
+        return None
+    if label in SEVERITY_MAP:
+        return SEVERITY_MAP[label]
+    if label in SEVERITY_MAP.values():
+        return label
+    return None
+
+
+def prepare_inputs(images, face_app, processor):
+    # Detect and preprocess every face once so each precision mode sees identical inputs
+    logger = logging.getLogger(__name__)
+    tensors, labels, paths = [], [], []
+    skipped = 0
+    for path, label in images:
+        img_rgb = load_image(str(path))
+        bbox = detect_face(img_rgb, face_app)
+        if isinstance(bbox, dict):
+            skipped += 1
+            continue
+        tensors.append(processor.preprocess(img_rgb, bbox)[0])
+        labels.append(label)
+        paths.append(str(path))
+    logger.info(f"Prepared {len(tensors)} faces ({skipped} images skipped without a face)")
+    return torch.stack(tensors) if tensors else None, labels, paths, skipped
+
+
+def run_mode(precision, pixel_values, batch_size):
+    # Load the model in one precision mode and time it over all prepared faces
+    rss_before = rss_mb()
+    loader = ModelLoader()
+    model, _ = loader.load_acne_model(backend='torch', precision=precision)
+    rss_loaded = rss_mb()
+
+    # Warm up once so lazy initialization does not skew the first batch
+    with torch.no_grad():
+        model(pixel_values=pixel_values[:1])
+
+    probabilities = []
+    latencies_ms = []
+    with torch.no_grad():
+        for start in range(0, len(pixel_values), batch_size):
+            batch = pixel_values[start:start + batch_size]
+            began = time.perf_counter()
+            logits = model(pixel_values=batch).logits
+            latencies_ms.append((time.perf_counter() - began) * 1000)
+            probabilities.append(torch.nn.functional.softmax(logits.float(), dim=-1).numpy())
+
+    result = {
+        'probabilities': np.concatenate(probabilities),
+        'latency_ms': {
+            'p50': round(float(np.percentile(latencies_ms, 50)), 3),
+            'p95': round(float(np.percentile(latencies_ms, 95)), 3),
+            'mean': round(float(np.mean(latencies_ms)), 3)
+        },
+        'throughput_per_s': round(len(pixel_values) / (sum(latencies_ms) / 1000), 2),
+        'rss_mb': {
+            'before_load': rss_before,
+            'after_load': rss_loaded,
+            'after_run': rss_mb(),
+            'model_delta': round(rss_loaded - rss_before, 1)
+        }
+    }
+    config = loader.model_config_dict
+
+    del model, loader
+    gc.collect()
+    return result, config
+
+
+def compare(reference, candidate, labels, model_config_dict):
+    # Agreement with fp32, severity flips and confidence drift for one precision mode
+    id2label = model_config_dict['id2label']
+    ref_ids = reference['probabilities'].argmax(axis=1)
+    cand_ids = candidate['probabilities'].argmax(axis=1)
+    ref_severity = [SEVERITY_MAP[id2label[str(i)]] for i in ref_ids]
+    cand_severity = [SEVERITY_MAP[id2label[str(i)]] for i in cand_ids]
+
+    # Per-class agreement, grouped by the fp32 prediction
+    per_class = defaultdict(lambda: [0, 0])
+    flips = Counter()
+    for ref, cand in zip(ref_severity, cand_severity):
+        per_class[ref][1] += 1
+        if ref == cand:
+            per_class[ref][0] += 1
+        else:
+            flips[f"{ref} -> {cand}"] += 1
+
+    # Drift in the probability of the class fp32 picked
+    rows = np.arange(len(ref_ids))
+    drift = np.abs(reference['probabilities'][rows, ref_ids] - candidate['probabilities'][rows, ref_ids])
+
+    report = {
+        'agreement': round(float(np.mean(ref_ids == cand_ids)), 4),
+        'per_class_agreement': {
+            severity: {'agree': agree, 'total': total, 'rate': round(agree / total, 4)}
+            for severity, (agree, total) in sorted(per_class.items())
+        },
+        'severity_flips': sum(flips.values()),
+        'severity_flip_rate': round(sum(flips.values()) / len(ref_ids), 4),
+        'flip_matrix': dict(flips.most_common()),
+        'confidence_drift': {
+            'mean': round(float(drift.mean()), 5),
+            'max': round(float(drift.max()), 5)
+        }
+    }
+
+    truth = [normalize_label(label, model_config_dict) for label in labels]
+    if any(t is not None for t in truth):
+        scored = [(t, c) for t, c in zip(truth, cand_severity) if t is not None]
+        report['accuracy'] = round(sum(t == c for t, c in scored) / len(scored), 4)
+    return report
+
+
+def run_harness(image_dir, modes=PRECISION_MODES, batch_size=1):
+    # Run a labeled image folder through every precision mode and compare each against fp32
+    images = collect_images(image_dir)
+    if not images:
+        raise FileNotFoundError(f"No images found under {image_dir}")
+
+    loader = ModelLoader()
+    _, processor = loader.load_acne_model(backend='torch', precision='fp32')
+    face_app = loader.load_face_detection()
+    pixel_values, labels, paths, skipped = prepare_inputs(images, face_app, processor)
+    if pixel_values is None:
+        raise RuntimeError("No faces detected in any image")
+    del loader
+    gc.collect()
+
+    modes = ['fp32'] + [mode for mode in modes if mode != 'fp32']
+    results = {}
+    reference = None
+    for mode in modes:
+        result, model_config_dict = run_mode(mode, pixel_values, batch_size)
+        if reference is None:
+            reference = result
+        entry = {
+            'latency_ms': result['latency_ms'],
+            'throughput_per_s': result['throughput_per_s'],
+            'speedup_vs_fp32': round(reference['latency_ms']['mean'] / result['latency_ms']['mean'], 2),
+            'rss_mb': result['rss_mb']
+        }
+        entry.update(compare(reference, result, labels, model_config_dict))
+        results[mode] = entry
+
+    return {
+        'images': len(images),
+        'faces': len(paths),
+        'skipped_no_face': skipped,
+        'batch_size': batch_size,
+        'modes': results
+    }
+
+
+def main(argv=None):
+    # Command-line entry point: python -m acne_classifier.precision_harness <image_dir>
+    parser = argparse.ArgumentParser(description="Compare ViT precision modes against fp32")
+    parser.add_argument('image_dir', help="Folder of images grouped into <label>/ subfolders")
+    parser.add_argument('--modes', nargs='+', default=list(PRECISION_MODES), choices=PRECISION_MODES)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--output', help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    report = run_harness(args.image_dir, args.modes, args.batch_size)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
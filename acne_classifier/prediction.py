@@ -1,74 +1,219 @@
+import io
 import logging
-import torch
-import cv2
 import numpy as np
-from PIL import Image
-from .config import SEVERITY_MAP, IMAGE_SIZE
+from PIL import Image, ImageOps
+from .config import SEVERITY_MAP, MAX_IMAGE_SIDE, MULTI_FACE_MIN_SIZE, MULTI_FACE_MAX_COUNT
+from .metrics import metrics, span
 
 
-def predict_image(image_path, model, processor, face_app, model_config_dict):
+def decode_image_bytes(image_bytes, max_side=MAX_IMAGE_SIDE):
+    # Decode uploaded image bytes in memory into an upright RGB numpy array
+    image = Image.open(io.BytesIO(image_bytes))
+    
+    # Let the JPEG decoder downscale while decoding instead of after
+    if max_side and max(image.size) > max_side:
+        image.draft('RGB', (max_side, max_side))
+    
+    # Apply EXIF orientation so faces are upright for detection
+    image = ImageOps.exif_transpose(image)
+    
+    # Cap anything still oversized before it reaches face detection
+    if max_side and max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.BILINEAR)
+    
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return np.asarray(image)
+
+
+def load_image(image_path):
+    # Load an image path, PIL image, raw bytes or array as an RGB numpy array
+    if isinstance(image_path, np.ndarray):
+        return image_path
+    if isinstance(image_path, (bytes, bytearray, memoryview)):
+        return decode_image_bytes(image_path)
+    if isinstance(image_path, str):
+        image = Image.open(image_path).convert('RGB')
+    else:
+        image = image_path.convert('RGB')
+    return np.array(image)
+
+
+def describe_image(image_path):
+    # Short description of an image argument for log lines
+    if isinstance(image_path, str):
+        return image_path
+    if isinstance(image_path, (bytes, bytearray, memoryview)):
+        return f"<{len(image_path)} bytes>"
+    return f"<{type(image_path).__name__}>"
+
+
+def detect_face(img_rgb, face_app):
+    # Detect faces and return the first face's bounding box clipped to the image
+    logger = logging.getLogger(__name__)
+    
+    # Detect faces using InsightFace
+    faces = face_app.get(img_rgb)
+    
+    if len(faces) == 0:
+        logger.warning("No face detected in the image")
+        return {'error': 'No face detected in the image'}
+    
+    logger.info(f"Detected {len(faces)} face(s)")
+    
+    # Extract bounding box coordinates from the first detected face
+    bbox = clip_bbox(faces[0].bbox, img_rgb.shape)
+    
+    # Validate bounding box coordinates
+    if bbox is None:
+        logger.error("Invalid face bounding box detected")
+        return {'error': 'Invalid face detection'}
+    
+    return bbox
+
+
+def clip_bbox(bbox, image_shape):
+    # Integer (x1, y1, x2, y2) clipped to the image, None if nothing is left
+    height, width = image_shape[:2]
+    x1, y1, x2, y2 = np.asarray(bbox[:4]).astype(int)
+    x1, x2 = max(x1, 0), min(x2, width)
+    y1, y2 = max(y1, 0), min(y2, height)
+    if x1 >= x2 or y1 >= y2:
+        return None
+    return (int(x1), int(y1), int(x2), int(y2))
+
+
+def detect_faces(img_rgb, face_app, min_size=MULTI_FACE_MIN_SIZE, max_count=MULTI_FACE_MAX_COUNT):
+    # Every usable face: clipped boxes at least min_size on their shorter side, largest first, at most max_count (None for no limit)
+    logger = logging.getLogger(__name__)
+    
+    # The coarse pass can stop at the largest faces and lose small ones, so multi-face detection always runs
+    # the full-size pass
+    from .face_detection import FaceDetector
+    faces = face_app.get(img_rgb, full=True) if isinstance(face_app, FaceDetector) else face_app.get(img_rgb)
+    detections = []
+    for face in faces:
+        bbox = clip_bbox(face.bbox, img_rgb.shape)
+        if bbox is None or min(bbox[2] - bbox[0], bbox[3] - bbox[1]) < min_size:
+            continue
+        detections.append({'bbox': bbox, 'det_score': float(getattr(face, 'det_score', 0.0))})
+    
+    if not detections:
+        logger.warning(f"No face of at least {min_size}px detected ({len(faces)} detected in total)")
+        return {'error': 'No face detected in the image'}
+    
+    detections.sort(key=lambda face: (face['bbox'][2] - face['bbox'][0]) * (face['bbox'][3] - face['bbox'][1]), reverse=True)
+    if max_count is not None and len(detections) > max_count:
+        logger.info(f"Classifying the {max_count} largest of {len(detections)} faces")
+        detections = detections[:max_count]
+    
+    logger.info(f"Detected {len(faces)} face(s), classifying {len(detections)}")
+    return detections
+
+
+def classify_faces(pixel_values, model, model_config_dict):
+    # Classify a (N, 3, H, W) batch of preprocessed faces with a single forward pass
+    import torch
+    
+    with torch.no_grad():
+        outputs = model(pixel_values=pixel_values)
+    
+    # Process model outputs to get predictions and probabilities per face
+    logits = outputs.logits
+    probabilities = torch.nn.functional.softmax(logits, dim=-1)
+    predicted_class_ids = logits.argmax(dim=-1).tolist()
+    
+    results = []
+    for i, predicted_class_id in enumerate(predicted_class_ids):
+        predicted_label = model_config_dict['id2label'][str(predicted_class_id)]
+        results.append({
+            'raw_logits': logits[i].numpy(),
+            'probabilities': probabilities[i].numpy(),
+            'predicted_class_id': predicted_class_id,
+            'predicted_label': predicted_label,
+            'confidence': probabilities[i][predicted_class_id].item(),
+            'severity': SEVERITY_MAP[str(predicted_label)]
+        })
+    return results
+
+
+def predict_image(image_path, model, processor, face_app, model_config_dict, engine=None):
     # Main function to predict acne severity from an image using face detection and classification
     logger = logging.getLogger(__name__)
     
     try:
-        logger.info(f"Starting prediction for image: {image_path}")
+        logger.info(f"Starting prediction for image: {describe_image(image_path)}")
         
-        # Load and convert image to RGB format
-        if isinstance(image_path, str):
-            image = Image.open(image_path).convert('RGB')
+        # Load image as an RGB numpy array for face detection; callers may pass one already decoded
+        if isinstance(image_path, np.ndarray):
+            img_rgb = image_path
         else:
-            image = image_path.convert('RGB')
+            with span('decode'):
+                img_rgb = load_image(image_path)
         
-        # Convert PIL image to numpy array for face detection
-        img_rgb = np.array(image)
+        with span('face_detection') as detection:
+            bbox = detect_face(img_rgb, face_app)
+            if isinstance(bbox, dict):
+                detection.fail()
+                return bbox
         
-        # Detect faces using InsightFace
-        faces = face_app.get(img_rgb)
+        # Crop, resize and normalize the face straight into the model input tensor
+        with span('preprocess'):
+            pixel_values = processor.preprocess(img_rgb, bbox)
         
-        if len(faces) == 0:
-            logger.warning("No face detected in the image")
-            return {'error': 'No face detected in the image'}
+        # Classify through the batching engine when one is running; with the engine this includes queueing
+        with span('forward'):
+            if engine is not None:
+                result = engine.classify(pixel_values[0])
+            else:
+                result = classify_faces(pixel_values, model, model_config_dict)[0]
+        result['bbox'] = list(bbox)
         
-        logger.info(f"Detected {len(faces)} face(s)")
+        metrics.inc('acne_predictions_total', severity=result['severity'])
+        logger.info(f"Prediction completed: {result['predicted_label']} (confidence: {result['confidence']:.4f})")
+        return result
         
-        # Extract bounding box coordinates from the first detected face
-        face = faces[0]
-        x1, y1, x2, y2 = face.bbox.astype(int)
+    except FileNotFoundError as e:
+        logger.error(f"Image file not found: {str(e)}")
+        return {'error': 'Image file not found'}
+    except Exception as e:
+        logger.error(f"Prediction failed: {str(e)}")
+        return {'error': f'Prediction failed: {str(e)}'}
+
+
+def predict_faces(image_path, predictor, min_size=MULTI_FACE_MIN_SIZE, max_count=MULTI_FACE_MAX_COUNT):
+    # Classify every detected face in an image with one batched forward pass
+    logger = logging.getLogger(__name__)
+    
+    try:
+        logger.info(f"Starting multi-face prediction for image: {describe_image(image_path)}")
         
-        # Validate bounding box coordinates
-        if x1 >= x2 or y1 >= y2:
-            logger.error("Invalid face bounding box detected")
-            return {'error': 'Invalid face detection'}
+        with span('decode'):
+            img_rgb = load_image(image_path)
         
-        # Crop face region and resize to model input size
-        face_crop = img_rgb[y1:y2, x1:x2]
-        face_crop_resized = cv2.resize(face_crop, (IMAGE_SIZE, IMAGE_SIZE))
-        face_image = Image.fromarray(face_crop_resized)
+        with span('face_detection') as detection:
+            detections = detect_faces(img_rgb, predictor.face_app, min_size, max_count)
+            if isinstance(detections, dict):
+                detection.fail()
+                return detections
         
-        # Preprocess face image for model input
-        inputs = processor(images=face_image, return_tensors="pt")
+        # All crops go into one (N, 3, H, W) tensor
+        with span('preprocess'):
+            pixel_values = predictor.processor.preprocess_batch(
+                [img_rgb] * len(detections),
+                [face['bbox'] for face in detections]
+            )
         
-        # Run model inference without gradient computation
-        with torch.no_grad():
-            outputs = model(**inputs)
+        with span('forward'):
+            predictions = predictor.classify(pixel_values)
         
-        # Process model outputs to get predictions and probabilities
-        logits = outputs.logits
-        probabilities = torch.nn.functional.softmax(logits, dim=-1)
-        predicted_class_id = logits.argmax().item()
-        predicted_label = model_config_dict['id2label'][str(predicted_class_id)]
-        confidence = probabilities[0][predicted_class_id].item()
+        faces = []
+        for face, prediction in zip(detections, predictions):
+            metrics.inc('acne_predictions_total', severity=prediction['severity'])
+            faces.append(dict(prediction, bbox=list(face['bbox']), det_score=face['det_score']))
         
-        logger.info(f"Prediction completed: {predicted_label} (confidence: {confidence:.4f})")
-        
-        return {
-            'raw_logits': logits.squeeze().numpy(),
-            'probabilities': probabilities.squeeze().numpy(),
-            'predicted_class_id': predicted_class_id,
-            'predicted_label': predicted_label,
-            'confidence': confidence,
-            'severity': SEVERITY_MAP[str(predicted_label)]
-        }
+        logger.info(f"Multi-face prediction completed for {len(faces)} face(s)")
+        return {'faces': faces}
         
     except FileNotFoundError as e:
         logger.error(f"Image file not found: {str(e)}")
@@ -80,23 +225,123 @@ def predict_image(image_path, model, processor, face_app, model_config_dict):
 
 class AcnePredictor:
     # Class wrapper for acne prediction with loaded models
-    def __init__(self, model, processor, face_app, model_config_dict):
+    def __init__(self, model, processor, face_app, model_config_dict, engine=None, cache=None):
         self.model = model
         self.processor = processor
         self.face_app = face_app
         self.model_config_dict = model_config_dict
+        self.engine = engine
+        self.cache = cache
         self.logger = logging.getLogger(__name__)
     
     def predict(self, image_path):
         # Predict acne severity for a single image
         try:
+            if self.cache is not None and self.cache.enabled and isinstance(image_path, (bytes, bytearray, memoryview)):
+                return self._predict_cached(image_path)
             return predict_image(
                 image_path, 
                 self.model, 
                 self.processor, 
                 self.face_app, 
-                self.model_config_dict
+                self.model_config_dict,
+                engine=self.engine
             )
         except Exception as e:
             self.logger.error(f"Predictor error: {str(e)}")
             return {'error': f'Prediction failed: {str(e)}'}
+    
+    def _predict_cached(self, image_bytes):
+        # Serve repeated uploads from the prediction cache: exact bytes first, then (if enabled) the
+        # classification of a perceptually similar image with this image's own face box, and only run
+        # detection and classification on a miss
+        key = self.cache.key(image_bytes)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return dict(cached, cache='hit')
+        
+        with span('decode'):
+            img_rgb = load_image(image_bytes)
+        
+        phash = None
+        if self.cache.use_phash:
+            from .prediction_cache import perceptual_hash
+            phash = perceptual_hash(img_rgb)
+            cached = self.cache.get_similar(phash)
+            if cached is not None:
+                # A near-duplicate shares only the classification; the face box must come from this image
+                with span('face_detection') as detection:
+                    bbox = detect_face(img_rgb, self.face_app)
+                    if isinstance(bbox, dict):
+                        detection.fail()
+                        return bbox
+                result = dict(cached, bbox=list(bbox))
+                # Later uploads of these exact bytes become exact hits
+                self.cache.set(key, result, phash)
+                return dict(result, cache='phash_hit')
+        
+        self.cache.record_miss()
+        result = predict_image(
+            img_rgb,
+            self.model,
+            self.processor,
+            self.face_app,
+            self.model_config_dict,
+            engine=self.engine
+        )
+        self.cache.set(key, result, phash)
+        return dict(result, cache='miss') if 'error' not in result else result
+    
+    def predict_faces(self, image_path, min_size=MULTI_FACE_MIN_SIZE, max_count=MULTI_FACE_MAX_COUNT):
+        # Predict acne severity for every face in a single image
+        return predict_faces(image_path, self, min_size, max_count)
+    
+    def classify(self, pixel_values):
+        # Classify an (N, 3, H, W) batch of preprocessed faces in one forward pass; the faces of a single request
+        # are already stacked, so routing them through the batching engine would only split them into
+        # BATCH_MAX_SIZE chunks
+        return classify_faces(pixel_values, self.model, self.model_config_dict)
+    
+    def predict_batch(self, images):
+        # Predict acne severity for several images, classifying all detected faces together
+        results = [None] * len(images)
+        face_images = []
+        bboxes = []
+        face_indices = []
+        
+        # Decode and detect faces per image, keeping per-image errors in place
+        for i, image_path in enumerate(images):
+            try:
+                with span('decode'):
+                    img_rgb = load_image(image_path)
+                with span('face_detection') as detection:
+                    bbox = detect_face(img_rgb, self.face_app)
+                    if isinstance(bbox, dict):
+                        detection.fail()
+            except Exception as e:
+                self.logger.error(f"Predictor error: {str(e)}")
+                bbox = {'error': f'Prediction failed: {str(e)}'}
+            
+            if isinstance(bbox, dict):
+                results[i] = bbox
+            else:
+                face_images.append(img_rgb)
+                bboxes.append(bbox)
+                face_indices.append(i)
+        
+        if not face_images:
+            return results
+        
+        try:
+            # Preprocess every face into one contiguous batch tensor
+            with span('preprocess'):
+                pixel_values = self.processor.preprocess_batch(face_images, bboxes)
+            with span('forward'):
+                predictions = self.classify(pixel_values)
+        except Exception as e:
+            self.logger.error(f"Batch prediction failed: {str(e)}")
+            predictions = [{'error': f'Prediction failed: {str(e)}'}] * len(face_images)
+        
+        for i, prediction in zip(face_indices, predictions):
+            results[i] = prediction
+        return results
@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from .config import (
+    PREDICTION_CACHE_ENABLED, PREDICTION_CACHE_MAX_ENTRIES, PREDICTION_CACHE_PHASH, PREDICTION_CACHE_PHASH_DISTANCE
+)
+from .metrics import metrics
+
+
+def perceptual_hash(img_rgb):
+    # 64-bit DCT hash: low-frequency coefficients of a 32x32 grayscale thumbnail compared with their median,
+    # so re-encoded or lightly resized copies of an image differ in only a few bits
+    gray = cv2.cvtColor(np.ascontiguousarray(img_rgb), cv2.COLOR_RGB2GRAY)
+    thumbnail = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(thumbnail)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    bits[0] = False
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+class PredictionCache:
+    # LRU cache of single-face predictions keyed by the upload's sha256 and the model version, with an
+    # optional perceptual-hash tier that serves near-duplicate images
+    def __init__(self, model_version=None, max_entries=PREDICTION_CACHE_MAX_ENTRIES, enabled=PREDICTION_CACHE_ENABLED,
+                 use_phash=PREDICTION_CACHE_PHASH, phash_distance=PREDICTION_CACHE_PHASH_DISTANCE):
+        self.model_version = model_version or 'unversioned'
+        self.max_entries = max_entries
+        self.enabled = enabled and max_entries > 0
+        self.use_phash = use_phash
+        self.phash_distance = phash_distance
+        self.logger = logging.getLogger(__name__)
+
+        # key -> (result, perceptual hash or None)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.phash_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, image_bytes):
+        # Content address of an upload; the model version is part of it so a new model never serves old results
+        digest = hashlib.sha256(self.model_version.encode('utf-8'))
+        digest.update(image_bytes)
+        return digest.hexdigest()
+
+    def get(self, key):
+        # Exact lookup by content address
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if entry is not None:
+            metrics.inc('acne_prediction_cache_total', result='hit')
+            return entry[0]
+        return None
+
+    def get_similar(self, phash):
+        # Closest cached image within phash_distance bits of phash
+        if not self.enabled or not self.use_phash or phash is None:
+            return None
+        best_key, best_distance = None, self.phash_distance + 1
+        with self._lock:
+            for key, (_, cached_phash) in self._entries.items():
+                if cached_phash is None:
+                    continue
+                distance = (cached_phash ^ phash).bit_count()
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            self.phash_hits += 1
+            result = self._entries[best_key][0]
+        metrics.inc('acne_prediction_cache_total', result='phash_hit')
+        return result
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+        metrics.inc('acne_prediction_cache_total', result='miss')
+
+    def set(self, key, result, phash=None):
+        # Cache a successful prediction; errors are never cached so a transient failure can be retried
+        if not self.enabled or result is None or 'error' in result:
+            return
+        with self._lock:
+            self._entries[key] = (result, phash)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        # Hit/miss counters for monitoring how many uploads skip detection and classification
+        with self._lock:
+            lookups = self.hits + self.phash_hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'model_version': self.model_version,
+                'phash': self.use_phash,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'phash_hits': self.phash_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits + self.phash_hits) / lookups, 4) if lookups else 0.0
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,107 @@
+import json
+import cv2
+import numpy as np
+from .config import PREPROCESSOR_CONFIG_PATH, IMAGE_SIZE
+
+# Map PIL resample ids used in preprocessor_config.json to OpenCV interpolation flags
+CV2_INTERPOLATION = {
+    0: cv2.INTER_NEAREST,
+    2: cv2.INTER_LINEAR,
+    3: cv2.INTER_CUBIC,
+    1: cv2.INTER_LANCZOS4
+}
+
+
+class FacePreprocessor:
+    # Crops, resizes and normalizes faces straight into contiguous float tensors for the ViT
+    def __init__(self, preprocessor_config):
+        size = preprocessor_config.get('size', IMAGE_SIZE)
+        if isinstance(size, dict):
+            self.height = size.get('height', size.get('shortest_edge', IMAGE_SIZE))
+            self.width = size.get('width', size.get('shortest_edge', IMAGE_SIZE))
+        else:
+            self.height = self.width = size
+
+        self.do_resize = preprocessor_config.get('do_resize', True)
+        self.interpolation = CV2_INTERPOLATION.get(preprocessor_config.get('resample', 2), cv2.INTER_LINEAR)
+
+        # Fold rescale and normalize into one multiply-add per channel
+        rescale = preprocessor_config.get('rescale_factor', 1 / 255) if preprocessor_config.get('do_rescale', True) else 1.0
+        if preprocessor_config.get('do_normalize', True):
+            mean = np.array(preprocessor_config.get('image_mean', [0.5, 0.5, 0.5]), dtype=np.float32)
+            std = np.array(preprocessor_config.get('image_std', [0.5, 0.5, 0.5]), dtype=np.float32)
+        else:
+            mean = np.zeros(3, dtype=np.float32)
+            std = np.ones(3, dtype=np.float32)
+        self.scale = (rescale / std).astype(np.float32).reshape(3, 1, 1)
+        self.offset = (-mean / std).astype(np.float32).reshape(3, 1, 1)
+
+    @classmethod
+    def from_file(cls, path=PREPROCESSOR_CONFIG_PATH):
+        # Read mean/std/size from preprocessor_config.json once
+        with open(path, 'r') as f:
+            return cls(json.load(f))
+
+    @property
+    def input_shape(self):
+        return (3, self.height, self.width)
+
+    def allocate(self, batch_size):
+        # Preallocate a contiguous float32 batch tensor; torch is imported here so crop-only users stay light
+        import torch
+        return torch.empty((batch_size,) + self.input_shape, dtype=torch.float32)
+
+    def crop_resize(self, img_rgb, bbox=None):
+        # Crop a face region and resize it to model input size
+        if bbox is not None:
+            x1, y1, x2, y2 = bbox
+            img_rgb = img_rgb[y1:y2, x1:x2]
+        if self.do_resize and img_rgb.shape[:2] != (self.height, self.width):
+            img_rgb = cv2.resize(img_rgb, (self.width, self.height), interpolation=self.interpolation)
+        return img_rgb
+
+    def preprocess_into(self, img_rgb, out, bbox=None):
+        # Crop -> resize -> normalize into a preallocated (3, H, W) float32 tensor
+        face = self.crop_resize(img_rgb, bbox)
+        target = out.numpy()
+        np.multiply(face.transpose(2, 0, 1), self.scale, out=target, casting='unsafe')
+        np.add(target, self.offset, out=target)
+        return out
+
+    def preprocess(self, img_rgb, bbox=None):
+        # Preprocess one image or face crop into a (1, 3, H, W) tensor
+        out = self.allocate(1)
+        self.preprocess_into(img_rgb, out[0], bbox)
+        return out
+
+    def preprocess_batch(self, images, bboxes=None, out=None):
+        # Preprocess many images or face crops into one (N, 3, H, W) tensor
+        if bboxes is None:
+            bboxes = [None] * len(images)
+        if out is None:
+            out = self.allocate(len(images))
+        for i, (img_rgb, bbox) in enumerate(zip(images, bboxes)):
+            self.preprocess_into(img_rgb, out[i], bbox)
+        return out[:len(images)]
+
+    def __call__(self, images, return_tensors="pt"):
+        # Drop-in replacement for ViTImageProcessor(images=..., return_tensors="pt")
+        if not isinstance(images, (list, tuple)):
+            images = [images]
+        return {'pixel_values': self.preprocess_batch([np.asarray(image) for image in images])}
+
+
+def check_parity(image_processor, preprocessor, face_crops, image_size=IMAGE_SIZE):
+    # Maximum absolute difference between this preprocessing path and the original one:
+    # cv2 bilinear resize to the model size, then ViTImageProcessor on the PIL image
+    from PIL import Image
+
+    expected = image_processor(
+        images=[
+            Image.fromarray(cv2.resize(crop, (image_size, image_size), interpolation=cv2.INTER_LINEAR))
+            for crop in face_crops
+        ],
+        return_tensors="pt"
+    )['pixel_values']
+    actual = preprocessor.preprocess_batch(face_crops)
+    return (expected - actual).abs().max().item()
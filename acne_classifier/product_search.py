@@ -1,47 +1,219 @@
 import logging
-import pandas as pd
+import os
+import threading
+import time
+from datetime import datetime
 import numpy as np
-from openai import OpenAI
-from sklearn.metrics.pairwise import cosine_similarity
+from .ann_index import AnnIndex, build_ann_index
+from .catalog import ProductCatalog, catalog_source
+from .embedding_index import EmbeddingIndex, build_index, index_dir_for, normalize_rows
+from .embeddings import get_embedding_provider
+from .ingredient_index import IngredientIndex
+from .metrics import span
 from .config import (
     SKINCARE_DATA_PATH,
-    PRODUCT_TYPE_MAPPING, 
+    EMBEDDING_INDEX_DIR,
     TOP_K_PRODUCTS, 
     MIN_RELEVANCE_THRESHOLD, 
     EXACT_MATCH_BONUS,
-    OPENAI_API_KEY
+    ANN_NPROBE,
+    ANN_CANDIDATES,
+    ANN_MIN_PARTITION_SIZE,
+    CATALOG_RELOAD_INTERVAL
 )
 
 
+class SearchState:
+    # Snapshot of the catalog and every index built from it; a search uses one snapshot from start to finish
+    def __init__(self, catalog, ingredient_index=None, source=None, version=0):
+        self.catalog = catalog
+        self.ingredient_index = ingredient_index
+        self.index = None
+        self.embedding_rows = None
+        self.ann = None
+        self.source = source
+        self.version = version
+        self.loaded_at = time.time()
+
+
 class ProductSearcher:
     # Handles RAG-based product search using embeddings and similarity matching
-    def __init__(self):
-        self.df = None
+    def __init__(self, data_path=SKINCARE_DATA_PATH, index_root=EMBEDDING_INDEX_DIR, provider=None):
+        self.state = SearchState(ProductCatalog.empty())
+        self.last_reload = None
         self.logger = logging.getLogger(__name__)
-        self.client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+        self.data_path = data_path
+        self.provider = provider or get_embedding_provider()
+        self.index_dir = index_dir_for(self.provider, index_root)
+        self.logger.info(f"Using {self.provider.provider} embeddings ({self.provider.model})")
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._watcher_pid = None
+        self._stop_watching = threading.Event()
+        self._recommender = None
         self.load_data()
     
+    @property
+    def catalog(self):
+        return self.state.catalog
+    
+    @property
+    def ingredient_index(self):
+        return self.state.ingredient_index
+    
+    @property
+    def index(self):
+        return self.state.index
+    
+    @property
+    def embedding_rows(self):
+        return self.state.embedding_rows
+    
+    @property
+    def ann(self):
+        return self.state.ann
+    
     def load_data(self):
         # Load skincare product database from CSV file
         # AI-Generated L27-L38
         try:
-            if not SKINCARE_DATA_PATH.exists():
-                self.logger.error(f"Skincare data file not found: {SKINCARE_DATA_PATH}")
-                self.df = pd.DataFrame()
-                return
-                
-            self.df = pd.read_csv(SKINCARE_DATA_PATH)
-            self.df = self.df.dropna(subset=['ingredients', 'product_type'])
-            self.logger.info(f"Loaded {len(self.df)} skincare products")
+            self.state = self._build_state()
         except Exception as e:
             self.logger.error(f"Error loading skincare data: {e}")
-            self.df = pd.DataFrame()
+            self.state = SearchState(ProductCatalog.empty())
+    
+    def _build_state(self, previous=None):
+        # Load the catalog and its indexes into a new snapshot; unchanged products reuse the previous one's work
+        source = catalog_source(self.data_path)
+        version = previous.version + 1 if previous is not None else 1
+        if source is None:
+            self.logger.error(f"Skincare data file not found: {self.data_path}")
+            return SearchState(ProductCatalog.empty(), version=version)
+        
+        # Pack the catalog into columnar buffers; no DataFrame is kept around per worker
+        catalog = ProductCatalog.from_csv(self.data_path)
+        self.logger.info(
+            f"Loaded {len(catalog)} skincare products "
+            f"({catalog.nbytes / 1e6:.2f} MB, {len(catalog.type_names)} product types)"
+        )
+        
+        # Tokenize every ingredient list once so exact matching is a sparse lookup per request
+        ingredient_index = IngredientIndex.build(
+            catalog.ingredients,
+            catalog.content_hashes,
+            previous=previous.ingredient_index if previous is not None else None
+        )
+        self.logger.info(f"Indexed {len(ingredient_index.vocabulary)} distinct ingredients")
+        
+        state = SearchState(catalog, ingredient_index, source=source, version=version)
+        self.load_index(state, previous)
+        return state
+
+    def load_index(self, state, previous=None):
+        # Memory-map precomputed product embeddings and align them with the loaded rows
+        try:
+            hashes = state.catalog.content_hashes
+            index = EmbeddingIndex.load(self.provider, self.index_dir)
+            rows = index.lookup(hashes) if index is not None else None
+
+            # Embed only products missing from the index, reusing a previous snapshot's vectors;
+            # local embeddings are cheap enough to build a missing index from scratch
+            base = index if index is not None else (previous.index if previous is not None else None)
+            if (rows is None or (rows < 0).any()) and (base is not None or self.provider.provider == 'local'):
+                self.logger.info("Updating embedding index for new or changed products")
+                index = build_index(state.catalog, self.provider, self.index_dir, previous=base)
+                index = EmbeddingIndex.load(self.provider, self.index_dir) or index
+                rows = index.lookup(hashes)
+
+            if index is None:
+                self.logger.warning("Falling back to per-request product embeddings")
+                return
+
+            missing = int((rows < 0).sum())
+            if missing:
+                self.logger.warning(
+                    f"Embedding index is stale ({missing} products not indexed); "
+                    "falling back to per-request product embeddings"
+                )
+                return
+
+            state.index = index
+            state.embedding_rows = rows
+            state.ann = AnnIndex.load(self.provider, state.catalog, self.index_dir)
 
+            # Keep serving through the ANN index after a catalog update by reusing its centroids
+            if state.ann is None and previous is not None and previous.ann is not None:
+                ann = build_ann_index(
+                    state.catalog, index, rows, self.provider, index_dir=self.index_dir, previous=previous.ann
+                )
+                state.ann = AnnIndex.load(self.provider, state.catalog, self.index_dir) or ann
+        except Exception as e:
+            self.logger.error(f"Error loading embedding index: {e}")
 
-    def rag_search(target_ingredients, product_type, top_k=TOP_K_PRODUCTS):
-        # Convenience function for RAG search without creating a ProductSearcher instance
-        searcher = ProductSearcher()
-        return searcher.rag_search(target_ingredients, product_type, top_k)
+    def reload(self, force=False):
+        # Rebuild the search state when the catalog file changed and swap it in; returns a change summary or None
+        with self._reload_lock:
+            previous = self.state
+            source = catalog_source(self.data_path)
+            if not force and source == previous.source:
+                return None
+            
+            began = time.perf_counter()
+            try:
+                state = self._build_state(previous)
+            except Exception as e:
+                self.logger.error(f"Catalog reload failed, keeping version {previous.version}: {e}")
+                return None
+            
+            # Single reference swap; searches already running finish on the snapshot they started with
+            self.state = state
+            
+            old_hashes = set(previous.catalog.content_hashes)
+            new_hashes = set(state.catalog.content_hashes)
+            self.last_reload = {
+                'version': state.version,
+                'products': len(state.catalog),
+                'added_or_changed': len(new_hashes - old_hashes),
+                'removed': len(old_hashes - new_hashes),
+                'unchanged': len(new_hashes & old_hashes),
+                'seconds': round(time.perf_counter() - began, 3)
+            }
+            self.logger.info(f"Catalog reloaded: {self.last_reload}")
+            return self.last_reload
+    
+    def start_watching(self, interval=CATALOG_RELOAD_INTERVAL):
+        # Poll the catalog file and hot-reload it on change; call after fork since threads do not survive it
+        if interval <= 0:
+            return
+        if self._watcher is not None and self._watcher.is_alive() and self._watcher_pid == os.getpid():
+            return
+        
+        def watch():
+            while not self._stop_watching.wait(interval):
+                try:
+                    self.reload()
+                except Exception as e:
+                    self.logger.error(f"Catalog watcher error: {e}")
+        
+        self._stop_watching = threading.Event()
+        self._watcher = threading.Thread(target=watch, name="catalog-watcher", daemon=True)
+        self._watcher.start()
+        self._watcher_pid = os.getpid()
+    
+    def stop_watching(self):
+        self._stop_watching.set()
+    
+    def stats(self):
+        # Version and size of the active snapshot plus the last reload summary
+        state = self.state
+        return {
+            'version': state.version,
+            'products': len(state.catalog),
+            'loaded_at': datetime.fromtimestamp(state.loaded_at).isoformat(),
+            'embedding_index': state.index is not None,
+            'ann_index': state.ann is not None,
+            'last_reload': self.last_reload
+        }
 
     def search_all_categories(self, ingredient_recommendations, severity=None, recommendations_text=None):
         # RAG Search: Search products and generate daily plan using retrieved products as context
@@ -66,9 +238,11 @@ class ProductSearcher:
             daily_plan = None
             if severity and recommendations_text:
                 try:
-                    from .ingredient_recommendations import IngredientRecommender
-                    recommender = IngredientRecommender()
-                    daily_plan = recommender.generate_daily_plan(severity, recommendations_text, results)
+                    # One recommender per searcher; it goes through the shared pooled OpenAI client
+                    if self._recommender is None:
+                        from .ingredient_recommendations import IngredientRecommender
+                        self._recommender = IngredientRecommender()
+                    daily_plan = self._recommender.generate_daily_plan(severity, recommendations_text, results)
                     self.logger.info("Successfully generated daily plan as part of RAG search")
                 except Exception as e:
                     self.logger.error(f"Failed to generate daily plan in RAG: {e}")
@@ -84,53 +258,54 @@ class ProductSearcher:
     
     def rag_search(self, target_ingredients, product_type, top_k=TOP_K_PRODUCTS):
         # Search for products matching target ingredients using embedding similarity
+        state = self.state
         try:
-            if self.df.empty:
-                self.logger.warning("Product database is empty")
+            rows = self._filter_products(state, target_ingredients, product_type)
+            if rows is None:
                 return []
             
-            self.logger.info(f"Searching for {product_type} with ingredients: {target_ingredients}")
-            
-            # Map user-friendly product type to database column value
-            mapped_type = PRODUCT_TYPE_MAPPING.get(product_type.lower())
-            if not mapped_type:
-                self.logger.error(f"Unknown product type: {product_type}")
-                return []
+            # Exact INCI matches of the filtered rows, computed once for candidate selection and ranking
+            exact_matches = state.ingredient_index.match_counts(target_ingredients, rows)
             
-            # Filter products by the specified type
-            filtered_df = self.df[
-                self.df['product_type'].str.contains(mapped_type, case=False, na=False)
-            ]
+            # Prepare target ingredients as a comma-separated query string
+            target_query = ', '.join([ing.strip() for ing in target_ingredients])
             
-            if filtered_df.empty:
-                self.logger.warning(f"No products found for type: {mapped_type}")
+            try:
+                # Generate embeddings with the configured provider
+                with span('embedding', category=product_type):
+                    embeddings = self.provider.embed(self._embedding_inputs(state, target_query, rows))
+                with span('similarity', category=product_type):
+                    rows, similarities, exact_matches = self._candidates(state, embeddings, rows, exact_matches, product_type)
+            except Exception as e:
+                self.logger.error(f"Embedding computation failed: {e}")
+                return []
+                
+        except Exception as e:
+            self.logger.error(f"Product search failed: {e}")
+            return []
+        
+        with span('ranking', category=product_type):
+            return self._rank_products(state, rows, similarities, exact_matches, top_k)
+    
+    async def rag_search_async(self, target_ingredients, product_type, client, top_k=TOP_K_PRODUCTS):
+        # Async variant of rag_search; remote providers embed through the shared OpenAIClient
+        state = self.state
+        try:
+            rows = self._filter_products(state, target_ingredients, product_type)
+            if rows is None:
                 return []
             
-            self.logger.info(f"Found {len(filtered_df)} products of type {mapped_type}")
-            
-            # Prepare target ingredients as a comma-separated query string
+            exact_matches = state.ingredient_index.match_counts(target_ingredients, rows)
             target_query = ', '.join([ing.strip() for ing in target_ingredients])
             
-            # Get embeddings for both product ingredients and target query
-            ingredients_list = [str(ing) for ing in filtered_df['ingredients'].tolist()]
-            all_texts = ingredients_list + [target_query]
-
             try:
-                # Generate embeddings using OpenAI's text-embedding model
-                response = self.client.embeddings.create(
-                    model="text-embedding-3-small",
-                    input=all_texts
-                )
-                
-                # Extract embedding vectors from API response
-                embeddings = np.array([item.embedding for item in response.data])
-                
-                # Calculate cosine similarity between query and all products
-                query_embedding = embeddings[-1:, :]
-                product_embeddings = embeddings[:-1, :]
-                
-                similarities = cosine_similarity(query_embedding, product_embeddings).flatten()
-                
+                with span('embedding', category=product_type):
+                    embeddings = await self.provider.embed_async(
+                        self._embedding_inputs(state, target_query, rows),
+                        client
+                    )
+                with span('similarity', category=product_type):
+                    rows, similarities, exact_matches = self._candidates(state, embeddings, rows, exact_matches, product_type)
             except Exception as e:
                 self.logger.error(f"Embedding computation failed: {e}")
                 return []
@@ -139,34 +314,108 @@ class ProductSearcher:
             self.logger.error(f"Product search failed: {e}")
             return []
         
-        # Score and rank products based on similarity and exact ingredient matches - AI generated L143 - L175
+        with span('ranking', category=product_type):
+            return self._rank_products(state, rows, similarities, exact_matches, top_k)
+    
+    def _filter_products(self, state, target_ingredients, product_type):
+        # Catalog rows of the requested type, or None when there is nothing to search
+        if len(state.catalog) == 0:
+            self.logger.warning("Product database is empty")
+            return None
+        
+        self.logger.info(f"Searching for {product_type} with ingredients: {target_ingredients}")
+        
+        # Product type partitions are precomputed when the catalog is loaded
+        rows = state.catalog.rows_for(product_type)
+        if rows is None:
+            self.logger.error(f"Unknown product type: {product_type}")
+            return None
+        
+        if len(rows) == 0:
+            self.logger.warning(f"No products found for type: {product_type}")
+            return None
+        
+        self.logger.info(f"Found {len(rows)} products of type {product_type}")
+        return rows
+    
+    def _embedding_inputs(self, state, target_query, rows):
+        # Only the query needs embedding when product vectors come from the index
+        if state.index is not None:
+            return [target_query]
+        return state.catalog.ingredients.take(rows) + [target_query]
+    
+    def _candidates(self, state, embeddings, rows, exact_matches, product_type):
+        # Products to rank with their similarities and exact match counts; large partitions are narrowed
+        # through the ANN index
+        partition = state.ann.partition(product_type) if state.ann is not None else None
+        if partition is None or partition.count < ANN_MIN_PARTITION_SIZE:
+            return rows, self._similarities(state, embeddings, rows), exact_matches
+        
+        query_embedding = normalize_rows(embeddings[0])
+        ann_positions, _ = partition.search(query_embedding, ANN_CANDIDATES, ANN_NPROBE)
+        
+        # Exact ingredient matches earn a bonus, so they are always ranked even if the ANN search missed them
+        positions = np.union1d(ann_positions, rows[exact_matches > 0])
+        
+        similarities = state.index.vectors[state.embedding_rows[positions]] @ query_embedding
+        return positions, np.asarray(similarities, dtype=np.float64), exact_matches[np.searchsorted(rows, positions)]
+    
+    def _similarities(self, state, embeddings, rows):
+        # Cosine similarity between the query and each filtered product
+        if state.index is not None:
+            return self._indexed_similarities(state, embeddings[0], rows)
+        return self._computed_similarities(embeddings)
+    
+    def _indexed_similarities(self, state, query_embedding, rows):
+        # Score the query against the memory-mapped product vectors
+        query_embedding = normalize_rows(query_embedding)
+        
+        # Only the filtered products' vectors are read from the index, as in the ANN path
+        similarities = state.index.vectors[state.embedding_rows[rows]] @ query_embedding
+        return np.asarray(similarities, dtype=np.float64)
+    
+    def _computed_similarities(self, embeddings):
+        # Similarities from product and query embeddings computed together when no index is available
+        from sklearn.metrics.pairwise import cosine_similarity
+        
+        # Calculate cosine similarity between query and all products
+        query_embedding = embeddings[-1:, :]
+        product_embeddings = embeddings[:-1, :]
+        
+        return cosine_similarity(query_embedding, product_embeddings).flatten()
+    
+    def _rank_products(self, state, rows, similarities, exact_matches, top_k):
+        # Score and rank products based on similarity and exact ingredient matches (one count per row)
         try:
-            scored_products = []
-            for idx, (_, product) in enumerate(filtered_df.iterrows()):
-                # Count exact matches of target ingredients in product
-                ingredient_text = str(product['ingredients']).lower()
-                exact_matches = sum(
-                    1 for ing in target_ingredients 
-                    if ing.strip().lower() in ingredient_text
-                )
-                
-                # Combine embedding similarity with exact match bonus
-                combined_score = similarities[idx] + (exact_matches * EXACT_MATCH_BONUS)
-                
-                # Filter out low-scoring products
-                if combined_score > MIN_RELEVANCE_THRESHOLD:
-                    scored_products.append({
-                        'product_name': product['product_name'],
-                        'price': product.get('price', 'N/A'),
-                        'similarity_score': round(similarities[idx], 3),
-                        'exact_matches': exact_matches,
-                        'combined_score': round(combined_score, 3),
-                        'url': product.get('product_url', 'N/A'),
-                        'ingredients': product['ingredients']
-                    })
-            
-            # Sort by combined score and return top K results
-            sorted_products = sorted(scored_products, key=lambda x: x['combined_score'], reverse=True)[:top_k]
+            similarities = np.asarray(similarities, dtype=np.float64)
+            
+            # Combine embedding similarity with exact match bonus
+            combined_scores = similarities + exact_matches * EXACT_MATCH_BONUS
+            
+            # Filter out low-scoring products, then take the top K without sorting everything
+            candidates = np.flatnonzero(combined_scores > MIN_RELEVANCE_THRESHOLD)
+            if len(candidates) > top_k:
+                partition = np.argpartition(-combined_scores[candidates], top_k - 1)[:top_k]
+                candidates = candidates[partition]
+            
+            # Order by rounded combined score, ties in catalog order as the stable sort did before
+            rounded = np.round(combined_scores[candidates], 3)
+            top = candidates[np.lexsort((candidates, -rounded))]
+            
+            # Only the returned rows are materialized
+            sorted_products = []
+            for idx in top:
+                product = state.catalog.product(rows[idx])
+                sorted_products.append({
+                    'product_name': product['product_name'],
+                    'price': product['price'],
+                    'similarity_score': round(float(similarities[idx]), 3),
+                    'exact_matches': int(exact_matches[idx]),
+                    'combined_score': round(float(combined_scores[idx]), 3),
+                    'url': product['url'],
+                    'ingredients': product['ingredients']
+                })
+            
             self.logger.info(f"Found {len(sorted_products)} matching products")
             return sorted_products
             
@@ -174,7 +423,6 @@ class ProductSearcher:
             self.logger.error(f"Product scoring failed: {e}")
             return []
     
-    
     def format_search_results(self, search_results):
         # Format search results into readable text output - AI-generated
         try:
@@ -206,3 +454,9 @@ class ProductSearcher:
         except Exception as e:
             self.logger.error(f"Result formatting failed: {e}")
             return "Error formatting search results"
+
+
+def rag_search(target_ingredients, product_type, top_k=TOP_K_PRODUCTS):
+    # Convenience function for RAG search without creating a ProductSearcher instance
+    searcher = ProductSearcher()
+    return searcher.rag_search(target_ingredients, product_type, top_k)
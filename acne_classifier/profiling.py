@@ -0,0 +1,182 @@
+import contextvars
+import cProfile
+import hmac
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import shutil
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from .config import PROFILE_TOKEN, PROFILE_SAMPLE_RATE, PROFILE_DIR, PROFILE_MAX_PROFILES, PROFILE_TORCH
+from .memory import rss_bytes
+
+# Profile of the request running in this context; metrics spans report their stages to it
+_active = contextvars.ContextVar('active_profile', default=None)
+
+# tracemalloc and the profilers are process-wide, so only one request is profiled at a time
+_profile_lock = threading.Lock()
+
+
+def active_profile():
+    return _active.get()
+
+
+def should_profile(token=None, sample_rate=PROFILE_SAMPLE_RATE, expected_token=PROFILE_TOKEN):
+    # Profile when the caller presents the configured token, or for a random sample of requests
+    if token and expected_token and hmac.compare_digest(token, expected_token):
+        return True
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+class RequestProfile:
+    # cProfile, the torch operator profiler and per-stage tracemalloc/RSS deltas for one request
+    def __init__(self, name, profile_dir=PROFILE_DIR, torch_profiler=PROFILE_TORCH):
+        self.name = name
+        self.profile_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{name}"
+        self.path = os.path.join(profile_dir, self.profile_id)
+        self.profile_dir = profile_dir
+        self.use_torch = torch_profiler
+        self.stages = []
+        self.logger = logging.getLogger(__name__)
+        self._stack = []
+        self._python = cProfile.Profile()
+        self._torch = None
+        self._started_tracemalloc = False
+        self._began = None
+        self._snapshot = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            self._started_tracemalloc = True
+        tracemalloc.reset_peak()
+        if self.use_torch:
+            try:
+                import torch
+
+                self._torch = torch.profiler.profile(
+                    activities=[torch.profiler.ProfilerActivity.CPU],
+                    record_shapes=True,
+                    profile_memory=True
+                )
+                self._torch.__enter__()
+            except Exception as e:
+                self.logger.warning(f"Torch profiler unavailable: {e}")
+                self._torch = None
+        self._began = time.perf_counter()
+        self._python.enable()
+
+    def stop(self):
+        self._python.disable()
+        self.seconds = time.perf_counter() - self._began
+        if self._torch is not None:
+            self._torch.__exit__(None, None, None)
+        self._snapshot = tracemalloc.take_snapshot()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+    def stage_started(self, stage):
+        # Called from metrics spans; nested stages fold their peak into the enclosing one
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stack:
+            self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+        self._stack.append({'stage': stage, 'traced': current, 'peak': 0, 'rss': rss_bytes()})
+
+    def stage_finished(self, stage, seconds, labels):
+        if not self._stack:
+            return
+        frame = self._stack.pop()
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(frame['peak'], peak)
+        if self._stack:
+            self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+        self.stages.append({
+            'stage': stage,
+            **{key: str(value) for key, value in labels.items()},
+            'ms': round(seconds * 1000, 3),
+            'python_alloc_delta_kb': round((current - frame['traced']) / 1024, 1),
+            'python_peak_above_start_kb': round((peak - frame['traced']) / 1024, 1),
+            'rss_delta_mb': round((rss_bytes() - frame['rss']) / (1024 * 1024), 2)
+        })
+
+    def save(self):
+        # Write every artifact into this request's folder, then drop the oldest folders over the limit
+        os.makedirs(self.path, exist_ok=True)
+
+        self._python.dump_stats(os.path.join(self.path, 'python.prof'))
+        text = io.StringIO()
+        pstats.Stats(self._python, stream=text).sort_stats('cumulative').print_stats(40)
+        with open(os.path.join(self.path, 'python.txt'), 'w') as f:
+            f.write(text.getvalue())
+
+        if self._torch is not None:
+            try:
+                self._torch.export_chrome_trace(os.path.join(self.path, 'torch_trace.json'))
+                with open(os.path.join(self.path, 'torch_ops.txt'), 'w') as f:
+                    f.write(self._torch.key_averages().table(sort_by='self_cpu_time_total', row_limit=30))
+            except Exception as e:
+                self.logger.warning(f"Could not export torch profile: {e}")
+
+        top_allocations = [
+            {'location': str(stat.traceback[0]), 'size_kb': round(stat.size / 1024, 1), 'count': stat.count}
+            for stat in self._snapshot.statistics('lineno')[:25]
+        ]
+        with open(os.path.join(self.path, 'stages.json'), 'w') as f:
+            json.dump({
+                'profile_id': self.profile_id,
+                'request': self.name,
+                'seconds': round(self.seconds, 4),
+                'stages': self.stages,
+                'top_allocations': top_allocations
+            }, f, indent=2)
+
+        rotate_profiles(self.profile_dir)
+        self.logger.info(f"Request profile written to {self.path}")
+
+
+def rotate_profiles(profile_dir=PROFILE_DIR, keep=PROFILE_MAX_PROFILES):
+    # Keep the newest profile folders; folder names start with a timestamp so they sort by age
+    try:
+        folders = sorted(
+            entry.path for entry in os.scandir(profile_dir) if entry.is_dir()
+        )
+    except FileNotFoundError:
+        return
+    for path in folders[:max(len(folders) - keep, 0)]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+@contextmanager
+def profile_request(name):
+    # Profile the block and yield the RequestProfile, or None when another request is already being profiled
+    if not _profile_lock.acquire(blocking=False):
+        yield None
+        return
+
+    profile = RequestProfile(name)
+    token = _active.set(profile)
+    try:
+        profile.start()
+        try:
+            yield profile
+        finally:
+            profile.stop()
+            try:
+                profile.save()
+            except Exception as e:
+                profile.logger.error(f"Failed to write request profile: {e}")
+    finally:
+        _active.reset(token)
+        _profile_lock.release()
+
+
+def maybe_profile(name, enabled):
+    # profile_request when enabled, otherwise a no-op context yielding None
+    return profile_request(name) if enabled else nullcontext()
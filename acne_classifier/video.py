@@ -0,0 +1,382 @@
+import argparse
+import json
+import logging
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import cv2
+import numpy as np
+from .config import (
+    SEVERITY_MAP, MAX_IMAGE_SIDE, MULTI_FACE_MIN_SIZE,
+    VIDEO_DETECT_EVERY, VIDEO_TRACK_MIN_SCORE, VIDEO_TRACK_SEARCH_MARGIN,
+    VIDEO_SAMPLE_MIN_INTERVAL, VIDEO_SAMPLE_MAX_INTERVAL, VIDEO_SAMPLE_CHANGE_THRESHOLD,
+    VIDEO_BATCH_SIZE, VIDEO_MAX_INFLIGHT_BATCHES, VIDEO_MAX_SAMPLES, VIDEO_MAX_FRAMES
+)
+from .metrics import metrics, span
+from .prediction import clip_bbox, detect_faces
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.webm', '.avi', '.mkv')
+
+
+class FaceTracker:
+    # Follows one face between detector runs by matching its grayscale template inside a window around
+    # the last position. Template and window are downscaled to template_width, so a match costs well
+    # under a millisecond. The template is only replaced by the detector, so tracking cannot drift far
+    def __init__(self, min_score=VIDEO_TRACK_MIN_SCORE, search_margin=VIDEO_TRACK_SEARCH_MARGIN, template_width=48):
+        self.min_score = min_score
+        self.search_margin = search_margin
+        self.template_width = template_width
+        self.bbox = None
+        self._template = None
+        self._scale = 1.0
+
+    def reset(self, img_rgb, bbox):
+        # Start tracking from a detector box
+        x1, y1, x2, y2 = bbox
+        self._scale = min(1.0, self.template_width / max(x2 - x1, 1))
+        self._template = self._gray(img_rgb[y1:y2, x1:x2])
+        self.bbox = tuple(bbox)
+
+    def clear(self):
+        self.bbox = None
+        self._template = None
+
+    def _gray(self, region):
+        gray = cv2.cvtColor(np.ascontiguousarray(region), cv2.COLOR_RGB2GRAY)
+        if self._scale < 1.0:
+            size = (max(int(round(gray.shape[1] * self._scale)), 1), max(int(round(gray.shape[0] * self._scale)), 1))
+            gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+        return gray
+
+    def update(self, img_rgb):
+        # The face's box in this frame and the match score; the box is None once the face is lost
+        if self.bbox is None:
+            return None, 0.0
+
+        height, width = img_rgb.shape[:2]
+        x1, y1, x2, y2 = self.bbox
+        box_width, box_height = x2 - x1, y2 - y1
+        margin_x, margin_y = int(box_width * self.search_margin), int(box_height * self.search_margin)
+        wx1, wy1 = max(x1 - margin_x, 0), max(y1 - margin_y, 0)
+        wx2, wy2 = min(x2 + margin_x, width), min(y2 + margin_y, height)
+
+        window = self._gray(img_rgb[wy1:wy2, wx1:wx2])
+        template_height, template_width = self._template.shape
+        if window.shape[0] < template_height or window.shape[1] < template_width:
+            self.clear()
+            return None, 0.0
+
+        scores = cv2.matchTemplate(window, self._template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (match_x, match_y) = cv2.minMaxLoc(scores)
+        if not np.isfinite(score) or score < self.min_score:
+            self.clear()
+            return None, float(score) if np.isfinite(score) else 0.0
+
+        # Keep the unclipped box so a face partly leaving the frame keeps its size
+        nx1 = wx1 + int(round(match_x / self._scale))
+        ny1 = wy1 + int(round(match_y / self._scale))
+        self.bbox = (nx1, ny1, nx1 + box_width, ny1 + box_height)
+        bbox = clip_bbox(self.bbox, img_rgb.shape)
+        if bbox is None:
+            self.clear()
+        return bbox, float(score)
+
+
+class VideoAnalyzer:
+    # Severity estimate for one clip or live frame stream. feed() takes frames in order and returns the
+    # sampled frames whose batch has been classified so far; finish() returns the aggregated estimate.
+    # Classification runs on a background thread, so feed() only pays for detection or tracking. With
+    # realtime=True a busy classifier makes sampling skip frames; with realtime=False feed() waits for it
+    # instead, so the sampled frames of a file do not depend on CPU load
+    def __init__(self, predictor, detect_every=VIDEO_DETECT_EVERY, min_interval=VIDEO_SAMPLE_MIN_INTERVAL,
+                 max_interval=VIDEO_SAMPLE_MAX_INTERVAL, change_threshold=VIDEO_SAMPLE_CHANGE_THRESHOLD,
+                 batch_size=VIDEO_BATCH_SIZE, max_inflight=VIDEO_MAX_INFLIGHT_BATCHES, max_samples=VIDEO_MAX_SAMPLES,
+                 min_face_size=MULTI_FACE_MIN_SIZE, tracker=None, realtime=True):
+        self.predictor = predictor
+        self.detect_every = max(detect_every, 1)
+        self.min_interval = max(min_interval, 1)
+        self.max_interval = max(max_interval, self.min_interval)
+        self.change_threshold = change_threshold
+        self.batch_size = max(batch_size, 1)
+        self.max_inflight = max(max_inflight, 1)
+        self.max_samples = max_samples
+        self.min_face_size = min_face_size
+        self.tracker = tracker or FaceTracker()
+        self.realtime = realtime
+        self.logger = logging.getLogger(__name__)
+
+        self.frame_count = 0
+        self.counts = {'detector_runs': 0, 'tracked_frames': 0, 'frames_without_face': 0, 'skipped_busy': 0, 'failed_samples': 0}
+        self.samples = []
+        self._pending = []
+        self._inflight = deque()
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='video-classify')
+        self._next_detection = 0
+        self._last_sample = None
+        self._last_thumbnail = None
+        self._submitted = 0
+        self._started = time.perf_counter()
+
+    @property
+    def done(self):
+        # True once the sample budget is used up; later frames are not worth decoding
+        return bool(self.max_samples) and self._submitted >= self.max_samples
+
+    def feed(self, img_rgb, timestamp=None):
+        index = self.frame_count
+        self.frame_count += 1
+
+        bbox, score = self._locate(img_rgb, index)
+        if bbox is not None and self._should_sample(img_rgb, bbox, index):
+            self._pending.append({
+                'frame': index,
+                'timestamp': timestamp,
+                'bbox': bbox,
+                'face_score': score,
+                # Own copy of the crop, so callers may reuse their frame buffer
+                'crop': np.array(self.predictor.processor.crop_resize(img_rgb, bbox))
+            })
+            self._submitted += 1
+            if len(self._pending) >= self.batch_size or self.done:
+                self._flush()
+        return self._collect()
+
+    def _locate(self, img_rgb, index):
+        # Track between detector runs; run the detector on schedule or as soon as tracking loses the face
+        if self.tracker.bbox is not None and index < self._next_detection:
+            with span('face_tracking'):
+                bbox, score = self.tracker.update(img_rgb)
+            if bbox is not None:
+                self.counts['tracked_frames'] += 1
+                return bbox, score
+            self._next_detection = index
+
+        if index < self._next_detection:
+            self.counts['frames_without_face'] += 1
+            return None, 0.0
+
+        with span('face_detection') as detection:
+            detections = detect_faces(img_rgb, self.predictor.face_app, self.min_face_size, max_count=1)
+            if isinstance(detections, dict):
+                detection.fail()
+        self.counts['detector_runs'] += 1
+        self._next_detection = index + self.detect_every
+
+        if isinstance(detections, dict):
+            self.tracker.clear()
+            self._last_thumbnail = None
+            self.counts['frames_without_face'] += 1
+            return None, 0.0
+
+        face = detections[0]
+        self.tracker.reset(img_rgb, face['bbox'])
+        return face['bbox'], face['det_score']
+
+    def _should_sample(self, img_rgb, bbox, index):
+        # Classify a frame when the face looks different from the last sample, or the last sample is too old
+        if self.done:
+            return False
+        since = index - self._last_sample if self._last_sample is not None else None
+        if since is not None and since < self.min_interval:
+            return False
+
+        # Back off while the classifier is behind, so a slow CPU lowers the sampling rate instead of lagging
+        if self.realtime and self._busy() >= self.max_inflight:
+            self.counts['skipped_busy'] += 1
+            return False
+
+        x1, y1, x2, y2 = bbox
+        thumbnail = cv2.resize(
+            cv2.cvtColor(np.ascontiguousarray(img_rgb[y1:y2, x1:x2]), cv2.COLOR_RGB2GRAY),
+            (16, 16),
+            interpolation=cv2.INTER_AREA
+        ).astype(np.float32)
+        changed = (
+            self._last_thumbnail is None
+            or since >= self.max_interval
+            or float(np.abs(thumbnail - self._last_thumbnail).mean()) >= self.change_threshold
+        )
+        if changed:
+            self._last_sample = index
+            self._last_thumbnail = thumbnail
+        return changed
+
+    def _busy(self):
+        return sum(1 for _, future in self._inflight if not future.done())
+
+    def _flush(self):
+        if not self._pending:
+            return
+        # Offline, wait for a batch to finish rather than queueing without bound
+        while not self.realtime and self._busy() >= self.max_inflight:
+            wait([future for _, future in self._inflight], return_when=FIRST_COMPLETED)
+        batch, self._pending = self._pending, []
+        self._inflight.append((batch, self._executor.submit(self._classify, [item['crop'] for item in batch])))
+
+    def _classify(self, crops):
+        # All sampled crops of a batch share one forward pass (or one engine submission)
+        with span('video_forward'):
+            pixel_values = self.predictor.processor.preprocess_batch(crops)
+            return self.predictor.classify(pixel_values)
+
+    def _collect(self, wait=False):
+        # Per-frame results of the finished batches, in frame order
+        finished = []
+        while self._inflight and (wait or self._inflight[0][1].done()):
+            batch, future = self._inflight.popleft()
+            try:
+                predictions = future.result()
+            except Exception as e:
+                self.logger.error(f"Video batch classification failed: {str(e)}")
+                self.counts['failed_samples'] += len(batch)
+                continue
+            for item, prediction in zip(batch, predictions):
+                finished.append({
+                    'frame': item['frame'],
+                    'timestamp': item['timestamp'],
+                    'bbox': list(item['bbox']),
+                    'severity': prediction['severity'],
+                    'predicted_class_id': int(prediction['predicted_class_id']),
+                    'confidence': float(prediction['confidence']),
+                    'probabilities': [float(p) for p in prediction['probabilities']],
+                    'face_score': float(item['face_score']),
+                    'weight': float(item['face_score']) * float(prediction['confidence'])
+                })
+        self.samples.extend(finished)
+        return finished
+
+    def finish(self):
+        # Classify what is still pending and aggregate every sampled frame into one estimate
+        try:
+            self._flush()
+            self._collect(wait=True)
+        finally:
+            self.close()
+        return self.summary()
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def summary(self):
+        # Confidence-weighted mean of the sampled frames' probabilities; each frame counts by its
+        # classifier confidence times how sure detection or tracking was about the face
+        elapsed = time.perf_counter() - self._started
+        stats = dict(
+            self.counts,
+            frames=self.frame_count,
+            sampled_frames=len(self.samples),
+            seconds=round(elapsed, 3),
+            fps=round(self.frame_count / elapsed, 1) if elapsed else None
+        )
+        if not self.samples:
+            return {'error': 'No face detected in the video', 'stats': stats}
+
+        probabilities = np.array([sample['probabilities'] for sample in self.samples])
+        weights = np.array([sample['weight'] for sample in self.samples])
+        if weights.sum() <= 0:
+            weights = np.ones_like(weights)
+        mean = weights @ probabilities / weights.sum()
+
+        id2label = self.predictor.model_config_dict['id2label']
+        class_id = int(mean.argmax())
+        predicted_label = id2label[str(class_id)]
+        return {
+            'severity': SEVERITY_MAP[str(predicted_label)],
+            'predicted_label': predicted_label,
+            'predicted_class_id': class_id,
+            'confidence': float(mean[class_id]),
+            'probabilities': {SEVERITY_MAP[str(id2label[str(i)])]: float(p) for i, p in enumerate(mean)},
+            # Share of sampled frames that agree with the aggregate; low values mean an unstable estimate
+            'agreement': float(np.mean([sample['predicted_class_id'] == class_id for sample in self.samples])),
+            'samples': self.samples,
+            'stats': stats
+        }
+
+
+def iter_video_frames(source, max_frames=VIDEO_MAX_FRAMES, max_side=MAX_IMAGE_SIDE):
+    # Decode a video file into (RGB frame, timestamp in seconds), downscaling frames above max_side
+    capture = cv2.VideoCapture(str(source))
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video: {source}")
+    try:
+        count = 0
+        while not max_frames or count < max_frames:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            timestamp = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            if max_side and max(frame.shape[:2]) > max_side:
+                scale = max_side / max(frame.shape[:2])
+                frame = cv2.resize(frame, (int(frame.shape[1] * scale), int(frame.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), timestamp
+            count += 1
+    finally:
+        capture.release()
+
+
+def analyze_video(source, predictor, max_frames=VIDEO_MAX_FRAMES, **options):
+    # Severity estimate for a whole video file; decoding stops once the sample budget is used up. A file
+    # can wait for the classifier, so sampling never backs off and the result does not depend on CPU load
+    logger = logging.getLogger(__name__)
+
+    analyzer = None
+    try:
+        logger.info(f"Starting video analysis for: {source}")
+        options.setdefault('realtime', False)
+        analyzer = VideoAnalyzer(predictor, **options)
+        for img_rgb, timestamp in iter_video_frames(source, max_frames):
+            analyzer.feed(img_rgb, timestamp)
+            if analyzer.done:
+                break
+        result = analyzer.finish()
+
+        if 'error' not in result:
+            metrics.inc('acne_predictions_total', severity=result['severity'])
+            logger.info(
+                f"Video analysis completed: {result['predicted_label']} (confidence: {result['confidence']:.4f}, "
+                f"{result['stats']['sampled_frames']} of {result['stats']['frames']} frames sampled)"
+            )
+        return result
+
+    except Exception as e:
+        if analyzer is not None:
+            analyzer.close()
+        logger.error(f"Video analysis failed: {str(e)}")
+        return {'error': f'Video analysis failed: {str(e)}'}
+
+
+def main(argv=None):
+    # Command-line entry point: python -m acne_classifier.video clip.mp4 --detect-every 10
+    from .model_loader import ModelLoader
+    from .prediction import AcnePredictor
+
+    parser = argparse.ArgumentParser(description="Estimate acne severity from a video clip")
+    parser.add_argument('source', help="Video file")
+    parser.add_argument('--detect-every', type=int, default=VIDEO_DETECT_EVERY, help="Frames between detector runs")
+    parser.add_argument('--max-samples', type=int, default=VIDEO_MAX_SAMPLES, help="Frames classified at most")
+    parser.add_argument('--max-frames', type=int, default=VIDEO_MAX_FRAMES, help="Frames decoded at most")
+    parser.add_argument('--batch-size', type=int, default=VIDEO_BATCH_SIZE, help="Sampled faces per ViT forward pass")
+    parser.add_argument('--timeline', action='store_true', help="Include every sampled frame in the output")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    loader = ModelLoader()
+    model, processor = loader.load_acne_model()
+    face_app = loader.load_face_detection()
+    predictor = AcnePredictor(model, processor, face_app, loader.model_config_dict)
+
+    result = analyze_video(
+        args.source,
+        predictor,
+        max_frames=args.max_frames,
+        detect_every=args.detect_every,
+        max_samples=args.max_samples,
+        batch_size=args.batch_size
+    )
+    if not args.timeline:
+        result.pop('samples', None)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
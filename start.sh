@@ -24,4 +24,10 @@ mkdir -p web/logs
 
 # Start the application
 echo "Starting production server on $HOST:$PORT..."
-cd web && python app.py
+cd web
+if [ "${WORKERS:-1}" -gt 1 ]; then
+    # Pre-fork mode: models load once in the master and are shared with $WORKERS workers
+    exec gunicorn -c gunicorn.conf.py app:app
+else
+    python app.py
+fi
@@ -0,0 +1,61 @@
+import json
+
+from acne_classifier.batch_classify import JsonlWriter, open_writer
+
+
+def write_records(writer, paths):
+    for path in paths:
+        writer.write({'path': path, 'severity': 'mild'})
+    writer.close()
+
+
+def test_resume_appends_and_reports_completed(tmp_path):
+    output = tmp_path / 'out' / 'results.jsonl'
+    write_records(JsonlWriter(output), ['a.jpg', 'b.jpg'])
+
+    writer = JsonlWriter(output)
+    assert writer.completed() == {'a.jpg', 'b.jpg'}
+    write_records(writer, ['c.jpg'])
+
+    lines = output.read_text().splitlines()
+    assert [json.loads(line)['path'] for line in lines] == ['a.jpg', 'b.jpg', 'c.jpg']
+
+
+def test_partial_last_line_is_truncated(tmp_path):
+    output = tmp_path / 'results.jsonl'
+    output.write_text('{"path": "a.jpg"}\n{"path": "b.j')
+
+    writer = JsonlWriter(output)
+    assert output.read_text() == '{"path": "a.jpg"}\n'
+    assert writer.completed() == {'a.jpg'}
+    write_records(writer, ['b.jpg'])
+    assert [json.loads(line)['path'] for line in output.read_text().splitlines()] == ['a.jpg', 'b.jpg']
+
+
+def test_partial_only_line_is_truncated_to_empty(tmp_path):
+    output = tmp_path / 'results.jsonl'
+    output.write_text('{"path": "a.')
+    JsonlWriter(output).close()
+    assert output.read_text() == ''
+
+
+def test_completed_skips_unparseable_lines(tmp_path):
+    output = tmp_path / 'results.jsonl'
+    output.write_text('{"path": "a.jpg"}\nnot json\n{"severity": "mild"}\n')
+    assert JsonlWriter(output).completed() == {'a.jpg'}
+
+
+def test_fresh_discards_previous_results(tmp_path):
+    output = tmp_path / 'results.jsonl'
+    write_records(JsonlWriter(output), ['a.jpg'])
+
+    writer = JsonlWriter(output, fresh=True)
+    assert writer.completed() == set()
+    write_records(writer, ['b.jpg'])
+    assert [json.loads(line)['path'] for line in output.read_text().splitlines()] == ['b.jpg']
+
+
+def test_open_writer_picks_jsonl_for_other_extensions(tmp_path):
+    writer = open_writer(tmp_path / 'results.json')
+    assert isinstance(writer, JsonlWriter)
+    writer.close()
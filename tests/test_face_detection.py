@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('insightface')
+from acne_classifier.face_detection import FaceDetector
+
+
+class FakeDetModel:
+    # Records every detect call; returns one face in input-image coordinates when the pass has faces
+    def __init__(self, faces_per_pass):
+        self.faces_per_pass = list(faces_per_pass)
+        self.calls = []
+
+    def detect(self, img, input_size=None, max_num=0):
+        self.calls.append({'shape': img.shape, 'input_size': input_size})
+        if not self.faces_per_pass.pop(0):
+            return np.zeros((0, 5), dtype=np.float32), None
+        height, width = img.shape[:2]
+        bboxes = np.array([[width * 0.25, height * 0.25, width * 0.75, height * 0.75, 0.9]], dtype=np.float32)
+        kpss = np.array([[[width * 0.5, height * 0.5]] * 5], dtype=np.float32)
+        return bboxes, kpss
+
+
+def image(height=960, width=1280):
+    return np.zeros((height, width, 3), dtype=np.uint8)
+
+
+def test_coarse_pass_hit_skips_full_pass_and_rescales():
+    det_model = FakeDetModel([True])
+    faces = FaceDetector(det_model, det_size=(640, 640), coarse_size=(320, 320)).get(image())
+
+    assert len(det_model.calls) == 1
+    assert det_model.calls[0]['input_size'] == (320, 320)
+    assert det_model.calls[0]['shape'][:2] == (240, 320)
+    np.testing.assert_allclose(faces[0].bbox, [320, 240, 960, 720], atol=1)
+    np.testing.assert_allclose(faces[0].kps[0], [640, 480], atol=1)
+    assert faces[0].det_score == pytest.approx(0.9)
+
+
+def test_coarse_pass_miss_falls_back_to_full_size():
+    det_model = FakeDetModel([False, True])
+    faces = FaceDetector(det_model, det_size=(640, 640), coarse_size=(320, 320)).get(image())
+
+    assert [call['input_size'] for call in det_model.calls] == [(320, 320), (640, 640)]
+    assert det_model.calls[1]['shape'][:2] == (960, 1280)
+    np.testing.assert_allclose(faces[0].bbox, [320, 240, 960, 720], atol=1)
+
+
+def test_no_face_in_either_pass():
+    det_model = FakeDetModel([False, False])
+    assert FaceDetector(det_model, coarse_size=(320, 320)).get(image()) == []
+    assert len(det_model.calls) == 2
+
+
+@pytest.mark.parametrize('height, width', [(200, 300), (600, 800)])
+def test_image_not_much_larger_than_detector_size_skips_coarse_pass(height, width):
+    det_model = FakeDetModel([True])
+    FaceDetector(det_model, det_size=(640, 640), coarse_size=(320, 320)).get(image(height, width))
+    assert [call['input_size'] for call in det_model.calls] == [(640, 640)]
+    assert det_model.calls[0]['shape'][:2] == (height, width)
+
+
+def test_full_flag_skips_coarse_pass():
+    det_model = FakeDetModel([True])
+    FaceDetector(det_model, det_size=(640, 640), coarse_size=(320, 320)).get(image(), full=True)
+    assert [call['input_size'] for call in det_model.calls] == [(640, 640)]
+
+
+def test_without_coarse_size_runs_single_full_pass():
+    det_model = FakeDetModel([True])
+    FaceDetector(det_model, det_size=(640, 640), coarse_size=None).get(image())
+    assert [call['input_size'] for call in det_model.calls] == [(640, 640)]
+
+
+class GroupDetModel:
+    # A group photo: one large face in front, smaller faces behind it that only the full-size pass resolves
+    FACES = [(800, 300, 1200, 800), (200, 400, 300, 520), (1500, 420, 1600, 540)]
+
+    def __init__(self):
+        self.calls = []
+
+    def detect(self, img, input_size=None, max_num=0):
+        self.calls.append(input_size)
+        scale = img.shape[1] / 1920
+        faces = self.FACES if input_size == (640, 640) else self.FACES[:1]
+        bboxes = np.array([[v * scale for v in face] + [0.9] for face in faces], dtype=np.float32)
+        return bboxes, None
+
+
+def test_multi_face_detection_finds_small_faces_the_coarse_pass_misses():
+    from acne_classifier.prediction import detect_faces
+
+    det_model = GroupDetModel()
+    detector = FaceDetector(det_model, det_size=(640, 640), coarse_size=(320, 320))
+    img = image(1080, 1920)
+
+    # The single-face path may stop at the coarse pass, which only sees the large face
+    assert len(detector.get(img)) == 1
+    assert det_model.calls == [(320, 320)]
+
+    det_model.calls.clear()
+    detections = detect_faces(img, detector, min_size=48, max_count=16)
+    assert det_model.calls == [(640, 640)]
+    assert [face['bbox'] for face in detections] == [(800, 300, 1200, 800), (200, 400, 300, 520), (1500, 420, 1600, 540)]
+
+
+def test_multi_face_detection_only_treats_none_as_no_limit():
+    from acne_classifier.prediction import detect_faces
+
+    detector = FaceDetector(GroupDetModel(), det_size=(640, 640), coarse_size=(320, 320))
+    img = image(1080, 1920)
+
+    assert len(detect_faces(img, detector, min_size=48, max_count=None)) == 3
+    assert len(detect_faces(img, detector, min_size=48, max_count=2)) == 2
+    assert detect_faces(img, detector, min_size=48, max_count=0) == []
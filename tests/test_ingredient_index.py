@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy')
+from acne_classifier.ingredient_index import IngredientIndex, normalize_inci, parse_ingredient_list, split_ingredients
+
+
+def test_split_keeps_commas_inside_parentheses():
+    assert split_ingredients('Aqua, Extract (Leaf, Root), Glycerin') == ['Aqua', ' Extract (Leaf, Root)', ' Glycerin']
+
+
+@pytest.mark.parametrize('ingredient, names', [
+    ('Aqua (Water)', ['aqua (water)', 'aqua', 'water']),
+    ('Aqua/Water', ['aqua/water', 'aqua', 'water']),
+    ('Parfum [Fragrance]', ['parfum [fragrance]', 'parfum', 'fragrance']),
+    ('  Salicylic   Acid. ', ['salicylic acid']),
+    ('Tocopherol (Vitamin E) Acetate', ['tocopherol (vitamin e) acetate']),
+    ('', []),
+])
+def test_normalize_inci(ingredient, names):
+    assert normalize_inci(ingredient) == names
+
+
+def test_parse_ingredient_list_deduplicates():
+    assert parse_ingredient_list('Aqua (Water), Water, Glycerin') == ['aqua (water)', 'aqua', 'water', 'glycerin']
+
+
+@pytest.fixture
+def index():
+    return IngredientIndex.build([
+        'Aqua, Salicylic Acid, Glycerin',
+        'Water, Glyceryl Stearate, Citric Acid',
+        'Aqua (Water), Niacinamide, Tocopherol (Vitamin E) Acetate',
+        'Hyaluronic Acid, Sodium Hyaluronate',
+    ])
+
+
+def test_matches_whole_tokens_only(index):
+    # "Acid" is not an ingredient of any product, and "Glycerin" does not match "Glyceryl Stearate"
+    assert index.match_counts(['Acid']).tolist() == [0, 0, 0, 0]
+    assert index.match_counts(['Glycerin']).tolist() == [1, 0, 0, 0]
+    assert index.match_counts(['Hyaluronic Acid']).tolist() == [0, 0, 0, 1]
+
+
+def test_matches_any_alias_of_a_target(index):
+    assert index.match_counts(['Water']).tolist() == [0, 1, 1, 0]
+    assert index.match_counts(['Aqua/Water']).tolist() == [1, 1, 1, 0]
+
+
+def test_inner_parenthetical_is_not_an_alias(index):
+    assert index.match_counts(['Vitamin E']).tolist() == [0, 0, 0, 0]
+    assert index.match_counts(['Tocopherol (Vitamin E) Acetate']).tolist() == [0, 0, 1, 0]
+
+
+def test_counts_each_target_once(index):
+    assert index.match_counts(['Salicylic Acid', 'Glycerin', 'Niacinamide', 'Unknown']).tolist() == [2, 0, 1, 0]
+    assert index.match_counts([]).dtype == np.int32
+
+
+def test_rebuild_reuses_unchanged_rows():
+    texts = ['Aqua, Salicylic Acid, Glycerin', 'Squalane']
+    hashes = ['a', 'b']
+    first = IngredientIndex.build(texts, hashes=hashes)
+    rebuilt = IngredientIndex.build(['Squalane', 'Aqua, Salicylic Acid, Glycerin', 'Niacinamide'],
+                                    hashes=['b', 'a', 'c'], previous=first)
+    assert rebuilt.match_counts(['Glycerin', 'Niacinamide']).tolist() == [0, 1, 1]
+    assert rebuilt.match_counts(['Squalane']).tolist() == [1, 0, 0]
@@ -0,0 +1,217 @@
+import asyncio
+import email.utils
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('openai')
+from acne_classifier.fake_openai import FakeOpenAIServer
+from acne_classifier.openai_client import ConcurrencyLimiter, OpenAIClient, parse_duration, retry_after
+
+MESSAGES = [{'role': 'user', 'content': 'Plan for mild acne'}]
+
+
+@pytest.fixture
+def server():
+    with FakeOpenAIServer() as server:
+        yield server
+
+
+def client_for(server, **options):
+    options = dict({'max_retries': 3, 'retry_base_delay': 0.01, 'retry_max_delay': 5, 'timeout': 10}, **options)
+    return OpenAIClient(api_key='test', base_url=server.url, **options)
+
+
+@pytest.mark.parametrize('value, seconds', [
+    ('20ms', 0.02),
+    ('1.5s', 1.5),
+    ('6m0s', 360),
+    ('1h2m', 3720),
+    ('', None),
+    ('soon', None),
+])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == (pytest.approx(seconds) if seconds is not None else None)
+
+
+def test_retry_after_headers():
+    assert retry_after(None) is None
+    assert retry_after({}) is None
+    assert retry_after({'retry-after-ms': '250', 'retry-after': '9'}) == pytest.approx(0.25)
+    assert retry_after({'retry-after': '3'}) == 3.0
+    assert retry_after({'retry-after': email.utils.formatdate(time.time() + 30)}) == pytest.approx(30, abs=2)
+    assert retry_after({'retry-after': email.utils.formatdate(time.time() - 30)}) == 0.0
+
+
+def test_retry_after_uses_only_exhausted_rate_limit_budgets():
+    headers = {
+        'x-ratelimit-remaining-requests': '0', 'x-ratelimit-reset-requests': '2s',
+        'x-ratelimit-remaining-tokens': '100', 'x-ratelimit-reset-tokens': '30s'
+    }
+    assert retry_after(headers) == 2.0
+    headers['x-ratelimit-remaining-tokens'] = '0'
+    assert retry_after(headers) == 30.0
+    assert retry_after({'x-ratelimit-remaining-requests': '5', 'x-ratelimit-reset-requests': '2s'}) is None
+
+
+def test_retries_rate_limited_calls(server):
+    client = client_for(server)
+    server.fail_next(2, status=429, retry_after=0)
+    response = client.chat_completion(MESSAGES)
+
+    assert response.choices[0].message.content
+    assert server.requests['failed'] == 2 and server.requests['chat'] == 1
+    assert client.stats()['retries'] == 2
+
+
+def test_does_not_retry_bad_requests(server):
+    import openai
+
+    client = client_for(server)
+    server.fail_next(1, status=400)
+    with pytest.raises(openai.BadRequestError):
+        client.chat_completion(MESSAGES)
+    assert client.stats()['retries'] == 0
+    assert client.stats()['errors'] == 1
+
+
+def test_gives_up_when_asked_to_wait_too_long(server):
+    import openai
+
+    client = client_for(server, retry_max_delay=1)
+    server.fail_next(1, status=429, retry_after=120)
+    with pytest.raises(openai.RateLimitError):
+        client.chat_completion(MESSAGES)
+    assert server.requests['failed'] == 1 and server.requests['chat'] == 0
+
+
+def test_coalesces_identical_sync_calls(server):
+    server.latency = 0.2
+    client = client_for(server)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.chat_completion(MESSAGES))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 8
+    assert server.requests['chat'] == 1
+    assert client.stats()['coalesced'] == 7
+
+
+def test_coalesces_identical_async_calls(server):
+    server.latency = 0.2
+    client = client_for(server)
+
+    async def calls():
+        return await asyncio.gather(*[client.chat_completion_async(MESSAGES) for _ in range(8)])
+
+    results = asyncio.run(calls())
+    assert len(results) == 8
+    assert server.requests['chat'] == 1
+    assert client.stats()['coalesced'] == 7
+
+
+def test_in_flight_counts_calls_on_every_loop(server):
+    server.latency = 0.4
+    client = client_for(server)
+    threads = [
+        threading.Thread(target=asyncio.run, args=(client.chat_completion_async([{'role': 'user', 'content': str(i)}]),))
+        for i in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    assert client.stats()['in_flight'] == 2
+    for thread in threads:
+        thread.join()
+    assert client.stats()['in_flight'] == 0
+
+
+def test_limiter_is_shared_by_threads_and_event_loops():
+    limiter = ConcurrencyLimiter(2)
+    lock = threading.Lock()
+    active, peak, done = [0], [0], []
+
+    def enter():
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+
+    def leave():
+        with lock:
+            active[0] -= 1
+            done.append(1)
+
+    def sync_call():
+        with limiter:
+            enter()
+            time.sleep(0.05)
+            leave()
+
+    async def async_call():
+        await limiter.acquire_async()
+        try:
+            enter()
+            await asyncio.sleep(0.05)
+            leave()
+        finally:
+            limiter.release()
+
+    async def async_calls():
+        await asyncio.gather(*[async_call() for _ in range(4)])
+
+    threads = [threading.Thread(target=sync_call) for _ in range(4)]
+    threads += [threading.Thread(target=asyncio.run, args=(async_calls(),)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(done) == 12
+    assert peak[0] == 2
+    assert limiter.active == 0 and limiter.waiting == 0
+
+
+def test_cancelled_waiter_gives_its_slot_back():
+    limiter = ConcurrencyLimiter(1)
+
+    async def scenario():
+        await limiter.acquire_async()
+        waiter = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0)
+        # Release hands the slot to the waiter, which is cancelled before it can run
+        limiter.release()
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert limiter.active == 0 and limiter.waiting == 0
+
+
+def test_stream_does_not_hold_a_slot_while_backing_off(server):
+    client = client_for(server, max_concurrency=1)
+    server.fail_next(1, status=429, retry_after=0.5)
+    finished = {}
+
+    async def stream():
+        chunks = [chunk async for chunk in client.stream_chat_completion_async(MESSAGES)]
+        finished['stream'] = time.perf_counter()
+        return chunks
+
+    async def other_call():
+        await asyncio.sleep(0.1)
+        await client.chat_completion_async([{'role': 'user', 'content': 'other'}])
+        finished['other'] = time.perf_counter()
+
+    async def scenario():
+        chunks, _ = await asyncio.gather(stream(), other_call())
+        return chunks
+
+    chunks = asyncio.run(scenario())
+    assert ''.join(chunk.choices[0].delta.content or '' for chunk in chunks)
+    assert finished['other'] < finished['stream']
+    assert client.limiter.active == 0
@@ -0,0 +1,132 @@
+import io
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from acne_classifier.prediction_cache import PredictionCache, perceptual_hash
+
+RESULT = {'severity': 'mild', 'predicted_label': 'level 1', 'confidence': 0.9}
+
+
+def smooth_image(seed=0, height=240, width=200):
+    # Blurred noise: enough structure for a stable perceptual hash
+    noise = np.random.default_rng(seed).integers(0, 256, size=(height // 8, width // 8, 3), dtype=np.uint8)
+    return cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+
+
+def encode(img_rgb, format='PNG'):
+    buffer = io.BytesIO()
+    Image.fromarray(img_rgb).save(buffer, format=format, quality=85)
+    return buffer.getvalue()
+
+
+def test_exact_hit_after_set():
+    cache = PredictionCache(model_version='v1', max_entries=4, enabled=True)
+    key = cache.key(b'image')
+    assert cache.get(key) is None
+    cache.set(key, RESULT)
+    assert cache.get(key) == RESULT
+    assert cache.stats()['hits'] == 1
+
+
+def test_key_depends_on_model_version():
+    assert PredictionCache(model_version='v1').key(b'image') != PredictionCache(model_version='v2').key(b'image')
+
+
+def test_errors_are_not_cached():
+    cache = PredictionCache(model_version='v1', max_entries=4, enabled=True)
+    cache.set('key', {'error': 'No face detected in the image'})
+    assert cache.get('key') is None
+
+
+def test_least_recently_used_is_evicted():
+    cache = PredictionCache(model_version='v1', max_entries=2, enabled=True)
+    cache.set('a', RESULT)
+    cache.set('b', RESULT)
+    cache.get('a')
+    cache.set('c', RESULT)
+    assert cache.get('b') is None
+    assert cache.get('a') == RESULT
+    assert cache.stats()['evictions'] == 1
+
+
+def test_disabled_cache_stores_nothing():
+    cache = PredictionCache(model_version='v1', max_entries=4, enabled=False)
+    cache.set('a', RESULT)
+    assert cache.get('a') is None
+
+
+def test_perceptual_hash_survives_reencoding_and_resizing():
+    img = smooth_image()
+    jpeg = np.array(Image.open(io.BytesIO(encode(img, 'JPEG'))))
+    smaller = cv2.resize(img, (100, 120), interpolation=cv2.INTER_AREA)
+    assert (perceptual_hash(img) ^ perceptual_hash(jpeg)).bit_count() <= 4
+    assert (perceptual_hash(img) ^ perceptual_hash(smaller)).bit_count() <= 4
+    assert (perceptual_hash(img) ^ perceptual_hash(smooth_image(seed=1))).bit_count() > 4
+
+
+def test_similar_lookup_respects_distance():
+    cache = PredictionCache(model_version='v1', max_entries=4, enabled=True, use_phash=True, phash_distance=2)
+    cache.set('a', RESULT, phash=0b1111)
+    assert cache.get_similar(0b1100) == RESULT
+    assert cache.get_similar(0b0000) is None
+    assert PredictionCache(model_version='v1', enabled=True, use_phash=False).get_similar(0b1111) is None
+
+
+class FaceApp:
+    # One face covering the middle of whatever image it is given
+    def get(self, img_rgb):
+        height, width = img_rgb.shape[:2]
+        return [SimpleNamespace(bbox=np.array([width // 4, height // 4, 3 * width // 4, 3 * height // 4]), det_score=0.9)]
+
+
+class Engine:
+    # Counts forward passes instead of running a model
+    def __init__(self):
+        self.calls = 0
+
+    def classify(self, pixel_values):
+        self.calls += 1
+        return dict(RESULT)
+
+
+@pytest.fixture
+def predictor():
+    pytest.importorskip('torch')
+    from acne_classifier.prediction import AcnePredictor
+    from acne_classifier.preprocessing import FacePreprocessor
+
+    processor = FacePreprocessor({'size': {'height': 224, 'width': 224}})
+    cache = PredictionCache(model_version='v1', max_entries=8, enabled=True, use_phash=True, phash_distance=4)
+    return AcnePredictor(None, processor, FaceApp(), {}, engine=Engine(), cache=cache)
+
+
+def test_predictor_serves_exact_repeat_from_cache(predictor):
+    upload = encode(smooth_image())
+    first = predictor.predict(upload)
+    second = predictor.predict(upload)
+
+    assert first['cache'] == 'miss' and second['cache'] == 'hit'
+    assert second['bbox'] == first['bbox']
+    assert predictor.engine.calls == 1
+
+
+def test_phash_hit_reuses_classification_but_not_bbox(predictor):
+    img = smooth_image()
+    original = predictor.predict(encode(img))
+    resized_upload = encode(cv2.resize(img, (100, 120), interpolation=cv2.INTER_AREA))
+    resized = predictor.predict(resized_upload)
+
+    assert resized['cache'] == 'phash_hit'
+    assert resized['severity'] == original['severity']
+    assert original['bbox'] == [50, 60, 150, 180]
+    assert resized['bbox'] == [25, 30, 75, 90]
+    assert predictor.engine.calls == 1
+
+    # The resized bytes are now an exact hit with their own box
+    again = predictor.predict(resized_upload)
+    assert again['cache'] == 'hit'
+    assert again['bbox'] == [25, 30, 75, 90]
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from acne_classifier.config import PREPROCESSOR_CONFIG_PATH
+from acne_classifier.preprocessing import FacePreprocessor, check_parity
+
+# Typical ViT preprocessor_config.json values, so the check runs without the downloaded model
+VIT_PREPROCESSOR_CONFIG = {
+    'do_normalize': True,
+    'do_rescale': True,
+    'do_resize': True,
+    'image_mean': [0.5, 0.5, 0.5],
+    'image_std': [0.5, 0.5, 0.5],
+    'resample': 2,
+    'rescale_factor': 1 / 255,
+    'size': {'height': 224, 'width': 224}
+}
+
+TOLERANCE = 1e-4
+
+
+def image_processor_for(preprocessor_config):
+    transformers = pytest.importorskip('transformers')
+    return transformers.ViTImageProcessor(
+        **{k: v for k, v in preprocessor_config.items() if k != 'image_processor_type'}
+    )
+
+
+def random_crops(count=8, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        rng.integers(0, 256, size=(int(h), int(w), 3), dtype=np.uint8)
+        for h, w in rng.integers(64, 640, size=(count, 2))
+    ]
+
+
+def test_matches_original_pipeline():
+    preprocessor = FacePreprocessor(VIT_PREPROCESSOR_CONFIG)
+    image_processor = image_processor_for(VIT_PREPROCESSOR_CONFIG)
+    assert check_parity(image_processor, preprocessor, random_crops()) < TOLERANCE
+
+
+@pytest.mark.skipif(not PREPROCESSOR_CONFIG_PATH.exists(), reason="pretrain_model not downloaded")
+def test_matches_original_pipeline_with_model_config():
+    preprocessor = FacePreprocessor.from_file(PREPROCESSOR_CONFIG_PATH)
+    import json
+    with open(PREPROCESSOR_CONFIG_PATH, 'r') as f:
+        image_processor = image_processor_for(json.load(f))
+    assert check_parity(image_processor, preprocessor, random_crops()) < TOLERANCE
+
+
+def test_detects_a_different_resize():
+    # A wrong interpolation mapping must not pass the check
+    preprocessor = FacePreprocessor(dict(VIT_PREPROCESSOR_CONFIG, resample=0))
+    image_processor = image_processor_for(VIT_PREPROCESSOR_CONFIG)
+    assert check_parity(image_processor, preprocessor, random_crops()) > TOLERANCE
+
+
+def test_crops_bbox_into_batch():
+    preprocessor = FacePreprocessor(VIT_PREPROCESSOR_CONFIG)
+    image = random_crops(1)[0]
+    bbox = (10, 20, 60, 90)
+    batch = preprocessor.preprocess_batch([image, image], [bbox, None])
+    assert tuple(batch.shape) == (2, 3, 224, 224)
+    x1, y1, x2, y2 = bbox
+    expected = preprocessor.preprocess(np.ascontiguousarray(image[y1:y2, x1:x2]))
+    assert (batch[0] - expected[0]).abs().max().item() == 0
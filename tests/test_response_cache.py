@@ -0,0 +1,174 @@
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from acne_classifier import ingredient_recommendations
+from acne_classifier.ingredient_recommendations import IngredientRecommender, ResponseCache
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ingredient_recommendations.time, 'time', clock)
+    return clock
+
+
+def test_fingerprint_ignores_whitespace_but_not_params():
+    messages = [{'role': 'user', 'content': 'For  mild\nacne'}]
+    same = [{'role': 'user', 'content': 'For mild acne'}]
+    assert ResponseCache.fingerprint('m', messages) == ResponseCache.fingerprint('m', same)
+    assert ResponseCache.fingerprint('m', messages) != ResponseCache.fingerprint('m', messages, temperature=0.7)
+    assert ResponseCache.fingerprint('m', messages) != ResponseCache.fingerprint('other', messages)
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = ResponseCache(ttl=60, max_entries=8, cache_dir=None, enabled=True)
+    cache.set('a', 'plan')
+    clock.now += 59
+    assert cache.get('a') == 'plan'
+    clock.now += 2
+    assert cache.get('a') is None
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['misses'] == 1
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = ResponseCache(ttl=60, max_entries=2, cache_dir=None, enabled=True)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_disabled_cache_stores_nothing():
+    cache = ResponseCache(ttl=60, max_entries=2, cache_dir=None, enabled=False)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+
+
+def test_disk_round_trip_between_workers(tmp_path, clock):
+    writer = ResponseCache(ttl=60, max_entries=8, cache_dir=str(tmp_path), enabled=True)
+    writer.set('a', {'plan': 'x'})
+    assert json.loads((tmp_path / 'a.json').read_text())['value'] == {'plan': 'x'}
+
+    # A fresh in-memory cache (another gunicorn worker) finds the entry on disk and keeps it in memory
+    reader = ResponseCache(ttl=60, max_entries=8, cache_dir=str(tmp_path), enabled=True)
+    assert reader.get('a') == {'plan': 'x'}
+    assert reader.stats()['disk_hits'] == 1
+    os.remove(tmp_path / 'a.json')
+    assert reader.get('a') == {'plan': 'x'}
+    assert reader.stats()['hits'] == 1
+
+
+def test_expired_disk_entry_is_a_miss(tmp_path, clock):
+    ResponseCache(ttl=60, max_entries=8, cache_dir=str(tmp_path), enabled=True).set('a', 'plan')
+    clock.now += 61
+    reader = ResponseCache(ttl=60, max_entries=8, cache_dir=str(tmp_path), enabled=True)
+    assert reader.get('a') is None
+    assert reader.stats()['misses'] == 1
+
+
+def test_disk_store_is_pruned_to_max_entries(tmp_path, clock):
+    cache = ResponseCache(ttl=60, max_entries=2, cache_dir=str(tmp_path), enabled=True)
+    for i, key in enumerate('abc'):
+        cache.set(key, i)
+        os.utime(tmp_path / f'{key}.json', (clock.now + i, clock.now + i))
+    cache._prune_disk()
+    assert sorted(os.listdir(tmp_path)) == ['b.json', 'c.json']
+
+
+class StreamingClient:
+    # Yields one chunk per word, then a final chunk with the given finish_reason
+    def __init__(self, words, finish_reason):
+        self.words = words
+        self.finish_reason = finish_reason
+        self.calls = 0
+
+    async def stream_chat_completion_async(self, messages, **params):
+        self.calls += 1
+        for word in self.words:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word), finish_reason=None)])
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None), finish_reason=self.finish_reason)])
+
+
+def stream_plan(client):
+    async def collect():
+        recommender = IngredientRecommender()
+        return [part async for part in recommender.stream_daily_plan_async('mild', 'Cleanser: Salicylic Acid', {}, client)]
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize('cache_dir', [None, 'disk'])
+def test_stream_caches_only_a_complete_plan(monkeypatch, tmp_path, cache_dir):
+    cache = ResponseCache(ttl=60, max_entries=8, cache_dir=str(tmp_path) if cache_dir else None, enabled=True)
+    monkeypatch.setattr(ingredient_recommendations, 'response_cache', cache)
+
+    truncated = StreamingClient(['Morning:', ' cleanse'], 'length')
+    assert stream_plan(truncated) == ['Morning:', ' cleanse']
+    assert cache.stats()['entries'] == 0
+
+    empty = StreamingClient([], 'stop')
+    assert stream_plan(empty) == []
+    assert cache.stats()['entries'] == 0
+
+    complete = StreamingClient(['Morning:', ' cleanse'], 'stop')
+    assert stream_plan(complete) == ['Morning:', ' cleanse']
+    assert stream_plan(complete) == ['Morning: cleanse']
+    assert complete.calls == 1
+
+
+class CompletionClient:
+    # Returns one chat completion with the given finish_reason, sync or async
+    def __init__(self, content, finish_reason):
+        self.response = SimpleNamespace(choices=[SimpleNamespace(
+            message=SimpleNamespace(content=content), finish_reason=finish_reason
+        )])
+        self.calls = 0
+
+    def chat_completion(self, messages, **params):
+        self.calls += 1
+        return self.response
+
+    async def chat_completion_async(self, messages, **params):
+        self.calls += 1
+        return self.response
+
+
+@pytest.mark.parametrize('content, finish_reason', [
+    ('Morning: cleanse, then', 'length'),
+    ('', 'stop'),
+    ('Morning: cleanse', 'content_filter'),
+])
+def test_plan_is_cached_only_when_complete(monkeypatch, content, finish_reason):
+    cache = ResponseCache(ttl=60, max_entries=8, cache_dir=None, enabled=True)
+    monkeypatch.setattr(ingredient_recommendations, 'response_cache', cache)
+    recommender = IngredientRecommender()
+
+    client = CompletionClient(content, finish_reason)
+    recommender.client = client
+    assert recommender.generate_daily_plan('mild', 'Cleanser: Salicylic Acid', {}) == content
+    assert asyncio.run(recommender.generate_daily_plan_async('mild', 'Cleanser: Salicylic Acid', {}, client)) == content
+    assert cache.stats()['entries'] == 0
+    assert client.calls == 2
+
+    complete = CompletionClient('Morning: cleanse', 'stop')
+    recommender.client = complete
+    recommender.generate_daily_plan('mild', 'Cleanser: Salicylic Acid', {})
+    assert asyncio.run(recommender.generate_daily_plan_async('mild', 'Cleanser: Salicylic Acid', {}, complete)) == 'Morning: cleanse'
+    assert complete.calls == 1
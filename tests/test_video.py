@@ -0,0 +1,60 @@
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+
+from acne_classifier.video import VideoAnalyzer
+
+
+class SlowPredictor:
+    # One face in every frame; classify blocks until released, like a classifier far behind the decoder
+    def __init__(self):
+        self.release = threading.Event()
+        self.face_app = SimpleNamespace(get=lambda img: [SimpleNamespace(bbox=[40, 40, 140, 140], det_score=0.9)])
+        self.processor = SimpleNamespace(
+            crop_resize=lambda img, bbox: img[bbox[1]:bbox[3], bbox[0]:bbox[2]],
+            preprocess_batch=lambda crops: crops
+        )
+        self.model_config_dict = {'id2label': {'0': 'level 0', '1': 'level 1'}}
+
+    def classify(self, pixel_values):
+        self.release.wait(timeout=5)
+        return [{'severity': 'clear_skin', 'predicted_class_id': 0, 'confidence': 0.8, 'probabilities': [0.8, 0.2]}
+                for _ in pixel_values]
+
+
+def frames(count=40):
+    # Fresh noise every frame, so each frame counts as a changed face
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, size=(180, 180, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def analyzer(predictor, realtime):
+    return VideoAnalyzer(predictor, detect_every=1, min_interval=1, max_interval=1, batch_size=1,
+                         max_inflight=1, max_samples=0, realtime=realtime)
+
+
+def test_realtime_sampling_backs_off_while_the_classifier_is_busy():
+    predictor = SlowPredictor()
+    video = analyzer(predictor, realtime=True)
+    for img in frames():
+        video.feed(img)
+    predictor.release.set()
+    result = video.finish()
+
+    assert result['stats']['skipped_busy'] > 0
+    assert result['stats']['sampled_frames'] < 40
+
+
+def test_offline_analysis_waits_for_the_classifier_instead_of_skipping():
+    predictor = SlowPredictor()
+    video = analyzer(predictor, realtime=False)
+    timer = threading.Timer(0.2, predictor.release.set)
+    timer.start()
+    for img in frames():
+        video.feed(img)
+    result = video.finish()
+    timer.cancel()
+
+    assert result['stats']['skipped_busy'] == 0
+    assert result['stats']['sampled_frames'] == 40
@@ -1,22 +1,35 @@
+import json
 import logging
 import os
 import sys
+import tempfile
+import threading
+import time
 from pathlib import Path
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
-import tempfile
 import traceback
 from datetime import datetime
 
-from flask import Flask, request, render_template, jsonify
+from flask import Flask, Response, g, request, render_template, jsonify, stream_with_context
 
 # Add project paths
 parent_dir = Path(__file__).parent.parent
 sys.path.append(str(parent_dir / 'acne_classifier'))
 sys.path.append(str(parent_dir))
 
-from acne_classifier.model_loader import load_models
+from acne_classifier.config import INFERENCE_BACKEND, ORT_INTRA_OP_THREADS, MULTI_FACE_MIN_SIZE, MULTI_FACE_MAX_COUNT
+from acne_classifier.memory import process_memory
+from acne_classifier.metrics import metrics
+from acne_classifier.profiling import maybe_profile, should_profile
+from acne_classifier.model_loader import ModelLoader, set_thread_count
 from acne_classifier.prediction import AcnePredictor
-from acne_classifier.ingredient_recommendations import IngredientRecommender
+from acne_classifier.prediction_cache import PredictionCache
+from acne_classifier.video import VIDEO_EXTENSIONS, analyze_video
+from acne_classifier.batching import BatchingEngine
+from acne_classifier.async_pipeline import AsyncPipeline
+from acne_classifier.ingredient_recommendations import IngredientRecommender, response_cache
+from acne_classifier.openai_client import openai_client
 from acne_classifier.product_search import ProductSearcher
 
 # Production Flask app
@@ -38,37 +51,123 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Global models
+model_loader = None
 predictor = None
+prediction_cache = None
+engine = None
 recommender = None
 searcher = None
+pipeline = None
 models_loaded = False
 
+# Startup progress reported by /health: starting -> loading -> warming -> ready (or failed)
+startup_phase = 'starting'
+startup_timings = {}
+
+# Accepted image uploads; videos accept VIDEO_EXTENSIONS
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+def load_shared_state():
+    """Load fork-safe, memory-heavy state once: ViT weights, product catalog and embedding index"""
+    global model_loader, searcher, startup_phase
+    
+    startup_phase = 'loading'
+    logger.info("Loading shared models...")
+    original_cwd = os.getcwd()
+    os.chdir(parent_dir)
+    
+    model_loader = ModelLoader()
+    
+    # ONNX Runtime sessions do not survive fork, so the ONNX backend is loaded per worker
+    if INFERENCE_BACKEND == 'torch':
+        model_loader.load_acne_model()
+    os.chdir(original_cwd)
+    
+    with model_loader.timed('product_search'):
+        searcher = ProductSearcher()
+
+def init_worker(threads=None):
+    """Create per-process state (ONNX Runtime sessions, threads), warm up and publish models"""
+    global predictor, prediction_cache, engine, recommender, pipeline, models_loaded, startup_phase
+    
+    if threads:
+        set_thread_count(threads)
+    
+    original_cwd = os.getcwd()
+    os.chdir(parent_dir)
+    if model_loader.model is None:
+        model_loader.load_acne_model(intra_op_threads=threads or ORT_INTRA_OP_THREADS)
+    model_loader.load_face_detection(intra_op_threads=threads)
+    os.chdir(original_cwd)
+    
+    recommender = IngredientRecommender()
+    pipeline = AsyncPipeline(recommender, searcher)
+    
+    # Each worker polls the catalog file and hot-swaps its own search snapshot
+    searcher.start_watching()
+    
+    # Publish this worker's metrics for whichever worker answers /metrics
+    metrics.start_flushing()
+    
+    # Only report ready once the first real request will not pay for lazy initialization
+    startup_phase = 'warming'
+    model_loader.warmup()
+    
+    engine = BatchingEngine(model_loader.model, model_loader.model_config_dict).start()
+    
+    # Repeated uploads skip detection and classification; keyed by model version so a new model starts cold
+    prediction_cache = PredictionCache(model_version=model_loader.model_version)
+    predictor = AcnePredictor(
+        model_loader.model, 
+        model_loader.processor, 
+        model_loader.face_app, 
+        model_loader.model_config_dict, 
+        engine=engine,
+        cache=prediction_cache
+    )
+    
+    startup_timings.update(model_loader.timings)
+    models_loaded = True
+    startup_phase = 'ready'
+    logger.info(f"Models loaded successfully (startup timings: {startup_timings})")
+
 def init_models():
-    """Initialize models with error handling"""
-    global predictor, recommender, searcher, models_loaded
+    """Load, warm up and publish models in a single process, recording startup-phase timings"""
+    global startup_phase
     
     if models_loaded:
         return True
     
     try:
-        logger.info("Loading models...")
-        original_cwd = os.getcwd()
-        os.chdir(parent_dir)
-        
-        model, processor, face_app, model_config_dict = load_models()
-        os.chdir(original_cwd)
-        
-        predictor = AcnePredictor(model, processor, face_app, model_config_dict)
-        recommender = IngredientRecommender()
-        searcher = ProductSearcher()
-        
-        models_loaded = True
-        logger.info("Models loaded successfully")
+        started = time.perf_counter()
+        load_shared_state()
+        init_worker()
+        startup_timings['total'] = round(time.perf_counter() - started, 3)
         return True
     except Exception as e:
+        startup_phase = 'failed'
         logger.error(f"Failed to load models: {e}")
         return False
 
+def init_models_in_background():
+    """Start model loading without blocking the server so /health can report progress"""
+    thread = threading.Thread(target=init_models, name='init-models', daemon=True)
+    thread.start()
+    return thread
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # Label by route pattern rather than raw path so label values stay bounded
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    if endpoint != '/metrics':
+        metrics.inc('acne_http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+        metrics.observe('acne_http_request_duration_seconds', time.perf_counter() - g.request_started, endpoint=endpoint)
+    return response
+
 @app.errorhandler(413)
 def file_too_large(e):
     return jsonify({'error': 'File too large (max 16MB)'}), 413
@@ -80,10 +179,104 @@ def internal_error(e):
 
 @app.route('/health')
 def health():
-    """Health check endpoint"""
+    """Health check endpoint; only healthy once models are loaded and warmed up"""
     if models_loaded and predictor is not None:
-        return jsonify({'status': 'healthy', 'timestamp': datetime.utcnow().isoformat()})
-    return jsonify({'status': 'unhealthy'}), 503
+        return jsonify({
+            'status': 'healthy',
+            'phase': startup_phase,
+            'startup_timings': startup_timings,
+            'timestamp': datetime.utcnow().isoformat()
+        })
+    return jsonify({'status': 'unhealthy', 'phase': startup_phase}), 503
+
+@app.route('/stats/batching')
+def batching_stats():
+    """Batching engine queue depth and batch-size stats"""
+    if engine is None:
+        return jsonify({'error': 'Service not ready'}), 503
+    return jsonify(engine.stats())
+
+@app.route('/stats/cache')
+def cache_stats():
+    """LLM response cache hit/miss counters"""
+    return jsonify(response_cache.stats())
+
+@app.route('/stats/openai')
+def openai_stats():
+    """Upstream OpenAI call, retry and coalescing counters for this worker"""
+    return jsonify(openai_client.stats())
+
+@app.route('/stats/prediction-cache')
+def prediction_cache_stats():
+    """Prediction cache hit/miss counters for this worker"""
+    if prediction_cache is None:
+        return jsonify({'error': 'Service not ready'}), 503
+    return jsonify(prediction_cache.stats())
+
+@app.route('/stats/catalog')
+def catalog_stats():
+    """Active product catalog version and the last hot-reload summary"""
+    if searcher is None:
+        return jsonify({'error': 'Service not ready'}), 503
+    return jsonify(searcher.stats())
+
+@app.route('/stats/memory')
+def memory_stats():
+    """RSS/PSS of the worker process that served this request"""
+    return jsonify(process_memory())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Request counters, stage error counters and latency histograms in Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/stats/stages')
+def stage_stats():
+    """Estimated p50/p90/p99 latency per pipeline stage from the /metrics histograms"""
+    return jsonify(metrics.stage_summary())
+
+def validate_upload(file, extensions=IMAGE_EXTENSIONS):
+    # Contents of one uploaded file, or a JSON error response when it is unnamed, of the wrong type, empty or too large
+    if not file.filename:
+        return None, (jsonify({'error': 'No file selected'}), 400)
+    
+    if not file.filename.lower().endswith(extensions):
+        return None, (jsonify({'error': f'Invalid file type: {file.filename}'}), 400)
+    
+    # Read at most one byte past the limit, so an oversized part is never held in memory whole
+    max_size = app.config['MAX_CONTENT_LENGTH']
+    data = file.read(max_size + 1)
+    if len(data) > max_size:
+        return None, file_too_large(None)
+    if not data:
+        return None, (jsonify({'error': f'Empty file: {file.filename}'}), 400)
+    return data, None
+
+def read_upload(field='image', extensions=IMAGE_EXTENSIONS):
+    # Contents of the single file uploaded as field, or a JSON error response
+    try:
+        if field not in request.files:
+            return None, (jsonify({'error': f'No {field} provided'}), 400)
+        return validate_upload(request.files[field], extensions)
+    except RequestEntityTooLarge as e:
+        # Parsing the form hits MAX_CONTENT_LENGTH before any route-level handler could see it
+        return None, file_too_large(e)
+
+def read_uploads(field='images', extensions=IMAGE_EXTENSIONS):
+    # Contents of every file uploaded as field, or a JSON error response for the first invalid one
+    try:
+        files = request.files.getlist(field)
+        if not files:
+            return None, (jsonify({'error': f'No {field} provided'}), 400)
+        uploads = []
+        for file in files:
+            data, error = validate_upload(file, extensions)
+            if error is not None:
+                return None, error
+            uploads.append(data)
+        return uploads, None
+    except RequestEntityTooLarge as e:
+        return None, file_too_large(e)
 
 @app.route('/')
 def index():
@@ -95,71 +288,266 @@ def predict():
         if not models_loaded:
             return jsonify({'error': 'Service not ready'}), 503
             
-        if 'image' not in request.files:
-            return jsonify({'error': 'No image provided'}), 400
+        # Decode the upload straight from memory
+        image_bytes, error = read_upload()
+        if error is not None:
+            return error
         
-        file = request.files['image']
-        if not file.filename:
-            return jsonify({'error': 'No file selected'}), 400
+        # Opt-in profiling runs every stage in this thread, outside the batching engine and the
+        # async pipeline, so the Python and torch profilers see all of it
+        with maybe_profile('predict', should_profile(request.headers.get('X-Profile-Token'))) as profile:
+            if profile is not None:
+                prediction_result, pipeline_result = run_inline(image_bytes)
+            else:
+                # Predict, then recommendations, concurrent product searches and daily plan, each with a timeout
+                prediction_result = predictor.predict(image_bytes)
+                if 'error' not in prediction_result:
+                    pipeline_result = pipeline.run(prediction_result['severity'])
         
-        if not file.filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-            return jsonify({'error': 'Invalid file type'}), 400
+        if 'error' in prediction_result:
+            return jsonify({'error': prediction_result['error']}), 400
         
-        # Process image
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-            file.save(tmp_file.name)
-            temp_path = tmp_file.name
+        recommendations = pipeline_result['recommendations']
+        if recommendations is not None and recommendations.startswith("Error"):
+            return jsonify({'error': 'Recommendation failed'}), 400
         
-        try:
-            # Predict
-            prediction_result = predictor.predict(temp_path)
-            if 'error' in prediction_result:
-                return jsonify({'error': prediction_result['error']}), 400
+        # Format product results
+        formatted_results = searcher.format_search_results(pipeline_result['products'])
+        
+        result = {
+            'prediction': {
+                'severity': prediction_result['severity'],
+                'confidence': round(prediction_result['confidence'], 4)
+            },
+            'recommendations': recommendations,
+            'products': formatted_results,
+            'daily_plan': pipeline_result['daily_plan']
+        }
+        
+        # Stages that timed out are reported so clients know the response is partial
+        if pipeline_result['timed_out']:
+            result['partial'] = True
+            result['timed_out'] = pipeline_result['timed_out']
+        
+        logger.info(f"Prediction successful: {prediction_result['severity']}")
+        response = jsonify(result)
+        if profile is not None:
+            response.headers['X-Profile-Id'] = profile.profile_id
+        return response
             
-            # Get recommendations
-            recommendations = recommender.get_recommendations(prediction_result['severity'])
-            if recommendations.startswith("Error"):
-                return jsonify({'error': 'Recommendation failed'}), 400
+    except Exception as e:
+        logger.error(f"Prediction error: {e}")
+        return jsonify({'error': 'Prediction failed'}), 500
+
+def run_inline(image_bytes):
+    # Classify and recommend one stage after another in the calling thread, for profiled requests
+    inline_predictor = AcnePredictor(
+        model_loader.model,
+        model_loader.processor,
+        model_loader.face_app,
+        model_loader.model_config_dict
+    )
+    prediction_result = inline_predictor.predict(image_bytes)
+    if 'error' in prediction_result:
+        return prediction_result, None
+    
+    severity = prediction_result['severity']
+    pipeline_result = AsyncPipeline.empty_result()
+    pipeline_result['recommendations'] = recommender.get_recommendations(severity)
+    if not pipeline_result['recommendations'].startswith("Error"):
+        parsed = recommender.parse_recommendations(pipeline_result['recommendations'])
+        rag_result = searcher.search_all_categories(parsed, severity, pipeline_result['recommendations'])
+        pipeline_result['products'] = rag_result['products']
+        pipeline_result['daily_plan'] = rag_result['daily_plan']
+    return prediction_result, pipeline_result
+
+def sse_event(event, data):
+    # One Server-Sent Events frame with a JSON payload
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/predict/stream', methods=['POST'])
+def predict_stream():
+    """Same as /predict, but streamed as Server-Sent Events while each stage finishes"""
+    try:
+        if not models_loaded:
+            return jsonify({'error': 'Service not ready'}), 503
             
-            # RAG Search: Get products and daily plan together
-            parsed_recommendations = recommender.parse_recommendations(recommendations)
-            rag_results = searcher.search_all_categories(
-                parsed_recommendations,
-                severity=prediction_result['severity'],
-                recommendations_text=recommendations
-            )
+        image_bytes, error = read_upload()
+        if error is not None:
+            return error
+        
+        # Classification errors are still plain JSON errors, since nothing has been streamed yet
+        prediction_result = predictor.predict(image_bytes)
+        if 'error' in prediction_result:
+            return jsonify({'error': prediction_result['error']}), 400
+        
+    except Exception as e:
+        logger.error(f"Prediction error: {e}")
+        return jsonify({'error': 'Prediction failed'}), 500
+    
+    severity = prediction_result['severity']
+    
+    def generate():
+        timed_out = []
+        yield sse_event('prediction', {
+            'severity': severity,
+            'confidence': round(prediction_result['confidence'], 4)
+        })
+        try:
+            for event, data in pipeline.stream(severity):
+                if event == 'recommendations':
+                    yield sse_event('recommendations', {'text': data})
+                elif event == 'products':
+                    category, products = data
+                    yield sse_event('products', {
+                        'category': category,
+                        'text': searcher.format_search_results({category: products})
+                    })
+                elif event == 'daily_plan':
+                    yield sse_event('daily_plan', {'delta': data})
+                elif event == 'timeout':
+                    timed_out.append(data)
+                    yield sse_event('timeout', {'stage': data})
+                else:
+                    yield sse_event('error', {'error': data})
+            logger.info(f"Streamed prediction successful: {severity}")
+        except Exception as e:
+            logger.error(f"Streaming prediction error: {e}")
+            yield sse_event('error', {'error': 'Prediction failed'})
+        yield sse_event('done', {'partial': bool(timed_out), 'timed_out': timed_out})
+    
+    # Disable proxy buffering so each event reaches the browser as soon as it is written
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/predict/faces', methods=['POST'])
+def predict_faces():
+    """Classify every face in one uploaded image (e.g. a group photo) in one batched pass"""
+    try:
+        if not models_loaded:
+            return jsonify({'error': 'Service not ready'}), 503
             
-            # Format product results
-            formatted_results = searcher.format_search_results(rag_results['products'])
+        image_bytes, error = read_upload()
+        if error is not None:
+            return error
+        
+        # Clients may tighten the limits but not exceed the configured maximum face count
+        try:
+            min_size = int(request.form.get('min_size', MULTI_FACE_MIN_SIZE))
+            max_count = min(int(request.form.get('max_count', MULTI_FACE_MAX_COUNT)), MULTI_FACE_MAX_COUNT)
+        except ValueError:
+            return jsonify({'error': 'min_size and max_count must be integers'}), 400
+        if min_size < 0 or max_count < 1:
+            return jsonify({'error': 'min_size must be at least 0 and max_count at least 1'}), 400
+        
+        prediction_result = predictor.predict_faces(image_bytes, min_size=min_size, max_count=max_count)
+        if 'error' in prediction_result:
+            return jsonify({'error': prediction_result['error']}), 400
+        
+        faces = [
+            {
+                'bbox': face['bbox'],
+                'severity': face['severity'],
+                'confidence': round(face['confidence'], 4),
+                'detection_score': round(face['det_score'], 4)
+            }
+            for face in prediction_result['faces']
+        ]
+        
+        logger.info(f"Multi-face prediction successful for {len(faces)} face(s)")
+        return jsonify({'face_count': len(faces), 'faces': faces})
+        
+    except Exception as e:
+        logger.error(f"Multi-face prediction error: {e}")
+        return jsonify({'error': 'Prediction failed'}), 500
+
+@app.route('/predict/video', methods=['POST'])
+def predict_video():
+    """Estimate severity from a short video clip, tracking the face between detector runs"""
+    try:
+        if not models_loaded:
+            return jsonify({'error': 'Service not ready'}), 503
             
-            result = {
-                'prediction': {
+        video_bytes, error = read_upload('video', VIDEO_EXTENSIONS)
+        if error is not None:
+            return error
+        
+        # OpenCV only decodes video from a file, so the upload is spooled to a temporary one
+        extension = os.path.splitext(request.files['video'].filename.lower())[1]
+        with tempfile.NamedTemporaryFile(suffix=extension) as video_file:
+            video_file.write(video_bytes)
+            video_file.flush()
+            prediction_result = analyze_video(video_file.name, predictor)
+        
+        if 'error' in prediction_result:
+            return jsonify({'error': prediction_result['error']}), 400
+        
+        result = {
+            'prediction': {
+                'severity': prediction_result['severity'],
+                'confidence': round(prediction_result['confidence'], 4),
+                'agreement': round(prediction_result['agreement'], 4),
+                'probabilities': {severity: round(p, 4) for severity, p in prediction_result['probabilities'].items()}
+            },
+            'frames': [
+                {
+                    'frame': sample['frame'],
+                    'timestamp': round(sample['timestamp'], 3) if sample['timestamp'] is not None else None,
+                    'severity': sample['severity'],
+                    'confidence': round(sample['confidence'], 4)
+                }
+                for sample in prediction_result['samples']
+            ],
+            'stats': prediction_result['stats']
+        }
+        
+        logger.info(f"Video prediction successful: {prediction_result['severity']}")
+        return jsonify(result)
+        
+    except Exception as e:
+        logger.error(f"Video prediction error: {e}")
+        return jsonify({'error': 'Prediction failed'}), 500
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """Classify several uploaded images in one batched pass"""
+    try:
+        if not models_loaded:
+            return jsonify({'error': 'Service not ready'}), 503
+        
+        images, error = read_uploads()
+        if error is not None:
+            return error
+        
+        files = request.files.getlist('images')
+        prediction_results = predictor.predict_batch(images)
+        
+        results = []
+        for file, prediction_result in zip(files, prediction_results):
+            if 'error' in prediction_result:
+                results.append({'filename': file.filename, 'error': prediction_result['error']})
+            else:
+                results.append({
+                    'filename': file.filename,
                     'severity': prediction_result['severity'],
                     'confidence': round(prediction_result['confidence'], 4)
-                },
-                'recommendations': recommendations,
-                'products': formatted_results,
-                'daily_plan': rag_results['daily_plan']
-            }
-            
-            logger.info(f"Prediction successful: {prediction_result['severity']}")
-            return jsonify(result)
-            
-        finally:
-            # Clean up
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
-            
+                })
+        
+        logger.info(f"Batch prediction completed for {len(files)} images")
+        return jsonify({'predictions': results})
+        
     except Exception as e:
-        logger.error(f"Prediction error: {e}")
+        logger.error(f"Batch prediction error: {e}")
         return jsonify({'error': 'Prediction failed'}), 500
 
 if __name__ == '__main__':
     logger.info("Starting production app...")
     
-    if not init_models():
-        logger.error("Failed to initialize models")
-        sys.exit(1)
+    # Serve /health immediately and load models in the background
+    init_models_in_background()
     
     # Production settings
     port = int(os.getenv('PORT', 5000))
@@ -0,0 +1,40 @@
+# Pre-fork server config: gunicorn -c gunicorn.conf.py app:app (run from web/)
+# The master loads ViT weights, the product catalog and the embedding index once;
+# forked workers share those pages copy-on-write and build their own sessions and threads.
+import gc
+import os
+from multiprocessing import cpu_count
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WORKERS', '2'))
+
+# Request threads per worker let concurrent requests share one batched forward pass
+worker_class = 'gthread'
+threads = int(os.getenv('WORKER_REQUEST_THREADS', '4'))
+timeout = int(os.getenv('WORKER_TIMEOUT', '120'))
+
+# Import the app in the master so shared state is loaded before forking
+preload_app = True
+
+# torch/onnxruntime compute threads per worker, split so workers do not oversubscribe cores
+compute_threads = int(os.getenv('WORKER_COMPUTE_THREADS', str(max(1, cpu_count() // workers))))
+
+
+def on_starting(server):
+    import app as web_app
+
+    # Worker metric snapshots from a previous run would otherwise be summed into /metrics
+    web_app.metrics.clear_files()
+    web_app.load_shared_state()
+
+    # Move loaded objects out of the GC's reach so collections in workers do not dirty shared pages
+    gc.collect()
+    gc.freeze()
+    server.log.info(f"Shared state loaded in master (pid {os.getpid()}), forking {workers} workers")
+
+
+def post_fork(server, worker):
+    import app as web_app
+
+    web_app.init_worker(threads=compute_threads)
+    server.log.info(f"Worker {worker.pid} ready with {compute_threads} compute threads")